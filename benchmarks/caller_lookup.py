@@ -0,0 +1,41 @@
+"""
+Benchmark of the caller lookups of common.utils (get_caller_logger, FileOperations.assert_type) against the former
+    inspect.stack() implementation, 20 frames deep.
+Run from the repository root: python benchmarks/caller_lookup.py
+"""
+import inspect
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.utils import get_caller_logger  # noqa: E402
+from common.utils.file_ops import FileOperations  # noqa: E402
+
+DEPTH = 20
+default_logger = logging.getLogger('common.utils.logged_requests')
+
+
+def inspect_stack_logger(stack_depth=1, default_logger=None):
+    # the former implementation, reading the frame info & source lines of the whole stack
+    caller_file = inspect.stack()[stack_depth + 1].filename.replace('{}/'.format(os.getcwd()), '')
+    return logging.getLogger(caller_file) if caller_file else default_logger
+
+
+def nested(depth, func):
+    if depth:
+        return nested(depth - 1, func)
+    return func()
+
+
+def measure(name, func, number):
+    seconds = min(timeit.repeat(lambda: nested(DEPTH, func), number=number, repeat=5))
+    print('{:<32} {:>10.2f} us per call'.format(name, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    measure('inspect.stack() logger', lambda: inspect_stack_logger(default_logger=default_logger), 200)
+    measure('get_caller_logger', lambda: get_caller_logger(default_logger=default_logger), 20000)
+    measure('assert_type', lambda: FileOperations.assert_type('path', 'value'), 20000)
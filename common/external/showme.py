@@ -5,6 +5,8 @@ from time import time as now
 from colorama import *
 from decorator import decorator
 
+from common.utils import get_func_scope
+
 # Source: https://github.com/kennethreitz/showme
 # Modified to support Python 3
 
@@ -73,15 +75,4 @@ def trace(f, *args, **kwargs):
 def _get_scope(f, args):
     """Get scope nameo of given function."""
 
-    _scope = inspect.getmodule(f).__name__
-    # guess that function is a method of it's class
-    try:
-        if f.__name__ in dir(args[0].__class__):
-            _scope += '.' + args[0].__class__.__name__
-            _scope += '.' + f.__name__
-        else:
-            _scope += '.' + f.__name__
-    except IndexError:
-        _scope += '.' + f.__name__
-
-    return _scope
+    return get_func_scope(f, args)
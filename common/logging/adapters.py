@@ -1,33 +1,68 @@
 import logging
 
-from .builders import MessageBuilder
+from .builders import JSONMessageBuilder, MessageBuilder
 from .mixins import LoggingHelperMixin
 
 __all__ = ['MessageAdapter', 'StrictMessageAdapter', 'LoggingAdapter', 'StrictLoggingAdapter']
 
 
 class MessageAdapter(logging.LoggerAdapter):
-    def __init__(self, logger, *args, **kwargs):
+    """
+    Logs the messages as per the message types. Set structured (by default, the LOGGING_MESSAGE_MODE django setting
+        set to 'json') to log every message type as a single json object instead of its text format.
+    """
+
+    def __init__(self, logger, *args, structured=None, **kwargs):
         self.kwargs = dict()
+        if structured is None:
+            from django.conf import settings
+            structured = settings.configured and getattr(settings, 'LOGGING_MESSAGE_MODE', 'text') == 'json'
+        self.structured = structured
         super(MessageAdapter, self).__init__(logger, {})
 
+    def log(self, level, message=None, *args, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        message = self.process(message, kwargs)
+        self.logger.log(level, message)
+
     def info(self, message=None, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         message = self.process(message, kwargs)
         self.logger.info(message)
 
     def debug(self, message=None, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
         message = self.process(message, kwargs)
         self.logger.debug(message)
 
     def exception(self, message=None, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.ERROR):
+            return
         message = self.process(message, kwargs)
         self.logger.exception(message)
 
     def process(self, message, kwargs):
         message_type = kwargs.pop('message_type')
-        self.kwargs = kwargs
         message_builder = getattr(message_type, 'builder', MessageBuilder)
-        return message_builder(message, message_type, self, **kwargs)
+        if self.structured and message_builder is MessageBuilder:
+            message_builder = JSONMessageBuilder
+        return message_builder(message, message_type, self.for_record(kwargs), **kwargs)
+
+    def for_record(self, kwargs):
+        """
+        Get a copy of the adapter holding the kwargs of one log record. The adapters are shared across threads
+            (e.g. module level adapters) & the message is built lazily, so the kwargs are never set on the adapter
+            itself.
+        :param kwargs: the kwargs of the log record
+        :return: the adapter copy
+        """
+        record_adapter = object.__new__(self.__class__)
+        record_adapter.__dict__.update(self.__dict__)
+        record_adapter.kwargs = kwargs
+        return record_adapter
 
 
 class StrictMessageAdapter(MessageAdapter):
@@ -0,0 +1,271 @@
+import gzip
+import json
+import re
+from datetime import datetime, timezone
+
+from . import message_types
+from .builders import MessageTemplate
+from .metrics import LatencyHistogram
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ['LogAnalyzer']
+
+
+class LogStats:
+    """
+    Throughput, errors & latency histogram of the requests of a path or an api action
+    """
+    __slots__ = ('count', 'client_errors', 'server_errors', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.client_errors = 0
+        self.server_errors = 0
+        self.histogram = LatencyHistogram()
+
+    def record(self, status, processing_time=None):
+        self.count += 1
+        if status >= 500:
+            self.server_errors += 1
+        elif status >= 400:
+            self.client_errors += 1
+        if processing_time is not None:
+            self.histogram.record(processing_time * 1000000)
+
+    def merge(self, other):
+        self.count += other.count
+        self.client_errors += other.client_errors
+        self.server_errors += other.server_errors
+        self.histogram.merge(other.histogram)
+        return self
+
+
+class LogAnalyzer:
+    """
+    Streams the log files written with the common.logging message types & aggregates the requests per path (SYSTEM_OUT
+        lines, with latency percentiles) & per api action (API_OUT lines) over time windows.
+    Log files are read line by line (gzip & zstd compressed files too), so the memory used does not depend on the
+        size of the files. Supports the 'verbose' text format of the LOGGING settings & the JSONFormatter lines.
+    """
+
+    # [18/Oct/2017 10:00:00] INFO [dummy_app.views:12 in list] SYSTEM_OUT /dummy/logging/ 200 0.0123 ...
+    header_pattern = re.compile(r'^\[(?P<time>[^\]]+)\] (?P<level>[A-Z]+) (?:\[[^\]]*\] )?(?P<message>.*)$')
+    time_format = '%d/%b/%Y %H:%M:%S'
+
+    # Fields after which the rest of a message is not parsed
+    data_keys = ('request_data', 'response_data', 'message')
+
+    # Formats of older versions of the message types, still parsed
+    legacy_formats = [
+        'SYSTEM_OUT {request_path} {response_code} {processing_time}',
+    ]
+
+    # Continuation lines of a record kept for parsing, at most this long
+    max_continuation_length = 4096
+
+    def __init__(self, window=None):
+        """
+        :param window: the length of the time windows in seconds. None for a single window over all the lines
+        """
+        self.window = window
+        # (window start, 'path' or 'action', key) -> LogStats
+        self.stats = {}
+        self.lines = 0
+        self.unparsed = 0
+        self._time_cache = (None, None)
+        self.patterns = {}
+        for message_type in (getattr(message_types, name) for name in message_types.__all__):
+            self.add_pattern(message_type.template)
+        for legacy_format in self.legacy_formats:
+            self.add_pattern(MessageTemplate(legacy_format, 'message'))
+
+    def add_pattern(self, template):
+        """
+        Compile the message type template into a regex matching the fields up to the first data field
+        """
+        parts = ['^']
+        for literal, key, _, _, _ in template.chunks:
+            parts.append(re.escape(literal))
+            if key is None:
+                continue
+            if key in self.data_keys:
+                break
+            parts.append('(?P<{}>.*?)'.format(key))
+        else:
+            parts.append('$')
+        self.patterns.setdefault(template.name, []).append(re.compile(''.join(parts), re.DOTALL))
+
+    @classmethod
+    def open_file(cls, path):
+        if path.endswith('.gz'):
+            return gzip.open(path, 'rt', errors='replace')
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise ValueError('zstandard is required for reading {}'.format(path))
+            import io
+            return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')), errors='replace')
+        return open(path, 'r', errors='replace')
+
+    def analyze_file(self, path):
+        with self.open_file(path) as file_obj:
+            record = None
+            for line in file_obj:
+                self.lines += 1
+                line = line.rstrip('\n')
+                if line.startswith('{'):
+                    self.flush(record)
+                    record = None
+                    self.parse_json(line)
+                    continue
+
+                match = self.header_pattern.match(line)
+                if match:
+                    self.flush(record)
+                    record = [match.group('time'), match.group('message')]
+                elif record is not None and len(record) < 3:
+                    # only the first continuation line is needed (api_action of the *_WITH_DATA message types)
+                    record.append(line[:self.max_continuation_length])
+            self.flush(record)
+        return self
+
+    def flush(self, record):
+        if record is None:
+            return
+        timestamp = self.parse_time(record[0])
+        message = '\n'.join(record[1:])
+        type_name = message.split(' ', 1)[0]
+        for pattern in self.patterns.get(type_name, []):
+            match = pattern.match(message)
+            if match:
+                self.record(type_name, timestamp, match.groupdict())
+                return
+        if type_name in self.patterns:
+            self.unparsed += 1
+
+    def parse_json(self, line):
+        try:
+            data = json.loads(line)
+        except ValueError:
+            self.unparsed += 1
+            return
+        if data.get('type') not in self.patterns:
+            return
+        timestamp = self.parse_time(data.get('time'), json_time=True)
+        self.record(data['type'], timestamp, {
+            'request_path': data.get('path'),
+            'response_code': data.get('status'),
+            'processing_time': data.get('processing_time'),
+            'api_action': data.get('api_action'),
+        })
+
+    def parse_time(self, value, json_time=False):
+        """
+        :return: the epoch seconds of the log time, None if not parsable. The last value is cached, as consecutive
+            lines mostly have the same time.
+        """
+        if self._time_cache[0] == value:
+            return self._time_cache[1]
+        try:
+            if json_time:
+                # logging.Formatter default time format e.g. 2017-10-18 10:00:00,123
+                parsed = datetime.strptime(value.split(',')[0], '%Y-%m-%d %H:%M:%S')
+            else:
+                parsed = datetime.strptime(value, self.time_format)
+            timestamp = parsed.replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            timestamp = None
+        self._time_cache = (value, timestamp)
+        return timestamp
+
+    def record(self, type_name, timestamp, fields):
+        try:
+            status = int(fields.get('response_code'))
+        except (TypeError, ValueError):
+            return
+
+        window_start = None
+        if self.window and timestamp is not None:
+            window_start = int(timestamp // self.window * self.window)
+
+        if type_name == 'SYSTEM_OUT':
+            try:
+                processing_time = float(fields.get('processing_time'))
+            except (TypeError, ValueError):
+                processing_time = None
+            key = (window_start, 'path', fields.get('request_path'))
+            self.stats.setdefault(key, LogStats()).record(status, processing_time)
+        elif type_name in ('API_OUT', 'API_OUT_WITH_DATA'):
+            key = (window_start, 'action', fields.get('api_action'))
+            self.stats.setdefault(key, LogStats()).record(status)
+
+    def merge(self, other):
+        for key, stats in other.stats.items():
+            if key in self.stats:
+                self.stats[key].merge(stats)
+            else:
+                self.stats[key] = stats
+        self.lines += other.lines
+        self.unparsed += other.unparsed
+        return self
+
+    @classmethod
+    def analyze_files(cls, paths, window=None, workers=1):
+        """
+        Analyze the log files, in parallel worker processes if workers > 1
+        :return: the LogAnalyzer with the merged stats of all the files
+        """
+        analyzer = cls(window=window)
+        if workers <= 1 or len(paths) <= 1:
+            for path in paths:
+                analyzer.analyze_file(path)
+            return analyzer
+
+        from multiprocessing import Pool
+        with Pool(processes=min(workers, len(paths))) as pool:
+            for file_analyzer in pool.imap_unordered(_analyze_file, [(path, window) for path in paths]):
+                analyzer.merge(file_analyzer)
+        return analyzer
+
+    def rows(self):
+        """
+        The report rows, ordered by window & then request count
+        :return: list of dicts
+        """
+        rows = []
+        for (window_start, kind, key), stats in self.stats.items():
+            histogram = stats.histogram
+            row = {
+                'window': datetime.fromtimestamp(window_start, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                if window_start is not None else 'all',
+                'kind': kind,
+                'key': key,
+                'count': stats.count,
+                'rps': round(stats.count / float(self.window), 3) if self.window else None,
+                'client_errors': stats.client_errors,
+                'server_errors': stats.server_errors,
+                'error_rate': round(stats.server_errors / float(stats.count), 4) if stats.count else 0,
+                'p50_ms': None,
+                'p90_ms': None,
+                'p99_ms': None,
+                'max_ms': None,
+            }
+            if histogram.count:
+                row.update({
+                    'p50_ms': round(histogram.percentile(50) / 1000.0, 1),
+                    'p90_ms': round(histogram.percentile(90) / 1000.0, 1),
+                    'p99_ms': round(histogram.percentile(99) / 1000.0, 1),
+                    'max_ms': round(histogram.max / 1000.0, 1),
+                })
+            rows.append(row)
+
+        rows.sort(key=lambda row: (row['window'], row['kind'], -row['count']))
+        return rows
+
+
+def _analyze_file(args):
+    path, window = args
+    return LogAnalyzer(window=window).analyze_file(path)
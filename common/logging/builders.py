@@ -1,5 +1,152 @@
+import re
 import string
 
+from .serializers import get_serializer, sort_keys_enabled
+
+FIELD_PATH_PATTERN = re.compile(r'(?:\.[^.\[]+|\[[^\]]+\])*')
+FIELD_PATH_PART_PATTERN = re.compile(r'\.([^.\[]+)|\[([^\]]+)\]')
+
+
+def split_field_name(field_name):
+    """
+    Split a format field name the way str.format does
+    :param field_name: the field name e.g. 'request.META[REMOTE_ADDR]'
+    :return: (key, list of (is_attr, attribute name or item)) e.g.
+        ('request', [(True, 'META'), (False, 'REMOTE_ADDR')]). Numeric keys & items are ints
+    """
+    key, field_path = re.match(r'([^.\[]*)(.*)', field_name, re.DOTALL).groups()
+    if not FIELD_PATH_PATTERN.fullmatch(field_path):
+        raise ValueError('Invalid format field name {!r}'.format(field_name))
+    parts = []
+    for attribute, item in FIELD_PATH_PART_PATTERN.findall(field_path):
+        if attribute:
+            parts.append((True, attribute))
+        else:
+            parts.append((False, int(item) if item.isdigit() else item))
+    return int(key) if key.isdigit() else key, parts
+
+
+class MessageTemplate:
+    """
+    A message type format compiled into a fixed list of literal chunks & field getters.
+    Compiled once when the message type is defined, so that building a log message does not re-parse the format
+    string or resolve the adapter getters by name for every record.
+    """
+
+    # Field getter used when the adapter does not define a get_<key> function; the value is read from the kwargs
+    KWARGS_GETTER = None
+
+    def __init__(self, format_string, message_key_name):
+        self.format_string = format_string
+        # The message type name is the leading word of the format e.g. SYSTEM_OUT
+        self.name = format_string.split(' ', 1)[0].split('\n', 1)[0]
+        # list of (literal, key, field_path, conversion, format_spec) tuples; key is None for trailing literals
+        self.chunks = []
+        # unique field keys in the order of their first occurrence
+        self.keys = []
+        self.message_key_name = message_key_name
+        # (adapter class, getter prefixes) -> tuple of unbound getters, aligned with self.keys
+        self._getters_cache = {}
+
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(format_string):
+            if field_name is None:
+                self.chunks.append((literal, None, (), None, ''))
+                continue
+
+            key, field_path = split_field_name(field_name)
+            if isinstance(key, int) or key == '':
+                # positional fields are not supported by message types & always render as empty strings
+                self.chunks.append((literal, None, (), None, ''))
+                continue
+
+            if key not in self.keys:
+                self.keys.append(key)
+            self.chunks.append((literal, key, tuple(field_path), conversion, format_spec or ''))
+
+    def __repr__(self):
+        return 'MessageTemplate({!r})'.format(self.format_string)
+
+    def getters(self, adapter_class, getter_prefixes=('get_',)):
+        """
+        Resolve the adapter getter functions for each field key of the template, cached per adapter class
+        :param adapter_class: the class of the logging adapter used for building the message
+        :param getter_prefixes: the getter name prefixes to look up, in order of preference
+        :return: tuple of unbound getter functions (or KWARGS_GETTER), aligned with self.keys
+        """
+        cache_key = (adapter_class, getter_prefixes)
+        try:
+            return self._getters_cache[cache_key]
+        except KeyError:
+            pass
+
+        getters = []
+        for key in self.keys:
+            getter = self.KWARGS_GETTER
+            if key != self.message_key_name:
+                for prefix in getter_prefixes:
+                    getter = getattr(adapter_class, prefix + key.lower(), self.KWARGS_GETTER)
+                    if getter is not self.KWARGS_GETTER:
+                        break
+            getters.append(getter)
+
+        getters = tuple(getters)
+        self._getters_cache[cache_key] = getters
+        return getters
+
+    def resolve(self, builder):
+        """
+        Resolve the value of every field key of the template for one log record. Each getter is run only once.
+        :param builder: the message builder of the log record
+        :return: dict of field key -> value
+        """
+        adapter = builder.message_adapter
+        values = {}
+        for key, getter in zip(self.keys, self.getters(adapter.__class__, builder.GETTER_PREFIXES)):
+            if key == self.message_key_name:
+                values[key] = builder.message if builder.message else ''
+                continue
+
+            if getter is not self.KWARGS_GETTER:
+                try:
+                    values[key] = getter(adapter)
+                    continue
+                except AttributeError:
+                    pass
+            values[key] = builder.kwargs.get(key, adapter.DEFAULT_VALUE)
+
+        return values
+
+    def render(self, values):
+        """
+        Render the template with the resolved field values
+        :param values: dict of field key -> value as returned by resolve
+        :return: the formatted message string
+        """
+        parts = []
+        for literal, key, field_path, conversion, format_spec in self.chunks:
+            if literal:
+                parts.append(literal)
+            if key is None:
+                continue
+
+            value = values[key]
+            for is_attr, item in field_path:
+                value = getattr(value, item) if is_attr else value[item]
+
+            if conversion == 's':
+                value = str(value)
+            elif conversion == 'r':
+                value = repr(value)
+            elif conversion == 'a':
+                value = ascii(value)
+
+            if format_spec:
+                parts.append(format(value, format_spec))
+            else:
+                parts.append(value if type(value) is str else str(value))
+
+        return ''.join(parts)
+
 
 class MessageBuilder(string.Formatter):
     """
@@ -10,18 +157,55 @@ class MessageBuilder(string.Formatter):
     # For other items, getters would be defined e.g. request_data would have a function get_request_data in subclass
     MESSAGE_KEY_NAME = 'message'
 
+    # The adapter getters are looked up as <prefix><key>
+    GETTER_PREFIXES = ('get_',)
+
+    # Whether the built message is a serialized json object
+    structured = False
+
+    # (builder class, format string) -> compiled template, for message types not created through
+    # message_types.MESSAGE_TYPE
+    _templates = {}
+
     def __init__(self, message, message_type, adapter, *args, **kwargs):
         # The message string to be logged
         self.message = message
         # The contextual message format to be used for generating log message
         self.message_type_format = message_type.format
+        # The compiled form of the message format
+        self.message_template = getattr(message_type, 'template', None) or self.compile(message_type.format)
         # The logging adapter to be used for specifying contextual information in logging output
         self.message_adapter = adapter
         self.args = args
         self.kwargs = kwargs
+        # The message is built lazily & only once, even when the record is formatted by several handlers
+        self._message_string = None
 
     def __str__(self):
-        return self.format(self.message_type_format)
+        if self._message_string is None:
+            if type(self).get_value is not MessageBuilder.get_value:
+                # builders customising get_value keep going through the string.Formatter path
+                self._message_string = self.format(self.message_type_format)
+            else:
+                template = self.message_template
+                self._message_string = template.render(template.resolve(self))
+        return self._message_string
+
+    @classmethod
+    def compile(cls, message_type_format):
+        """
+        Compile the message type format into a MessageTemplate. Templates are cached by the builder class & the format
+            string, as they depend on the MESSAGE_KEY_NAME of the builder.
+        :param message_type_format: the format string of the message type
+        :return: the MessageTemplate object
+        """
+        key = (cls, message_type_format)
+        try:
+            return cls._templates[key]
+        except KeyError:
+            template = MessageTemplate(message_type_format, cls.MESSAGE_KEY_NAME)
+            cls._templates[key] = template
+            return template
 
     def get_value(self, key, args, kwargs):
         if isinstance(key, int):
@@ -34,3 +218,39 @@ class MessageBuilder(string.Formatter):
             return getattr(self.message_adapter, 'get_%s' % key.lower())()
         except AttributeError:
             return self.kwargs.get(key, self.message_adapter.DEFAULT_VALUE)
+
+
+class JSONMessageBuilder(MessageBuilder):
+    """
+    Builds the log message as a single json object with typed fields, instead of the free text message type format.
+    The field values are taken from the get_structured_<key> getters of the adapter if defined, else get_<key>.
+    """
+
+    GETTER_PREFIXES = ('get_structured_', 'get_')
+
+    structured = True
+
+    # message type field key -> json field name
+    FIELD_NAMES = {
+        'request_path': 'path',
+        'request_method': 'method',
+        'request_client_ip': 'client_ip',
+        'request_data': 'request',
+        'response_code': 'status',
+        'response_data': 'response',
+    }
+
+    def __str__(self):
+        if self._message_string is None:
+            self._message_string = get_serializer().dumps(self.as_dict(), sort_keys=sort_keys_enabled())
+        return self._message_string
+
+    def as_dict(self):
+        """
+        The structured log message -- the message type name & the typed fields of the message type
+        """
+        template = self.message_template
+        data = {'type': template.name}
+        for key, value in template.resolve(self).items():
+            data[self.FIELD_NAMES.get(key, key)] = value
+        return data
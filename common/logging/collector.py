@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+
+from .handlers import QueuedHandlerMixin
+
+__all__ = ['LogCollector']
+
+logger = logging.getLogger(__name__)
+
+
+class LogCollector:
+    """
+    Per host log collector process for the queued handlers configured with collector_socket.
+    The workers ship their records over the unix socket & the collector writes them through the handler of the same
+        name in its own logging configuration. As the collector is the only process writing the log files, the file
+        rotation does not race between the workers.
+    Usage: python manage.py run_log_collector --socket /tmp/django_logs/collector.sock
+    """
+
+    # header of every frame -- the length of the json payload
+    header = struct.Struct('>L')
+
+    def __init__(self, socket_path, backlog=128):
+        self.socket_path = socket_path
+        self.backlog = backlog
+        self.server = None
+        self._stopped = threading.Event()
+
+    def serve_forever(self):
+        QueuedHandlerMixin.collector_mode = True
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        # only processes of the same user are allowed to send records
+        os.chmod(self.socket_path, 0o600)
+        self.server.listen(self.backlog)
+        logger.info('Log collector listening on {}'.format(self.socket_path))
+
+        try:
+            while not self._stopped.is_set():
+                try:
+                    conn, _ = self.server.accept()
+                except OSError:
+                    if self._stopped.is_set():
+                        break
+                    raise
+                threading.Thread(target=self.handle_connection, args=(conn,), daemon=True).start()
+        finally:
+            self.server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        self._stopped.set()
+        if self.server is not None:
+            self.server.close()
+
+    def handle_connection(self, conn):
+        with conn:
+            reader = conn.makefile('rb')
+            while True:
+                header = reader.read(self.header.size)
+                if len(header) < self.header.size:
+                    break
+                payload = reader.read(self.header.unpack(header)[0])
+                try:
+                    self.handle_frame(json.loads(payload.decode('utf-8')))
+                except Exception as e:
+                    print('Error handling log record in collector : {}'.format(e))
+
+    def handle_frame(self, frame):
+        """
+        Write the record of a frame through the handler it was sent from
+        :param frame: dict with the handler name & the log record attributes
+        """
+        handler = logging._handlers.get(frame['handler'])
+        if handler is None:
+            return
+
+        record = logging.makeLogRecord(frame['record'])
+        if record.levelno >= handler.level:
+            handler.handle(record)
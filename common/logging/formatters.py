@@ -0,0 +1,42 @@
+import json
+import logging
+
+from .serializers import get_serializer
+
+__all__ = ['JSONFormatter']
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats every log record as a single json object line with the time, level & logger name of the record.
+    The json object messages of the structured logging adapters are merged into the object; other messages (& the
+        structured ones that are not a complete json object) are logged under the message key.
+    """
+
+    def format(self, record):
+        message = record.getMessage()
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+        }
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+
+        structured = getattr(record, 'structured_message', False) or getattr(record.msg, 'structured', False)
+        if structured:
+            try:
+                message_data = json.loads(message)
+            except ValueError:
+                # e.g. truncated as per the max bytes limit
+                message_data = None
+            if isinstance(message_data, dict):
+                # the time, level & logger of the record take precedence over the keys of the message
+                message_data.update(data)
+                return get_serializer().dumps(message_data)
+
+        data['message'] = message
+        return get_serializer().dumps(data)
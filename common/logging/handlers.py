@@ -0,0 +1,502 @@
+import copy
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import struct
+import threading
+import time
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ['QueuedFileHandler', 'QueuedRotatingFileHandler', 'QueuedTimedRotatingFileHandler',
+           'CompressingTimedRotatingFileHandler', 'QueuedCompressingTimedRotatingFileHandler']
+
+OVERFLOW_DROP = 'drop'
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_SAMPLE = 'sample'
+
+
+class QueuedHandlerMixin:
+    """
+    Moves the log I/O off the calling thread. Mix it in before a logging handler class.
+    The calling thread only builds the message & puts the record into a bounded queue. A background listener thread
+        formats & writes the records through the handler (including rotation), or ships them to a log collector
+        process over a unix socket when collector_socket is set.
+    Overflow policies for a full queue:
+        drop -- the record is dropped
+        block -- the calling thread waits for up to block_timeout seconds (forever if None), then drops the record
+        sample -- once the queue is filled beyond sample_threshold, only 1 in sample_rate records below ERROR is kept
+    Dropped records are counted & reported by the listener as a warning line once the queue drains.
+    """
+
+    # Set by the log collector process, so that records received from the workers are written locally
+    collector_mode = False
+
+    # seconds to wait before trying to reconnect to an unreachable log collector
+    collector_retry_interval = 5
+
+    _sentinel = None
+
+    def __init__(self, *args, queue_size=10000, overflow=OVERFLOW_DROP, block_timeout=None, sample_rate=10,
+                 sample_threshold=0.5, collector_socket=None, **kwargs):
+        if collector_socket and not self.collector_mode:
+            # files are only opened if the collector is unreachable
+            kwargs['delay'] = True
+        super(QueuedHandlerMixin, self).__init__(*args, **kwargs)
+
+        assert overflow in (OVERFLOW_DROP, OVERFLOW_BLOCK, OVERFLOW_SAMPLE), 'Invalid overflow policy {}'.format(
+            overflow)
+        self.queue_size = int(queue_size)
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.sample_rate = max(int(sample_rate), 1)
+        self.sample_threshold = int(self.queue_size * float(sample_threshold))
+        self.collector_socket = collector_socket
+
+        self.dropped = 0
+        self._sampled = 0
+        self._reported_dropped = 0
+        # guards the counters, updated by the calling threads & read by the listener
+        self._counters_lock = threading.Lock()
+        self._queue = None
+        self._listener = None
+        self._listener_pid = None
+        self._start_lock = threading.Lock()
+        # held by the listener while writing. The handler lock is not used, as logging.shutdown holds it while flushing
+        self._write_lock = threading.RLock()
+        self._collector_conn = None
+        self._collector_retry_at = 0
+
+    def handle(self, record):
+        """
+        Same as logging.Handler.handle, except that the handler lock is not held by the calling thread
+        """
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        """
+        Resolve everything in the record that refers to request time state, so that the record can be written later
+        from another thread or process
+        :param record: the log record
+        :return: a copy of the record, as the record is shared with the other handlers
+        """
+        record = copy.copy(record)
+        if getattr(record.msg, 'structured', False):
+            record.structured_message = True
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                formatter = self.formatter or logging.Formatter()
+                record.exc_text = formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        record_queue = self.get_queue()
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                record_queue.put(record, timeout=self.block_timeout)
+                return
+
+            if self.overflow == OVERFLOW_SAMPLE and record.levelno < logging.ERROR \
+                    and record_queue.qsize() >= self.sample_threshold:
+                with self._counters_lock:
+                    self._sampled += 1
+                    drop = self._sampled % self.sample_rate
+                    if drop:
+                        self.dropped += 1
+                if drop:
+                    return
+
+            record_queue.put_nowait(record)
+        except queue.Full:
+            with self._counters_lock:
+                self.dropped += 1
+
+    def get_queue(self):
+        """
+        Get the record queue of the current process. The listener thread is started lazily, so that processes forked
+            after the logging setup (e.g. gunicorn workers) get their own listener.
+        """
+        if self._listener_pid != os.getpid():
+            with self._start_lock:
+                if self._listener_pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.queue_size)
+                    self._collector_conn = None
+                    self._listener = threading.Thread(target=self.listen, args=(self._queue,),
+                                                      name='{}-listener'.format(self.__class__.__name__), daemon=True)
+                    self._listener.start()
+                    self._listener_pid = os.getpid()
+        return self._queue
+
+    def listen(self, record_queue):
+        while True:
+            record = record_queue.get()
+            if record is self._sentinel:
+                record_queue.task_done()
+                break
+
+            self.write(record)
+            if self.dropped != self._reported_dropped and record_queue.empty():
+                self.report_dropped()
+            record_queue.task_done()
+
+    def report_dropped(self):
+        with self._counters_lock:
+            dropped = self.dropped - self._reported_dropped
+            self._reported_dropped = self.dropped
+        self.write(logging.makeLogRecord({
+            'name': __name__,
+            'levelno': logging.WARNING,
+            'levelname': logging.getLevelName(logging.WARNING),
+            'msg': '{} dropped {} log records as the log queue was full'.format(self.__class__.__name__, dropped),
+        }))
+
+    def write(self, record):
+        """
+        Write the record from the listener thread -- to the log collector if configured, else through the handler
+        """
+        if self.collector_socket and not self.collector_mode and self.send_to_collector(record):
+            return
+
+        with self._write_lock:
+            super(QueuedHandlerMixin, self).emit(record)
+
+    def send_to_collector(self, record):
+        """
+        Send the record to the log collector as a length prefixed json frame
+        :param record: the prepared log record
+        :return: True if sent, False if the collector is unreachable
+        """
+        if self._collector_conn is None:
+            if time.time() < self._collector_retry_at:
+                return False
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conn.connect(self.collector_socket)
+                self._collector_conn = conn
+            except OSError:
+                conn.close()
+                self._collector_retry_at = time.time() + self.collector_retry_interval
+                return False
+
+        try:
+            payload = json.dumps({'handler': self.name, 'record': record.__dict__}, default=str).encode('utf-8')
+            self._collector_conn.sendall(struct.pack('>L', len(payload)) + payload)
+        except OSError:
+            self._collector_conn.close()
+            self._collector_conn = None
+            self._collector_retry_at = time.time() + self.collector_retry_interval
+            return False
+        return True
+
+    def flush(self):
+        """
+        Wait for the queued records to be written, if the listener thread is running in this process
+        """
+        if self._listener_pid == os.getpid() and threading.current_thread() is self._listener:
+            # the handler lock may be held by logging.shutdown while it waits for this thread in close
+            stream = getattr(self, 'stream', None)
+            if stream and hasattr(stream, 'flush'):
+                stream.flush()
+            return
+        if self._listener_pid == os.getpid() and self._listener.is_alive():
+            self.wait_for_queue()
+        super(QueuedHandlerMixin, self).flush()
+
+    def wait_for_queue(self, timeout=5):
+        """
+        Wait for up to timeout seconds for the listener thread to write all the queued records
+        """
+        end = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < end:
+            time.sleep(0.005)
+
+    def close(self):
+        if self._listener_pid == os.getpid() and self._listener.is_alive():
+            try:
+                self._queue.put(self._sentinel, timeout=5)
+            except queue.Full:
+                pass
+            self._listener.join(timeout=5)
+        self._listener_pid = None
+        if self._collector_conn is not None:
+            self._collector_conn.close()
+            self._collector_conn = None
+        with self._write_lock:
+            super(QueuedHandlerMixin, self).close()
+
+
+class QueuedFileHandler(QueuedHandlerMixin, logging.FileHandler):
+    pass
+
+
+class QueuedRotatingFileHandler(QueuedHandlerMixin, RotatingFileHandler):
+    pass
+
+
+class QueuedTimedRotatingFileHandler(QueuedHandlerMixin, TimedRotatingFileHandler):
+    pass
+
+
+class LogFileMaintainer:
+    """
+    Background thread compressing the rotated log files & enforcing the retention limits of the handlers, so that
+        neither happens on the thread that rotates the file
+    """
+    compressed_extensions = {'gzip': '.gz', 'zstd': '.zst'}
+
+    # bytes read at a time while compressing
+    chunk_size = 1024 * 1024
+
+    # seconds after which the lock file of a compression is taken as left by a crashed process, where flock is not
+    # available
+    stale_lock_seconds = 3600
+
+    def __init__(self):
+        self.tasks = queue.Queue()
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def submit(self, handler):
+        """
+        Schedule the compression of the pending rotated files & the retention of the handler
+        """
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.tasks = queue.Queue()
+                    self.thread = threading.Thread(target=self.run, name='LogFileMaintainer', daemon=True)
+                    self.thread.start()
+                    self.pid = os.getpid()
+        self.tasks.put(handler)
+
+    def run(self):
+        while True:
+            handler = self.tasks.get()
+            try:
+                self.maintain(handler)
+            except Exception as e:
+                print('Error maintaining rotated log files of {} : {}'.format(handler.baseFilename, e))
+
+    def maintain(self, handler):
+        pending = []
+        for path in handler.get_rotated_files():
+            if handler.compression and not path.endswith(tuple(self.compressed_extensions.values())):
+                pending.append(path)
+
+        for path in pending:
+            # other processes may still be writing to a file rotated by another process
+            wait = handler.compress_delay - (time.time() - os.path.getmtime(path))
+            if wait > 0:
+                time.sleep(wait)
+            self.compress(path, handler.compression)
+
+        handler.enforce_retention()
+
+    def lock_compression(self, lock_path):
+        """
+        Take the lock file of a compression. With flock (as in doRollover) the lock is released by the OS if the
+            process dies, else a lock file older than stale_lock_seconds is taken as left by a crashed process.
+        :return: the file descriptor of the lock file, None if another process holds the lock
+        """
+        if fcntl is None:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > self.stale_lock_seconds:
+                    os.remove(lock_path)
+            except OSError:
+                pass
+            try:
+                return os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return None
+
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_WRONLY)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # the lock file may have been removed by the process that held it, after it was opened here
+            if os.fstat(lock_fd).st_ino == os.stat(lock_path).st_ino:
+                return lock_fd
+        except OSError:
+            pass
+        os.close(lock_fd)
+        return None
+
+    def compress(self, path, compression):
+        """
+        Compress the file to <path>.gz/.zst & remove it. A lock file guards against several processes compressing
+            the same file.
+        """
+        target = path + self.compressed_extensions[compression]
+        lock_path = path + '.compressing'
+        lock_fd = self.lock_compression(lock_path)
+        if lock_fd is None:
+            return
+        try:
+            if not os.path.exists(path) or os.path.exists(target):
+                return
+            temp_path = target + '.tmp'
+            with open(path, 'rb') as source:
+                if compression == 'zstd':
+                    if zstandard is None:
+                        raise ValueError('zstandard is required for zstd compression')
+                    with open(temp_path, 'wb') as destination:
+                        zstandard.ZstdCompressor().copy_stream(source, destination, read_size=self.chunk_size)
+                else:
+                    with gzip.open(temp_path, 'wb', compresslevel=6) as destination:
+                        shutil.copyfileobj(source, destination, self.chunk_size)
+            shutil.copystat(path, temp_path)
+            os.replace(temp_path, target)
+            os.remove(path)
+        finally:
+            # removed while locked, so that no other process takes a lock on the removed file
+            os.remove(lock_path)
+            os.close(lock_fd)
+
+
+log_file_maintainer = LogFileMaintainer()
+
+
+class CompressingTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    TimedRotatingFileHandler that compresses the rotated files (gzip or zstd) & enforces the retention limits on a
+        background thread, & that is safe when several processes write to the same log file:
+        -- the rotation takes a lock file & a file already rotated by another process is not rotated (or removed) again
+        -- the rotated files are compressed after compress_delay seconds without writes
+    Retention limits, applied oldest file first:
+        backupCount -- max number of rotated files
+        max_age_days -- max age of the rotated files
+        max_total_bytes -- max total size of the rotated files
+    """
+
+    def __init__(self, *args, compression='gzip', max_age_days=None, max_total_bytes=None, compress_delay=60,
+                 **kwargs):
+        super(CompressingTimedRotatingFileHandler, self).__init__(*args, **kwargs)
+        assert compression in (None, 'gzip', 'zstd'), 'Invalid compression {}'.format(compression)
+        self.compression = compression
+        self.max_age_days = max_age_days
+        self.max_total_bytes = max_total_bytes
+        self.compress_delay = compress_delay
+        self.lock_path = self.baseFilename + '.rotate.lock'
+
+    def rotation_start_time(self):
+        """
+        The start time of the current interval, the time in the name of the rotated file (as in
+            TimedRotatingFileHandler)
+        """
+        current_time = int(time.time())
+        dst_now = time.localtime(current_time)[-1]
+        start = self.rolloverAt - self.interval
+        if self.utc:
+            return time.gmtime(start)
+        time_tuple = time.localtime(start)
+        if dst_now != time_tuple[-1]:
+            time_tuple = time.localtime(start + (3600 if dst_now else -3600))
+        return time_tuple
+
+    def next_rollover(self):
+        """
+        The next rollover time after now (as in TimedRotatingFileHandler)
+        """
+        current_time = int(time.time())
+        dst_now = time.localtime(current_time)[-1]
+        rollover_at = self.computeRollover(current_time)
+        while rollover_at <= current_time:
+            rollover_at += self.interval
+        if (self.when == 'MIDNIGHT' or self.when.startswith('W')) and not self.utc:
+            if dst_now != time.localtime(rollover_at)[-1]:
+                rollover_at += -3600 if not dst_now else 3600
+        return rollover_at
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        rotated_path = self.rotation_filename(
+            '{}.{}'.format(self.baseFilename, time.strftime(self.suffix, self.rotation_start_time())))
+        lock_fd = os.open(self.lock_path, os.O_CREAT | os.O_WRONLY)
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            already_rotated = any(os.path.exists(rotated_path + extension) for extension in
+                                  [''] + list(LogFileMaintainer.compressed_extensions.values()))
+            if not already_rotated:
+                self.rotate(self.baseFilename, rotated_path)
+        finally:
+            os.close(lock_fd)
+
+        if not self.delay:
+            self.stream = self._open()
+        self.rolloverAt = self.next_rollover()
+        log_file_maintainer.submit(self)
+
+    def get_rotated_files(self):
+        """
+        :return: the rotated files of the handler (compressed or not), oldest first
+        """
+        directory, base_name = os.path.split(self.baseFilename)
+        prefix = base_name + '.'
+        rotated_files = []
+        for entry in os.scandir(directory):
+            if not entry.name.startswith(prefix) or not entry.is_file():
+                continue
+            suffix = entry.name[len(prefix):].split('.', 1)[0]
+            if self.extMatch.match(suffix) and not entry.name.endswith(('.tmp', '.compressing', '.lock')):
+                rotated_files.append(entry.path)
+        return sorted(rotated_files)
+
+    def enforce_retention(self):
+        rotated_files = self.get_rotated_files()
+        remove = set()
+
+        if self.backupCount > 0 and len(rotated_files) > self.backupCount:
+            remove.update(rotated_files[:len(rotated_files) - self.backupCount])
+
+        if self.max_age_days is not None:
+            min_mtime = time.time() - self.max_age_days * 86400
+            remove.update(path for path in rotated_files if os.path.getmtime(path) < min_mtime)
+
+        if self.max_total_bytes is not None:
+            kept = [path for path in rotated_files if path not in remove]
+            total = sum(os.path.getsize(path) for path in kept)
+            for path in kept:
+                if total <= self.max_total_bytes:
+                    break
+                total -= os.path.getsize(path)
+                remove.add(path)
+
+        for path in remove:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # removed by another process
+                pass
+
+
+class QueuedCompressingTimedRotatingFileHandler(QueuedHandlerMixin, CompressingTimedRotatingFileHandler):
+    pass
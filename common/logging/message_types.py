@@ -4,16 +4,25 @@ from .builders import MessageBuilder
 
 __all__ = ['SYSTEM_IN', 'SYSTEM_OUT', 'EXCEPTION', 'API_IN_WITH_DATA', 'API_OUT_WITH_DATA', 'API_IN', 'API_OUT']
 
-MESSAGE_TYPE = namedtuple('MESSAGE_TYPE', 'format builder')
 
-MESSAGE_TYPE.__new__.__defaults__ = (MessageBuilder,)
+class MESSAGE_TYPE(namedtuple('MESSAGE_TYPE', 'format builder template')):
+    """
+    Log message type. The format is compiled by the builder into a MessageTemplate once, at definition time.
+    """
+    __slots__ = ()
+
+    def __new__(cls, format, builder=MessageBuilder, template=None):
+        if template is None:
+            template = builder.compile(format)
+        return super(MESSAGE_TYPE, cls).__new__(cls, format, builder, template)
+
 
 SYSTEM_IN = MESSAGE_TYPE(
     format='SYSTEM_IN {request_path}'
 )
 
 SYSTEM_OUT = MESSAGE_TYPE(
-    format='SYSTEM_OUT {request_path} {response_code} {processing_time}'
+    format='SYSTEM_OUT {request_path} {response_code} {processing_time} trace<{trace_id}> spans<{span_summary}>'
 )
 
 EXCEPTION = MESSAGE_TYPE(
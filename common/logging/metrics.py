@@ -0,0 +1,315 @@
+import json
+import os
+import threading
+import time
+
+__all__ = ['LatencyHistogram', 'LatencyMetrics', 'latency_metrics']
+
+
+class LatencyHistogram:
+    """
+    Compact log-linear histogram of latencies in microseconds.
+    Values below 2 * sub_buckets are counted exactly; above that, every power of two range is split into sub_buckets
+        linear buckets, so the relative error of the percentiles is at most 1 / sub_buckets (~6%) at any scale.
+    Only the non empty buckets are stored, & the bucket boundaries are the same everywhere, so histograms of different
+        threads, processes & hosts can be merged by adding up the counts.
+    """
+    sub_bucket_bits = 4
+    sub_buckets = 1 << sub_bucket_bits
+
+    # fixed upper bounds in microseconds of the exported cumulative buckets, the same for every process & host
+    export_bounds = (1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000, 2500000, 5000000,
+                     10000000, 30000000, 60000000)
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        # bucket index -> count
+        self.counts = {}
+        self.count = 0
+        # sum of the values in microseconds
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def bucket_index(cls, value):
+        if value < 2 * cls.sub_buckets:
+            return value
+        bits = value.bit_length()
+        shift = bits - cls.sub_bucket_bits - 1
+        return 2 * cls.sub_buckets + (shift - 1) * cls.sub_buckets + (value >> shift) - cls.sub_buckets
+
+    @classmethod
+    def bucket_bounds(cls, index):
+        """
+        :return: (lowest, highest) value counted in the bucket
+        """
+        if index < 2 * cls.sub_buckets:
+            return index, index
+        shift, top = divmod(index - 2 * cls.sub_buckets, cls.sub_buckets)
+        shift += 1
+        top += cls.sub_buckets
+        return top << shift, ((top + 1) << shift) - 1
+
+    def record(self, value):
+        """
+        Record a latency
+        :param value: the latency in microseconds
+        """
+        value = int(value)
+        if value < 0:
+            value = 0
+        index = self.bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        # copied, as the thread of the other histogram may be adding buckets
+        for index, count in list(other.counts.items()):
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, percent):
+        """
+        Get the latency at the percentile
+        :param percent: the percentile, 0 to 100
+        :return: the highest value of the bucket of the percentile in microseconds, capped at the max recorded value
+        """
+        if not self.count:
+            return 0
+        rank = max(1, int(round(percent / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def cumulative_buckets(self, bounds=None):
+        """
+        :param bounds: the upper bounds in microseconds. Default is export_bounds
+        :return: list of (upper bound, count of values up to it) for every bound, including the empty ones. A value
+            is counted up to a bound if the highest value of its bucket is not above the bound (within the bucket
+            resolution)
+        """
+        buckets = []
+        indexes = sorted(self.counts)
+        position = 0
+        seen = 0
+        for bound in bounds or self.export_bounds:
+            while position < len(indexes) and self.bucket_bounds(indexes[position])[1] <= bound:
+                seen += self.counts[indexes[position]]
+                position += 1
+            buckets.append((bound, seen))
+        return buckets
+
+    def to_dict(self):
+        return {'counts': self.counts, 'count': self.count, 'total': self.total, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.counts = {int(index): count for index, count in data['counts'].items()}
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.max = data['max']
+        return histogram
+
+
+class LatencyMetrics:
+    """
+    In process request latency histograms per (route, status code).
+    Every thread records into its own shard, so recording takes no locks; the shards are merged when read. The shards
+        of the threads that have exited are merged into a retired histogram & dropped.
+    When metrics_dir is set, a background thread writes the snapshot of the process to
+        <metrics_dir>/latency-<pid>.json every dump_interval seconds, so that the metrics of all the worker processes
+        on the host can be collected & merged.
+    """
+
+    file_prefix = 'latency-'
+
+    def __init__(self, metrics_dir=None, dump_interval=10):
+        self.metrics_dir = metrics_dir
+        self.dump_interval = dump_interval
+        self._local = threading.local()
+        # list of (thread, shard)
+        self._shards = []
+        # (route, status) -> histogram merged from the shards of the exited threads
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+        self._dumper_pid = None
+
+    def configure(self, metrics_dir=None, dump_interval=10):
+        self.metrics_dir = metrics_dir
+        self.dump_interval = dump_interval
+
+    def get_shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None or self._local.pid != os.getpid():
+            shard = {}
+            self._local.shard = shard
+            self._local.pid = os.getpid()
+            with self._shards_lock:
+                if self._dumper_pid != os.getpid():
+                    # forked -- the shards of the parent process are not recorded into anymore
+                    self._shards = []
+                    self._retired = {}
+                    self.start_dumper()
+                self.retire_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def retire_shards(self):
+        """
+        Merge the shards of the exited threads into the retired histograms, so that short lived threads do not keep
+            adding shards. Called with the shards lock held.
+        """
+        live_shards = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live_shards.append((thread, shard))
+                continue
+            for key, histogram in shard.items():
+                self._retired.setdefault(key, LatencyHistogram()).merge(histogram)
+        self._shards = live_shards
+
+    def record(self, route, status, seconds):
+        """
+        Record the latency of a request
+        :param route: the resolved url name of the request
+        :param status: the response status code
+        :param seconds: the processing time in seconds
+        """
+        shard = self.get_shard()
+        key = (route, status)
+        histogram = shard.get(key)
+        if histogram is None:
+            histogram = shard[key] = LatencyHistogram()
+        histogram.record(seconds * 1000000)
+
+    def snapshot(self):
+        """
+        :return: dict of (route, status) -> merged histogram of all the threads of this process
+        """
+        merged = {}
+        with self._shards_lock:
+            self.retire_shards()
+            shards = [shard for thread, shard in self._shards]
+            for key, histogram in self._retired.items():
+                merged.setdefault(key, LatencyHistogram()).merge(histogram)
+
+        for shard in shards:
+            for key, histogram in list(shard.items()):
+                merged.setdefault(key, LatencyHistogram()).merge(histogram)
+        return merged
+
+    def start_dumper(self):
+        self._dumper_pid = os.getpid()
+        if self.metrics_dir:
+            threading.Thread(target=self.dump_forever, name='LatencyMetricsDumper', daemon=True).start()
+
+    def dump_forever(self):
+        while True:
+            time.sleep(self.dump_interval)
+            try:
+                self.dump()
+            except Exception as e:
+                print('Error dumping latency metrics to {} : {}'.format(self.metrics_dir, e))
+
+    def dump(self):
+        """
+        Write the snapshot of this process to the metrics directory. The file is replaced atomically.
+        """
+        if not os.path.exists(self.metrics_dir):
+            os.makedirs(self.metrics_dir, exist_ok=True)
+
+        data = [{'route': route, 'status': status, 'histogram': histogram.to_dict()}
+                for (route, status), histogram in self.snapshot().items()]
+        file_path = os.path.join(self.metrics_dir, '{}{}.json'.format(self.file_prefix, os.getpid()))
+        temp_path = '{}.tmp'.format(file_path)
+        with open(temp_path, 'w') as file_obj:
+            json.dump(data, file_obj)
+        os.replace(temp_path, file_path)
+
+    @classmethod
+    def load(cls, metrics_dir, max_age=None, exclude_pid=None):
+        """
+        Merge the snapshots of the processes from the metrics directory
+        :param metrics_dir: the metrics directory
+        :param max_age: snapshots not updated in the last max_age seconds are skipped. None to read all
+        :param exclude_pid: the pid of the process whose snapshot is to be skipped
+        :return: dict of (route, status) -> merged histogram
+        """
+        merged = {}
+        if not metrics_dir or not os.path.isdir(metrics_dir):
+            return merged
+
+        exclude_file = '{}{}.json'.format(cls.file_prefix, exclude_pid)
+        for entry in os.scandir(metrics_dir):
+            if not entry.name.startswith(cls.file_prefix) or not entry.name.endswith('.json') \
+                    or entry.name == exclude_file:
+                continue
+            if max_age is not None and time.time() - entry.stat().st_mtime > max_age:
+                continue
+            try:
+                with open(entry.path) as file_obj:
+                    data = json.load(file_obj)
+            except (OSError, ValueError):
+                continue
+
+            for item in data:
+                key = (item['route'], item['status'])
+                merged.setdefault(key, LatencyHistogram()).merge(LatencyHistogram.from_dict(item['histogram']))
+        return merged
+
+    def collect(self, max_age=None):
+        """
+        Merge the live snapshot of this process with the snapshots of the other processes in the metrics directory
+        """
+        merged = self.load(self.metrics_dir, max_age=max_age, exclude_pid=os.getpid())
+        for key, histogram in self.snapshot().items():
+            merged.setdefault(key, LatencyHistogram()).merge(histogram)
+        return merged
+
+    @classmethod
+    def render_text(cls, histograms, name='django_request_latency_seconds'):
+        """
+        Render the histograms in the prometheus text exposition format. The buckets & counts can be summed up across
+            processes & hosts; the quantiles & max are per scrape target.
+        :param histograms: dict of (route, status) -> histogram
+        :param name: the metric name
+        :return: the text
+        """
+        lines = [
+            '# HELP {} Request processing time by resolved url name & status code'.format(name),
+            '# TYPE {} histogram'.format(name),
+        ]
+        quantile_lines = [
+            '# HELP {}_quantile Request processing time percentiles & max'.format(name),
+            '# TYPE {}_quantile gauge'.format(name),
+        ]
+
+        for (route, status), histogram in sorted(histograms.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+            labels = 'route="{}",status="{}"'.format(str(route).replace('\\', '\\\\').replace('"', '\\"'), status)
+            for upper, count in histogram.cumulative_buckets():
+                lines.append('{}_bucket{{{},le="{:.6f}"}} {}'.format(name, labels, upper / 1e6, count))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, histogram.count))
+            lines.append('{}_sum{{{}}} {:.6f}'.format(name, labels, histogram.total / 1e6))
+            lines.append('{}_count{{{}}} {}'.format(name, labels, histogram.count))
+
+            for quantile in (50, 90, 99):
+                quantile_lines.append('{}_quantile{{{},quantile="0.{}"}} {:.6f}'.format(
+                    name, labels, quantile, histogram.percentile(quantile) / 1e6))
+            quantile_lines.append('{}_quantile{{{},quantile="1"}} {:.6f}'.format(name, labels, histogram.max / 1e6))
+
+        return '\n'.join(lines + quantile_lines) + '\n'
+
+
+# Process wide latency metrics recorded by the LoggingMiddleware
+latency_metrics = LatencyMetrics()
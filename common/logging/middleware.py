@@ -1,8 +1,21 @@
+import ipaddress
 import logging
 import time
+from contextlib import ExitStack
 
-from . import message_types
+from . import message_types, tracing
 from .adapters import LoggingAdapter
+from .metrics import latency_metrics
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:
+    import asyncio
+    from asyncio import iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
 
 __all__ = ['LoggingMiddleware', 'ExceptionLoggingMiddleware']
 
@@ -11,21 +24,147 @@ logger = LoggingAdapter(logging.getLogger(__name__))
 
 class LoggingMiddleware:
     """
-    Import this middleware class into the MIDDLEWARE_CLASSES django setting.
+    Import this middleware class into the MIDDLEWARE (or the old style MIDDLEWARE_CLASSES) django setting.
     Should be placed after CommonMiddleware and SessionMiddleware so that appropriate request
         parameters are setup before this middleware runs.
+    The request start time is kept on the request, so that concurrent requests do not share any state through the
+        middleware instance. Under ASGI, the middleware runs in the event loop without a thread switch.
+    Every request runs in a trace (common.logging.tracing) that times the outbound http calls, s3 operations & db
+        queries (django >= 2.0, sync requests) of the request; the per kind summary is logged in the SYSTEM_OUT line.
+    With the HTTP_REQUEST_BUDGET django setting (seconds) or the X-Request-Budget-Ms request header, the outbound
+        calls of the request run within a deadline budget (common.utils.resilience). The header is honored only from
+        the addresses of the HTTP_REQUEST_BUDGET_TRUSTED_NETWORKS setting (the internal callers) & is raised to the
+        HTTP_REQUEST_BUDGET_MIN setting (seconds), so that a caller cannot starve the outbound calls of the request.
     """
+    sync_capable = True
+    async_capable = True
+
+    # request attribute holding the perf_counter_ns value at the start of the request
+    time_in_attribute = '_logging_time_in'
+    # request attribute holding the (trace, context token) of the request
+    trace_attribute = '_logging_trace'
+    # request attribute holding the context token of the deadline budget of the request
+    deadline_attribute = '_logging_deadline'
+
+    def __init__(self, get_response=None):
+        from django.conf import settings
+        self.get_response = get_response
+        self.is_async = get_response is not None and iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+        # latency histograms per resolved url name & status code, exposed by common.logging.views.latency_metrics_view
+        self.record_latency = getattr(settings, 'LOGGING_LATENCY_METRICS', True)
+        if self.record_latency:
+            latency_metrics.configure(metrics_dir=getattr(settings, 'LOGGING_METRICS_DIR', None),
+                                      dump_interval=getattr(settings, 'LOGGING_METRICS_DUMP_INTERVAL', 10))
+
+        self.tracing = getattr(settings, 'LOGGING_TRACING', True)
+        self.trace_exporter = tracing.get_exporter() if self.tracing else None
+        self.request_id_meta_key = 'HTTP_{}'.format(tracing.REQUEST_ID_HEADER.upper().replace('-', '_'))
+
+        from common.utils import resilience
+        self.resilience = resilience
+        self.request_budget = getattr(settings, 'HTTP_REQUEST_BUDGET', None)
+        self.budget_meta_key = 'HTTP_{}'.format(resilience.BUDGET_HEADER.upper().replace('-', '_'))
+        self.min_request_budget = getattr(settings, 'HTTP_REQUEST_BUDGET_MIN', 0.5)
+        self.budget_trusted_networks = [ipaddress.ip_network(network, strict=False)
+                                        for network in getattr(settings, 'HTTP_REQUEST_BUDGET_TRUSTED_NETWORKS', ())]
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        self.process_request(request)
+        with ExitStack() as stack:
+            if self.tracing:
+                self.trace_db_queries(stack)
+            response = self.get_response(request)
+        return self.process_response(request, response)
+
+    @classmethod
+    def trace_db_queries(cls, stack):
+        from django.db import connections
+        for connection in connections.all():
+            if hasattr(connection, 'execute_wrapper'):
+                stack.enter_context(connection.execute_wrapper(tracing.db_span_wrapper))
 
-    def __init__(self):
-        self.time_in = None
+    async def __acall__(self, request):
+        self.process_request(request)
+        response = await self.get_response(request)
+        return self.process_response(request, response)
 
     def process_request(self, request):
-        self.time_in = time.time()
+        setattr(request, self.time_in_attribute, time.perf_counter_ns())
+        if self.tracing:
+            setattr(request, self.trace_attribute,
+                    tracing.start_trace(trace_id=request.META.get(self.request_id_meta_key), name=request.path))
+        budget = self.get_budget(request)
+        if budget is not None:
+            setattr(request, self.deadline_attribute, self.resilience.start_deadline(budget))
         logger.info(message_type=message_types.SYSTEM_IN, request=request)
 
+    def get_budget(self, request):
+        """
+        :return: the deadline budget of the request in seconds -- the lower of the HTTP_REQUEST_BUDGET setting & the
+            budget left of a trusted caller (X-Request-Budget-Ms header, no lower than HTTP_REQUEST_BUDGET_MIN).
+            None for no budget
+        """
+        budget = self.request_budget
+        if not self.is_trusted_caller(request):
+            return budget
+        try:
+            caller_budget = int(request.META[self.budget_meta_key]) / 1000.0
+        except (KeyError, ValueError):
+            return budget
+        if caller_budget <= 0:
+            # a spent or invalid budget, the request runs within the budget of the setting
+            return budget
+        caller_budget = max(caller_budget, self.min_request_budget or 0)
+        return caller_budget if budget is None else min(budget, caller_budget)
+
+    def is_trusted_caller(self, request):
+        """
+        :return: whether the budget header of the caller is honored -- the remote address of the request is in one of
+            the HTTP_REQUEST_BUDGET_TRUSTED_NETWORKS
+        """
+        if not self.budget_trusted_networks:
+            return False
+        try:
+            address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+        except ValueError:
+            return False
+        return any(address in network for network in self.budget_trusted_networks)
+
     def process_response(self, request, response):
+        time_in = getattr(request, self.time_in_attribute, None)
+        if time_in is None:
+            # the request did not pass through process_request e.g. a response returned by an earlier middleware
+            processing_time = logger.DEFAULT_VALUE
+        else:
+            processing_time = (time.perf_counter_ns() - time_in) / 1e9
+            if self.record_latency:
+                resolver_match = getattr(request, 'resolver_match', None)
+                route = resolver_match.view_name if resolver_match else 'unresolved'
+                latency_metrics.record(route, response.status_code, processing_time)
+
+        deadline_token = getattr(request, self.deadline_attribute, None)
+        if deadline_token is not None:
+            self.resilience.end_deadline(deadline_token)
+
+        trace, token = getattr(request, self.trace_attribute, (None, None))
+        if trace is not None:
+            tracing.end_trace(trace, token)
+            response[tracing.REQUEST_ID_HEADER] = trace.trace_id
+
         logger.info(message_type=message_types.SYSTEM_OUT, request=request, response=response,
-                    processing_time=time.time() - self.time_in)
+                    processing_time=processing_time, trace=trace)
+
+        if trace is not None and self.trace_exporter is not None:
+            try:
+                self.trace_exporter.export(trace)
+            except Exception as e:
+                print('Error exporting trace {} : {}'.format(trace.trace_id, e))
         return response
 
 
@@ -33,6 +172,22 @@ class ExceptionLoggingMiddleware:
     """
     Import this middleware to log exceptions in custom manner within django logs
     """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        self.is_async = get_response is not None and iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
 
     def process_exception(self, request, exception):
         logger.exception(exception, message_type=message_types.EXCEPTION, request=request)
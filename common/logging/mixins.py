@@ -1,10 +1,18 @@
-import json
+import copy
 import logging
+import random
+import time
+from collections import namedtuple
 
 from . import message_types
+from .policies import log_policies
+from .serializers import get_serializer, sort_keys_enabled
 
 __all__ = ['APILoggingMixin']
 
+APILoggingState = namedtuple('APILoggingState',
+                             'logger api_action policy log_data_settings skip_request_data skip_response_data')
+
 
 class LoggingHelperMixin:
     DEFAULT_VALUE = 'NA'
@@ -13,7 +21,7 @@ class LoggingHelperMixin:
         self.kwargs = dict()
 
     @staticmethod
-    def __new__(cls, *more):
+    def __new__(cls, *more, **kwargs):
         if cls is LoggingHelperMixin:
             raise TypeError('Logging Helper Mixing may not be instantiated')
         return object.__new__(cls)
@@ -24,11 +32,25 @@ class LoggingHelperMixin:
     def get_user_id(self):
         return self.kwargs['request'].META.get('HTTP_USER_ID', self.DEFAULT_VALUE)
 
+    def get_trace_id(self):
+        trace = self.kwargs.get('trace')
+        return trace.trace_id if trace is not None else self.DEFAULT_VALUE
+
+    def get_span_summary(self):
+        trace = self.kwargs.get('trace')
+        return trace.summary() if trace is not None else self.DEFAULT_VALUE
+
+    def get_structured_span_summary(self):
+        trace = self.kwargs.get('trace')
+        return trace.to_dict()['summary'] if trace is not None else None
+
     def get_request_path(self):
         return self.kwargs['request'].path
 
     def get_session_id(self):
-        return self.kwargs['request'].session.session_key or self.DEFAULT_VALUE
+        # session_key does not load the session data from the session store
+        session = getattr(self.kwargs['request'], 'session', None)
+        return getattr(session, 'session_key', None) or self.DEFAULT_VALUE
 
     def get_request_method(self):
         return self.kwargs['request'].method.upper()
@@ -41,12 +63,25 @@ class LoggingHelperMixin:
             client_ip = self.kwargs['request'].META.get('REMOTE_ADDR', None)
         return client_ip
 
-    def get_request_data(self):
+    def get_request_payload(self):
+        """
+        The logged request data -- the headers, the query params & the request body, or the request_payload read
+            earlier (see APILoggingMixin errors_only)
+        :return: dict of headers, query_params & request_data; None if no request object is found
+        """
+        request_payload = self.kwargs.get('request_payload')
+        if request_payload is not None:
+            return dict(request_payload)
         request = self.kwargs.get('request', None)
         if not request:
-            return 'NO_REQUEST_OBJECT_FOUND'
+            return None
+        return self.read_request_payload(request, self.kwargs.get('header_keys', []))
 
-        header_keys = self.kwargs.get('header_keys', [])
+    @staticmethod
+    def read_request_payload(request, header_keys):
+        """
+        :return: dict of the headers (header_keys, or all the HTTP_ headers), query_params & request_data of the request
+        """
         header_dict = {}
         if header_keys:
             for key in header_keys:
@@ -56,28 +91,63 @@ class LoggingHelperMixin:
                 if key.startswith('HTTP_'):
                     header_dict[key] = value
 
-        query_params = json.dumps(request.query_params.dict(), sort_keys=True)
-
         content_type = request.META.get('CONTENT_TYPE') or request.META.get('HTTP_CONTENT_TYPE', '')
 
         if 'multipart/form-data' in content_type:
             request_data = request.data.dict()
-        else:
+        elif request.FILES:
             request_data = request.data.copy()
+        else:
+            # the data is only read for logging, so it is not copied
+            request_data = request.data
 
         for filename in request.FILES:
             request_data[filename] = 'FILE[{}]'.format(request_data[filename].name)
 
+        return {
+            'headers': header_dict,
+            'query_params': request.query_params.dict(),
+            'request_data': request_data,
+        }
+
+    def get_request_data(self):
+        payload = self.get_request_payload()
+        if payload is None:
+            return 'NO_REQUEST_OBJECT_FOUND'
+
+        serializer = get_serializer()
+        sort_keys = sort_keys_enabled()
+        max_bytes = self.kwargs.get('max_data_bytes')
+        if max_bytes is None:
+            request_data = payload['request_data']
+        else:
+            request_data = serializer.dumps_truncated(payload['request_data'], max_bytes, sort_keys=sort_keys)
+
         return 'HEADERS: {headers}, QUERY_PARAMS: {query_params}, REQUEST_DATA: {request_data}'.format(
-            query_params=query_params,
+            query_params=serializer.dumps(payload['query_params'], sort_keys=sort_keys),
             request_data=request_data,
-            headers=json.dumps(header_dict, sort_keys=True)
+            headers=serializer.dumps(payload['headers'], sort_keys=sort_keys)
         )
 
+    def get_structured_request_data(self):
+        payload = self.get_request_payload()
+        max_bytes = self.kwargs.get('max_data_bytes')
+        if payload is not None and max_bytes is not None:
+            payload['request_data'] = get_serializer().dumps_truncated(payload['request_data'], max_bytes,
+                                                                       sort_keys=sort_keys_enabled())
+        return payload
+
     def get_response_data(self):
-        response_data = json.dumps(self.kwargs['response'].data, sort_keys=True)
+        response_data = get_serializer().dumps_truncated(
+            self.kwargs['response'].data, self.kwargs.get('max_data_bytes'), sort_keys=sort_keys_enabled())
         return 'RESPONSE: {}'.format(response_data)
 
+    def get_structured_response_data(self):
+        max_bytes = self.kwargs.get('max_data_bytes')
+        if max_bytes is None:
+            return self.kwargs['response'].data
+        return get_serializer().dumps_truncated(self.kwargs['response'].data, max_bytes, sort_keys=sort_keys_enabled())
+
     def get_response_code(self):
         return self.kwargs['response'].status_code
 
@@ -91,35 +161,184 @@ class APILoggingMixin:
     # ViewSet actions for which response data is not to be logged
     skip_request_data_actions = []
 
+    # Limits for logging the request & response data. None to use the value in the LOGGING_API_DATA django setting
+    # max length of the logged request/response data; longer data is truncated while being serialized
+    log_data_max_bytes = None
+    # fraction of the requests for which the data is logged, 0 to 1
+    log_data_sample_rate = None
+    # content types for which the data is logged, e.g. ['application/json']. Empty for all content types
+    log_data_content_types = None
+    # content types for which the data is never logged, e.g. ['multipart/form-data']
+    log_data_skip_content_types = None
+    # whether the data is logged only for responses with an error status code (4xx/5xx). The request data is read
+    # before the view runs & logged in an API_IN_WITH_DATA line along with the error response
+    log_data_errors_only = None
+
+    # Log policy of the view. None to use the policy of the api action from common.logging.policies.log_policies
+    log_policy = None
+
+    # (view class, action) -> APILoggingState, for the log_policies version
+    _logging_states = {}
+    _logging_states_version = None
+
+    # defaults of the data logging limits
+    default_log_data_settings = {
+        'max_bytes': None,
+        'sample_rate': 1,
+        'content_types': [],
+        'skip_content_types': [],
+        'errors_only': False,
+    }
+
     @staticmethod
     def __new__(cls, *more, **kwargs):
         if cls is APILoggingMixin:
             raise TypeError('Logging Mixing may not be instantiated')
         return super().__new__(cls)
 
+    def get_log_data_settings(self):
+        """
+        The data logging limits of the view -- the view attributes, falling back to the LOGGING_API_DATA django setting
+        :return: dict of max_bytes, sample_rate, content_types, skip_content_types & errors_only
+        """
+        from django.conf import settings
+        log_data_settings = dict(self.default_log_data_settings)
+        log_data_settings.update(getattr(settings, 'LOGGING_API_DATA', {}))
+
+        for key in self.default_log_data_settings:
+            value = getattr(self, 'log_data_{}'.format(key))
+            if value is not None:
+                log_data_settings[key] = value
+        return log_data_settings
+
+    @classmethod
+    def match_content_type(cls, content_type, content_types):
+        """
+        Check if the content type is one of the content types. Parameters like charset are ignored.
+        :param content_type: the content type e.g. 'application/json; charset=utf-8'
+        :param content_types: the list of content types or their prefixes e.g. ['application/json', 'text/']
+        :return: True/False value
+        """
+        media_type = (content_type or '').split(';', 1)[0].strip().lower()
+        return any(media_type.startswith(item.lower()) for item in content_types)
+
+    def should_log_data(self, content_type, log_data_settings):
+        """
+        Check if the data of this content type is to be logged as per the sampling & content type limits.
+        The sampling decision is taken once per request, so that either both request & response data are logged or none.
+        """
+        if self.match_content_type(content_type, log_data_settings['skip_content_types']):
+            return False
+        if log_data_settings['content_types'] and \
+                not self.match_content_type(content_type, log_data_settings['content_types']):
+            return False
+
+        sampled = getattr(self, '_log_data_sampled', None)
+        if sampled is None:
+            sample_rate = log_data_settings['sample_rate']
+            sampled = sample_rate >= 1 or random.random() < sample_rate
+            self._log_data_sampled = sampled
+        return sampled
+
+    def get_logging_state(self):
+        """
+        The logging state of the view action -- the logger, api action, log policy & data logging limits.
+        Resolved once per view class & action & cached, until log_policies.register() changes the policies.
+        :return: the APILoggingState
+        """
+        if APILoggingMixin._logging_states_version != log_policies.version:
+            APILoggingMixin._logging_states = {}
+            APILoggingMixin._logging_states_version = log_policies.version
+        key = (self.__class__, self.action)
+        state = self._logging_states.get(key)
+        if state is None:
+            from .adapters import LoggingAdapter
+            api_action = '{}.{}.{}'.format(self.__module__, self.__class__.__name__, self.action)
+            state = APILoggingState(
+                logger=LoggingAdapter(logging.getLogger(self.__module__)),
+                api_action=api_action,
+                policy=self.log_policy or log_policies.resolve(api_action),
+                log_data_settings=self.get_log_data_settings(),
+                skip_request_data=bool(
+                    self.skip_request_data_actions and self.action in self.skip_request_data_actions),
+                skip_response_data=bool(
+                    self.skip_response_data_actions and self.action in self.skip_response_data_actions),
+            )
+            APILoggingMixin._logging_states[key] = state
+        return state
+
     def initial(self, request, *args, **kwargs):
-        from .adapters import LoggingAdapter
         super(APILoggingMixin, self).initial(request, *args, **kwargs)
 
-        logger = LoggingAdapter(logging.getLogger(self.__module__))
-        api_action = '{}.{}.{}'.format(self.__module__, self.__class__.__name__, self.action)
+        state = self.get_logging_state()
+        self._log_time_in = time.perf_counter()
+        self._log_sampled = state.policy.sample()
+        self._log_deferred_message = None
+        self._log_error_message = None
+        if not self._log_sampled and not state.policy.tail_sampling:
+            return
+
+        log_data_settings = state.log_data_settings
+        content_type = request.META.get('CONTENT_TYPE') or request.META.get('HTTP_CONTENT_TYPE', '')
+        log_data = not state.skip_request_data and self.should_log_data(content_type, log_data_settings)
+        if not log_data or log_data_settings['errors_only']:
+            log_kwargs = dict(message_type=message_types.API_IN, request=request, api_action=state.api_action)
+        else:
+            log_kwargs = dict(message_type=message_types.API_IN_WITH_DATA, request=request,
+                              api_action=state.api_action, header_keys=self.header_keys,
+                              max_data_bytes=log_data_settings['max_bytes'])
+
+        if log_data and log_data_settings['errors_only']:
+            # read before the view consumes or changes it, serialized only if the response is an error
+            request_payload = LoggingHelperMixin.read_request_payload(request, self.header_keys)
+            request_payload['request_data'] = copy.copy(request_payload['request_data'])
+            self._log_error_message = dict(message_type=message_types.API_IN_WITH_DATA, request=request,
+                                           api_action=state.api_action, request_payload=request_payload,
+                                           max_data_bytes=log_data_settings['max_bytes'])
 
-        if self.skip_request_data_actions and self.action in self.skip_request_data_actions:
-            logger.info(message_type=message_types.API_IN, request=request, api_action=api_action)
+        if self._log_sampled:
+            if state.policy.allow():
+                state.logger.log(state.policy.level, **log_kwargs)
         else:
-            logger.info(message_type=message_types.API_IN_WITH_DATA, request=request, api_action=api_action,
-                        header_keys=self.header_keys)
+            # tail sampling -- logged along with the response if the request is kept
+            self._log_deferred_message = log_kwargs
 
     def finalize_response(self, request, response, *args, **kwargs):
-        from .adapters import LoggingAdapter
         response = super(APILoggingMixin, self).finalize_response(request, response, *args, **kwargs)
 
-        logger = LoggingAdapter(logging.getLogger(self.__module__))
-        api_action = '{}.{}.{}'.format(self.__module__, self.__class__.__name__, self.action)
-        if self.skip_response_data_actions and self.action in self.skip_response_data_actions:
-            logger.info(message_type=message_types.API_OUT, request=request, response=response, api_action=api_action)
+        state = self.get_logging_state()
+        policy = state.policy
+        sampled = getattr(self, '_log_sampled', True)
+        if not sampled:
+            time_in = getattr(self, '_log_time_in', None)
+            processing_time = time.perf_counter() - time_in if time_in is not None else 0
+            if not policy.tail_sampling or not policy.keep(response.status_code, processing_time):
+                return response
+
+        error_message = getattr(self, '_log_error_message', None) if response.status_code >= 400 else None
+        deferred_message = getattr(self, '_log_deferred_message', None)
+        if deferred_message is not None:
+            if not policy.allow(lines=2):
+                return response
+            state.logger.log(policy.level, **(error_message or deferred_message))
+        elif not policy.allow(lines=1 if error_message is None else 2):
+            return response
+        elif error_message is not None:
+            # the request data of the failed request (errors_only), after its API_IN line
+            state.logger.log(policy.level, **error_message)
+
+        log_data_settings = state.log_data_settings
+        if log_data_settings['errors_only'] and response.status_code < 400:
+            log_data = False
+        else:
+            log_data = self.should_log_data(getattr(response, 'accepted_media_type', None), log_data_settings)
+
+        if state.skip_response_data or not log_data:
+            state.logger.log(policy.level, message_type=message_types.API_OUT, request=request, response=response,
+                             api_action=state.api_action)
         else:
-            logger.info(message_type=message_types.API_OUT_WITH_DATA, request=request, response=response,
-                        api_action=api_action)
+            state.logger.log(policy.level, message_type=message_types.API_OUT_WITH_DATA, request=request,
+                             response=response, api_action=state.api_action,
+                             max_data_bytes=log_data_settings['max_bytes'])
 
         return response
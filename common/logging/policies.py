@@ -0,0 +1,140 @@
+import fnmatch
+import logging
+import random
+import threading
+import time
+
+__all__ = ['LogPolicy', 'LogPolicyRegistry', 'log_policies']
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter -- allows rate tokens per second, with bursts of up to burst tokens
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, tokens=1):
+        """
+        :return: True if the tokens are available, else False
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+
+class LogPolicy:
+    """
+    Logging policy of an api action:
+        level -- the log level of the API_IN/API_OUT lines e.g. 'INFO' or logging.DEBUG
+        rate_limit -- max log lines per second for the action (with bursts of up to burst lines). None for no limit
+        sample_rate -- head sampling: the fraction of the requests logged, decided when the request starts
+        tail_errors -- tail sampling: requests not sampled are still logged if the response is an error (4xx/5xx)
+        tail_slow_seconds -- tail sampling: requests not sampled are still logged if slower than this
+    With tail sampling, the API_IN line of a request not sampled is held back until the response is known.
+    """
+
+    def __init__(self, level=logging.INFO, rate_limit=None, burst=None, sample_rate=1, tail_errors=False,
+                 tail_slow_seconds=None):
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+        self.rate_limiter = TokenBucket(rate_limit, burst) if rate_limit is not None else None
+        self.sample_rate = sample_rate
+        self.tail_errors = tail_errors
+        self.tail_slow_seconds = tail_slow_seconds
+
+    @property
+    def tail_sampling(self):
+        return self.tail_errors or self.tail_slow_seconds is not None
+
+    def sample(self):
+        """
+        Head sampling decision for a request
+        """
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def keep(self, status_code, processing_time):
+        """
+        Tail sampling decision for a request that was not sampled at its start
+        """
+        if self.tail_errors and status_code >= 400:
+            return True
+        return self.tail_slow_seconds is not None and processing_time >= self.tail_slow_seconds
+
+    def allow(self, lines=1):
+        """
+        Rate limit decision for logging the lines
+        """
+        return self.rate_limiter is None or self.rate_limiter.consume(lines)
+
+
+class LogPolicyRegistry:
+    """
+    Registry of the logging policies keyed by api action (module.Class.action).
+    Keys can be glob patterns e.g. 'dummy_app.views.HealthViewSet.*'; the exact key, else the longest matching
+        pattern is used. The policies can also be configured by the LOGGING_API_POLICIES django setting -- a dict of
+        key -> LogPolicy kwargs.
+    """
+
+    def __init__(self):
+        self._policies = {}
+        self._resolved = {}
+        self._settings_loaded = False
+        self.default_policy = LogPolicy()
+        # incremented when the policies change, for the caches of the resolved policies
+        self.version = 0
+
+    def register(self, key, policy=None, **kwargs):
+        """
+        Register the policy for the api action key
+        :param key: the api action or a glob pattern of api actions
+        :param policy: the LogPolicy object. If not given, a LogPolicy is created from the kwargs
+        :return: the policy
+        """
+        policy = policy or LogPolicy(**kwargs)
+        self._policies[key] = policy
+        self._resolved = {}
+        self.version += 1
+        return policy
+
+    def load_settings(self):
+        from django.conf import settings
+        self._settings_loaded = True
+        for key, policy_kwargs in getattr(settings, 'LOGGING_API_POLICIES', {}).items():
+            if key not in self._policies:
+                self._policies[key] = LogPolicy(**policy_kwargs)
+
+    def resolve(self, api_action):
+        """
+        Get the policy of the api action. The result is cached.
+        :param api_action: the api action -- module.Class.action
+        :return: the LogPolicy object
+        """
+        try:
+            return self._resolved[api_action]
+        except KeyError:
+            pass
+
+        if not self._settings_loaded:
+            self.load_settings()
+
+        policy = self._policies.get(api_action)
+        if policy is None:
+            patterns = [key for key in self._policies if fnmatch.fnmatchcase(api_action, key)]
+            policy = self._policies[max(patterns, key=len)] if patterns else self.default_policy
+
+        self._resolved[api_action] = policy
+        return policy
+
+
+# Process wide logging policies used by the APILoggingMixin
+log_policies = LogPolicyRegistry()
@@ -0,0 +1,102 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ['JSONSerializer', 'ORJSONSerializer', 'get_serializer']
+
+# Appended to the logged data that is truncated as per the max bytes limit
+TRUNCATION_MARKER = '...<TRUNCATED>'
+
+
+class JSONSerializer:
+    """
+    Serializer for the data logged by the logging adapters, using the python json library
+    """
+
+    @classmethod
+    def dumps(cls, data, sort_keys=False):
+        """
+        Serialize the data to a json string. Values that are not json serializable are logged as their str value.
+        :param data: the data to be serialized
+        :param sort_keys: whether the keys of dicts are to be sorted
+        :return: the json string
+        """
+        return json.dumps(data, sort_keys=sort_keys, default=str)
+
+    @classmethod
+    def dumps_truncated(cls, data, max_bytes, sort_keys=False):
+        """
+        Serialize the data to a json string of at most max_bytes (plus the truncation marker).
+        The data is encoded incrementally & the encoding stops once the limit is reached, so that the complete json
+            string of large data is never built.
+        :param data: the data to be serialized
+        :param max_bytes: the max length of the json string. None for no limit
+        :param sort_keys: whether the keys of dicts are to be sorted
+        :return: the json string, ending with TRUNCATION_MARKER if truncated
+        """
+        if max_bytes is None:
+            return cls.dumps(data, sort_keys=sort_keys)
+
+        # ensure_ascii output, so that the string length is the byte length
+        encoder = json.JSONEncoder(sort_keys=sort_keys, default=str)
+        chunks = []
+        size = 0
+        for chunk in encoder.iterencode(data):
+            if size + len(chunk) > max_bytes:
+                chunks.append(chunk[:max_bytes - size])
+                chunks.append(TRUNCATION_MARKER)
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return ''.join(chunks)
+
+
+class ORJSONSerializer(JSONSerializer):
+    """
+    Serializer using orjson, which is several times faster than the python json library. Used when orjson is installed.
+    """
+
+    @classmethod
+    def dumps(cls, data, sort_keys=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(data, default=str, option=option).decode('utf-8')
+        except TypeError:
+            # e.g. integers larger than 64 bit or circular references
+            return super(ORJSONSerializer, cls).dumps(data, sort_keys=sort_keys)
+
+
+_serializer = None
+
+
+def get_serializer():
+    """
+    Get the serializer for the logged data. The LOGGING_JSON_SERIALIZER django setting can be set to the import path
+        of a custom serializer class; by default orjson is used if installed, else the python json library.
+    :return: the serializer class
+    """
+    global _serializer
+    if _serializer is None:
+        from django.conf import settings
+        serializer_path = getattr(settings, 'LOGGING_JSON_SERIALIZER', None) if settings.configured else None
+        if serializer_path:
+            from django.utils.module_loading import import_string
+            _serializer = import_string(serializer_path)
+        elif orjson is not None:
+            _serializer = ORJSONSerializer
+        else:
+            _serializer = JSONSerializer
+    return _serializer
+
+
+def sort_keys_enabled():
+    """
+    Whether the keys of the logged json data are to be sorted -- the LOGGING_JSON_SORT_KEYS django setting
+    """
+    from django.conf import settings
+    return bool(settings.configured and getattr(settings, 'LOGGING_JSON_SORT_KEYS', False))
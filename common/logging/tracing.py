@@ -0,0 +1,251 @@
+import contextvars
+import functools
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+__all__ = ['Trace', 'Span', 'span', 'traced', 'current_trace', 'start_trace', 'end_trace', 'inject_headers',
+           'FileTraceExporter', 'LoggerTraceExporter']
+
+# Header carrying the trace id of the request, read from inbound requests & sent with the outbound requests
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_current_trace = contextvars.ContextVar('common_logging_trace', default=None)
+
+
+class Span:
+    """
+    Timing of one operation within a trace e.g. an outbound http call, an s3 upload or a db query
+    """
+    __slots__ = ('name', 'kind', 'start_ns', 'duration_ns', 'attributes', 'error')
+
+    def __init__(self, name, kind, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.perf_counter_ns()
+        self.duration_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def finish(self):
+        self.duration_ns = time.perf_counter_ns() - self.start_ns
+
+    def to_dict(self, trace_start_ns):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'offset_ms': round((self.start_ns - trace_start_ns) / 1e6, 3),
+            'duration_ms': round((self.duration_ns or 0) / 1e6, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class Trace:
+    """
+    The spans of one inbound request. The time spent is aggregated per span kind; the individual spans are kept up to
+        max_spans for the exporters.
+    """
+    max_spans = 200
+
+    # trace ids received from the callers are only used if they match this pattern
+    trace_id_pattern = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+    def __init__(self, trace_id=None, name=None):
+        if not trace_id or not self.trace_id_pattern.match(trace_id):
+            trace_id = uuid.uuid4().hex
+        self.trace_id = trace_id
+        self.name = name
+        self.start_ns = time.perf_counter_ns()
+        self.start_time = time.time()
+        self.duration_ns = None
+        self.spans = []
+        self.dropped_spans = 0
+        # kind -> [count, total duration in ns]
+        self.kinds = {}
+        self.lock = threading.Lock()
+
+    def add(self, finished_span):
+        with self.lock:
+            totals = self.kinds.setdefault(finished_span.kind, [0, 0])
+            totals[0] += 1
+            totals[1] += finished_span.duration_ns
+            if len(self.spans) < self.max_spans:
+                self.spans.append(finished_span)
+            else:
+                self.dropped_spans += 1
+
+    def finish(self):
+        self.duration_ns = time.perf_counter_ns() - self.start_ns
+
+    def summary(self):
+        """
+        Per span kind count & total time, the slowest kind first e.g. http:2/340.1ms,db:14/35.2ms
+        """
+        if not self.kinds:
+            return '-'
+        kinds = sorted(self.kinds.items(), key=lambda item: -item[1][1])
+        return ','.join('{}:{}/{:.1f}ms'.format(kind, count, total / 1e6) for kind, (count, total) in kinds)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'start_time': self.start_time,
+            'duration_ms': round((self.duration_ns or 0) / 1e6, 3),
+            'summary': {kind: {'count': count, 'total_ms': round(total / 1e6, 3)}
+                        for kind, (count, total) in self.kinds.items()},
+            'spans': [item.to_dict(self.start_ns) for item in self.spans],
+            'dropped_spans': self.dropped_spans,
+        }
+
+
+def current_trace():
+    """
+    :return: the trace of the current request (context), None if no trace is started
+    """
+    return _current_trace.get()
+
+
+def start_trace(trace_id=None, name=None):
+    """
+    Start a trace in the current context
+    :param trace_id: the trace id e.g. the request id received from the caller. A new id is generated if None
+    :param name: the name of the trace e.g. the request path
+    :return: (trace, token) -- the token is to be passed to end_trace
+    """
+    trace = Trace(trace_id=trace_id, name=name)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(trace, token=None):
+    """
+    Finish the trace & remove it from the current context
+    """
+    trace.finish()
+    if token is not None:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # the token was created in a different context
+            _current_trace.set(None)
+
+
+@contextmanager
+def span(name, kind='internal', **attributes):
+    """
+    Time the enclosed block as a span of the current trace. Does nothing if no trace is started.
+    with span('s3 push', kind='s3', key=key_name):
+        ...
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    current_span = Span(name, kind, attributes)
+    try:
+        yield current_span
+    except BaseException as e:
+        current_span.error = repr(e)
+        raise
+    finally:
+        current_span.finish()
+        trace.add(current_span)
+
+
+def traced(kind, name=None):
+    """
+    Decorator to time the function calls as spans of the current trace
+    :param kind: the span kind e.g. 's3'
+    :param name: the span name. Default is the qualified name of the function
+    """
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name, kind=kind):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def inject_headers(headers=None):
+    """
+    Add the request id of the current trace to the headers of an outbound request
+    :param headers: the headers of the outbound request. Not modified
+    :return: the headers with the request id; the same headers if no trace is started or the header is already set
+    """
+    trace = _current_trace.get()
+    if trace is None or (headers and REQUEST_ID_HEADER in headers):
+        return headers
+    headers = dict(headers) if headers else {}
+    headers[REQUEST_ID_HEADER] = trace.trace_id
+    return headers
+
+
+def db_span_wrapper(execute, sql, params, many, context):
+    """
+    Database execute wrapper (connection.execute_wrapper, django >= 2.0) timing the queries as db spans
+    """
+    if _current_trace.get() is None:
+        return execute(sql, params, many, context)
+    with span(sql[:200], kind='db', many=many):
+        return execute(sql, params, many, context)
+
+
+class FileTraceExporter:
+    """
+    Appends every finished trace as a json line to a local file. The file is written by a queued handler, off the
+        request thread.
+    """
+
+    def __init__(self, file_path, **handler_kwargs):
+        from .handlers import QueuedFileHandler
+        self.handler = QueuedFileHandler(file_path, **handler_kwargs)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+
+    def export(self, trace):
+        self.handler.handle(logging.makeLogRecord({
+            'name': __name__,
+            'levelno': logging.INFO,
+            'levelname': 'INFO',
+            'msg': json.dumps(trace.to_dict(), default=str),
+        }))
+
+
+def get_exporter():
+    """
+    Get the trace exporter configured by the LOGGING_TRACE_EXPORTER django setting -- a dict with the import path of
+        the exporter class as 'class' & its kwargs. None if not configured.
+    """
+    from django.conf import settings
+    from django.utils.module_loading import import_string
+    exporter_settings = dict(getattr(settings, 'LOGGING_TRACE_EXPORTER', None) or {})
+    if not exporter_settings:
+        return None
+    return import_string(exporter_settings.pop('class'))(**exporter_settings)
+
+
+class LoggerTraceExporter:
+    """
+    Logs every finished trace as a json line to the common.logging.traces logger, so that the traces go through the
+        configured logging handlers e.g. a queued file handler or the log collector
+    """
+
+    def __init__(self, logger_name='common.logging.traces'):
+        self.logger = logging.getLogger(logger_name)
+
+    def export(self, trace):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(json.dumps(trace.to_dict(), default=str))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .metrics import latency_metrics
+
+__all__ = ['latency_metrics_view']
+
+
+def latency_metrics_view(request):
+    """
+    Expose the request latency histograms of all the worker processes on the host, in the prometheus text format.
+    Access is limited to the LOGGING_METRICS_ALLOWED_IPS django setting, if set. The snapshots of the processes not
+        written in the last LOGGING_METRICS_MAX_AGE seconds (default 3 dump intervals) are skipped as exited.
+    """
+    allowed_ips = getattr(settings, 'LOGGING_METRICS_ALLOWED_IPS', None)
+    if allowed_ips is not None and request.META.get('REMOTE_ADDR') not in allowed_ips:
+        return HttpResponseForbidden()
+
+    max_age = getattr(settings, 'LOGGING_METRICS_MAX_AGE', None) or 3 * latency_metrics.dump_interval
+    histograms = latency_metrics.collect(max_age=max_age)
+    return HttpResponse(latency_metrics.render_text(histograms), content_type='text/plain; version=0.0.4')
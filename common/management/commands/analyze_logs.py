@@ -0,0 +1,51 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand
+
+from common.logging.analyzer import LogAnalyzer
+
+
+class Command(BaseCommand):
+    help = 'Reports the throughput, error rate & latency percentiles per path & api action from the log files'
+
+    columns = ['window', 'kind', 'key', 'count', 'rps', 'client_errors', 'server_errors', 'error_rate',
+               'p50_ms', 'p90_ms', 'p99_ms', 'max_ms']
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='log files, including rotated & gzip/zstd compressed ones')
+        parser.add_argument('--window', type=int, default=None,
+                            help='length of the time windows in seconds. Default is a single window')
+        parser.add_argument('--workers', type=int, default=1, help='number of processes to read the files with')
+        parser.add_argument('--kind', choices=['path', 'action'], default=None, help='report only paths or actions')
+        parser.add_argument('--top', type=int, default=None, help='report only the top N keys of every window')
+        parser.add_argument('--format', dest='output_format', choices=['table', 'csv', 'json'], default='table')
+
+    def handle(self, *args, **options):
+        analyzer = LogAnalyzer.analyze_files(options['files'], window=options['window'], workers=options['workers'])
+
+        rows = [row for row in analyzer.rows() if options['kind'] in (None, row['kind'])]
+        if options['top']:
+            counts = {}
+            top_rows = []
+            for row in rows:
+                group = (row['window'], row['kind'])
+                counts[group] = counts.get(group, 0) + 1
+                if counts[group] <= options['top']:
+                    top_rows.append(row)
+            rows = top_rows
+
+        if options['output_format'] == 'json':
+            self.stdout.write(json.dumps({'lines': analyzer.lines, 'unparsed': analyzer.unparsed, 'rows': rows}))
+        elif options['output_format'] == 'csv':
+            writer = csv.DictWriter(self.stdout, fieldnames=self.columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            row_format = '{:<19} {:<6} {:<50} {:>8} {:>8} {:>6} {:>6} {:>8} {:>9} {:>9} {:>9} {:>9}'
+            self.stdout.write(row_format.format('WINDOW', 'KIND', 'KEY', 'COUNT', 'RPS', '4XX', '5XX', 'ERR_RATE',
+                                                'P50_MS', 'P90_MS', 'P99_MS', 'MAX_MS'))
+            for row in rows:
+                self.stdout.write(row_format.format(*[
+                    str(row[column])[:50] if row[column] is not None else '-' for column in self.columns]))
+            self.stdout.write('{} lines read, {} records not parsed'.format(analyzer.lines, analyzer.unparsed))
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from common.utils.temp_janitor import temp_janitor
+
+
+class Command(BaseCommand):
+    help = 'Removes the expired & over quota entries of the temp download & workspace directories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('roots', nargs='*', help='directories to clean. Default is the roots of TEMP_JANITOR')
+        parser.add_argument('--max-age', type=int, default=None, help='remove the entries older than these seconds')
+        parser.add_argument('--max-bytes', type=int, default=None, help='byte quota of every root')
+        parser.add_argument('--min-age', type=int, default=None,
+                            help='never remove the entries modified in these seconds')
+        parser.add_argument('--dry-run', action='store_true', help='report the entries to be removed only')
+        parser.add_argument('--format', dest='output_format', choices=['table', 'json'], default='table')
+
+    def handle(self, *args, **options):
+        temp_janitor.load_settings()
+        overrides = {key: options[key] for key in ('max_age', 'max_bytes', 'min_age') if options[key] is not None}
+        roots = [dict(temp_janitor.root_defaults, path=path) for path in options['roots']] or temp_janitor.roots
+        reports = [temp_janitor.clean_root(dict(root, **overrides), dry_run=options['dry_run']) for root in roots]
+
+        if options['output_format'] == 'json':
+            self.stdout.write(json.dumps(reports))
+            return
+
+        row_format = '{:<40} {:>8} {:>14} {:>8} {:>16} {:>6} {:>9}'
+        self.stdout.write(row_format.format('ROOT', 'ENTRIES', 'BYTES', 'REMOVED', 'RECLAIMED_BYTES', 'LIVE',
+                                            'SECONDS'))
+        for report in reports:
+            self.stdout.write(row_format.format(report['root'][:40], report['entries'], report['bytes'],
+                                                report['removed'], report['reclaimed_bytes'], report['live'],
+                                                report['duration']))
+        if options['dry_run']:
+            self.stdout.write('Dry run -- nothing removed')
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from common.logging.metrics import LatencyMetrics
+
+
+class Command(BaseCommand):
+    help = 'Reports the request latency percentiles recorded by the LoggingMiddleware of the worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--metrics-dir', dest='metrics_dir', default=getattr(settings, 'LOGGING_METRICS_DIR', None),
+                            help='directory of the latency snapshots. Default is the LOGGING_METRICS_DIR setting')
+        parser.add_argument('--max-age', dest='max_age', type=int, default=None,
+                            help='skip the snapshots of processes not updated in the last max-age seconds')
+        parser.add_argument('--format', dest='output_format', choices=['table', 'prometheus'], default='table')
+
+    def handle(self, *args, **options):
+        if not options['metrics_dir']:
+            self.stderr.write('No metrics directory specified. Set --metrics-dir or the LOGGING_METRICS_DIR setting')
+            return
+
+        histograms = LatencyMetrics.load(options['metrics_dir'], max_age=options['max_age'])
+        if options['output_format'] == 'prometheus':
+            self.stdout.write(LatencyMetrics.render_text(histograms), ending='')
+            return
+
+        row_format = '{:<50} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}'
+        self.stdout.write(row_format.format('ROUTE', 'STATUS', 'COUNT', 'P50 (ms)', 'P90 (ms)', 'P99 (ms)', 'MAX (ms)'))
+        for (route, status), histogram in sorted(histograms.items(), key=lambda item: -item[1].count):
+            self.stdout.write(row_format.format(
+                str(route)[:50], status, histogram.count,
+                '{:.1f}'.format(histogram.percentile(50) / 1000.0),
+                '{:.1f}'.format(histogram.percentile(90) / 1000.0),
+                '{:.1f}'.format(histogram.percentile(99) / 1000.0),
+                '{:.1f}'.format(histogram.max / 1000.0)))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from common.utils.http_cache import asset_cache
+
+
+class Command(BaseCommand):
+    help = 'Evicts the expired & least recently used objects of the disk tier of the asset cache (ASSET_CACHE setting)'
+
+    def handle(self, *args, **options):
+        asset_cache.load_settings()
+        report = asset_cache.prune()
+        if report is None:
+            self.stdout.write('{} is being pruned by another process, or does not exist'.format(asset_cache.directory))
+            return
+        self.stdout.write('Removed {removed} objects, {bytes} bytes left'.format(**report))
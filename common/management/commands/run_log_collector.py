@@ -0,0 +1,29 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from common.logging.collector import LogCollector
+
+
+class Command(BaseCommand):
+    help = 'Runs the per host log collector for the queued logging handlers configured with collector_socket'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', dest='socket_path',
+                            default=getattr(settings, 'LOGGING_COLLECTOR_SOCKET', None),
+                            help='path of the unix socket to listen on. Default is the LOGGING_COLLECTOR_SOCKET setting')
+
+    def handle(self, *args, **options):
+        socket_path = options['socket_path']
+        if not socket_path:
+            self.stderr.write('No socket path specified. Set --socket or the LOGGING_COLLECTOR_SOCKET setting')
+            return
+
+        collector = LogCollector(socket_path)
+        signal.signal(signal.SIGTERM, lambda signum, frame: collector.stop())
+        self.stdout.write('Log collector listening on {}'.format(socket_path))
+        try:
+            collector.serve_forever()
+        except KeyboardInterrupt:
+            collector.stop()
@@ -0,0 +1,201 @@
+"""
+Local http servers of the tests -- a file server with Range requests & an S3 compatible stand-in
+"""
+import hashlib
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.etree import ElementTree
+
+
+class LocalServer:
+    """
+    Threaded http server on a free local port, run on a daemon thread until stopped
+    """
+
+    def __init__(self, handler_class):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.server.owner = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_port
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        owner = self.server.owner
+        owner.requests.append(dict(self.headers))
+        time.sleep(owner.delays.get(self.path, 0))
+        data = owner.data
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match and owner.ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), len(data) - 1) if match.group(2) else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(data)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if owner.fail_segments and start > 0:
+                self.send_response(500)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(data)))
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header('ETag', owner.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RangeServer(LocalServer):
+    """
+    Serves data at any path, with Range requests unless ranges=False; fail_segments answers the ranges not starting at 0
+        with a 500 & delays holds the seconds to wait before answering a path
+    """
+
+    def __init__(self, data, ranges=True, etag='"v1"'):
+        super().__init__(RangeHandler)
+        self.data = data
+        self.ranges = ranges
+        self.etag = etag
+        self.fail_segments = False
+        self.delays = {}
+        self.requests = []
+
+    def url(self, path='/file.bin'):
+        return 'http://127.0.0.1:{}{}'.format(self.port, path)
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    """
+    The object & multipart upload calls of the S3 api, path style (/bucket/key), without authentication
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def parse(self):
+        url = urlsplit(self.path)
+        return url.path.lstrip('/').split('/', 1)[1], parse_qs(url.query, keep_blank_values=True)
+
+    def do_PUT(self):
+        owner = self.server.owner
+        key, query = self.parse()
+        body = self.read_body()
+        if 'acl' in query:
+            return self.respond(200)
+        with owner.lock:
+            if 'uploadId' in query:
+                owner.connections.add((query['uploadId'][0], self.client_address))
+                owner.uploads[query['uploadId'][0]][int(query['partNumber'][0])] = body
+            else:
+                owner.objects[key] = body
+        # the md5 of the content, as checked by the clients
+        self.respond(200, headers={'ETag': '"{}"'.format(hashlib.md5(body).hexdigest())})
+
+    def do_POST(self):
+        owner = self.server.owner
+        key, query = self.parse()
+        body = self.read_body()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            with owner.lock:
+                owner.uploads[upload_id] = {}
+            return self.respond(200, (
+                '<?xml version="1.0" encoding="UTF-8"?><InitiateMultipartUploadResult><Bucket>{}</Bucket>'
+                '<Key>{}</Key><UploadId>{}</UploadId></InitiateMultipartUploadResult>').format(
+                owner.bucket, key, upload_id).encode('utf-8'))
+
+        upload_id = query['uploadId'][0]
+        numbers = [int(element.text) for element in ElementTree.fromstring(body).iter('PartNumber')]
+        with owner.lock:
+            parts = owner.uploads.pop(upload_id)
+            owner.objects[key] = b''.join(parts[number] for number in numbers)
+            owner.completed.append((key, numbers))
+        self.respond(200, (
+            '<?xml version="1.0" encoding="UTF-8"?><CompleteMultipartUploadResult><Bucket>{}</Bucket><Key>{}</Key>'
+            '<ETag>"done"</ETag></CompleteMultipartUploadResult>').format(owner.bucket, key).encode('utf-8'))
+
+    def do_GET(self):
+        owner = self.server.owner
+        key, query = self.parse()
+        if 'uploadId' not in query:
+            with owner.lock:
+                body = owner.objects.get(key)
+            return self.respond(404) if body is None else self.respond(200, body)
+        # the parts listed by the clients to complete the upload
+        with owner.lock:
+            parts = sorted(owner.uploads.get(query['uploadId'][0], {}).items())
+        self.respond(200, (
+            '<?xml version="1.0" encoding="UTF-8"?><ListPartsResult><Bucket>{}</Bucket><Key>{}</Key>'
+            '<UploadId>{}</UploadId><IsTruncated>false</IsTruncated>{}</ListPartsResult>').format(
+            owner.bucket, key, query['uploadId'][0], ''.join(
+                '<Part><PartNumber>{}</PartNumber><ETag>"{}"</ETag><Size>{}</Size></Part>'.format(
+                    number, hashlib.md5(data).hexdigest(), len(data)) for number, data in parts)).encode('utf-8'))
+
+    def do_DELETE(self):
+        owner = self.server.owner
+        _, query = self.parse()
+        with owner.lock:
+            owner.uploads.pop(query.get('uploadId', [None])[0], None)
+            owner.aborted += 1
+        self.respond(204)
+
+
+class S3Server(LocalServer):
+    """
+    S3 compatible stand-in keeping the objects in memory; connection_kwargs are the boto.connect_s3 kwargs to reach it
+    """
+
+    def __init__(self, bucket='test-bucket'):
+        super().__init__(S3Handler)
+        self.bucket = bucket
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.uploads = {}
+        self.completed = []
+        self.aborted = 0
+        # (upload id, client address) of the part uploads
+        self.connections = set()
+
+    @property
+    def connection_kwargs(self):
+        return {'host': '127.0.0.1', 'port': self.port, 'is_secure': False,
+                'calling_format': 'boto.s3.connection.OrdinaryCallingFormat'}
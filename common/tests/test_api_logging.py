@@ -0,0 +1,43 @@
+from django.test import SimpleTestCase
+from rest_framework import viewsets
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from common.logging.mixins import APILoggingMixin
+
+
+class ErrorsOnlyViewSet(APILoggingMixin, viewsets.GenericViewSet):
+    authentication_classes = []
+    permission_classes = []
+    log_data_errors_only = True
+
+    def create(self, request):
+        status = int(request.data['status'])
+        request.data['status'] = 'changed by the view'
+        return Response({'status': status}, status=status)
+
+
+class ErrorsOnlyTests(SimpleTestCase):
+
+    def post(self, status):
+        view = ErrorsOnlyViewSet.as_view({'post': 'create'})
+        request = APIRequestFactory().post('/demo/', {'status': str(status)}, format='json')
+        with self.assertLogs(__name__, level='DEBUG') as logs:
+            view(request)
+        return [record.getMessage() for record in logs.records]
+
+    def test_success_logs_no_data(self):
+        messages = self.post(200)
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[0].startswith('API_IN '))
+        self.assertTrue(messages[1].startswith('API_OUT '))
+        self.assertNotIn('status', messages[0])
+
+    def test_error_logs_request_data_read_before_the_view(self):
+        messages = self.post(400)
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(messages[0].startswith('API_IN '))
+        self.assertTrue(messages[1].startswith('API_IN_WITH_DATA '))
+        self.assertIn('400', messages[1])
+        self.assertNotIn('changed by the view', messages[1])
+        self.assertTrue(messages[2].startswith('API_OUT_WITH_DATA '))
@@ -0,0 +1,56 @@
+import asyncio
+import socket
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from common.tests.servers import RangeServer
+from common.utils.logged_requests import AsyncLoggedRequests, RequestLogger
+from common.utils.resilience import BUDGET_HEADER, deadline, resilience
+
+
+class AsyncLoggedRequestsTests(SimpleTestCase):
+    """
+    AsyncLoggedRequests against the local server of common.tests.servers
+    """
+
+    def setUp(self):
+        self.server = RangeServer(b'content').start()
+        self.addCleanup(self.server.stop)
+        for attribute, value in (('_settings_loaded', True), ('budget_hosts', frozenset(['127.0.0.1']))):
+            patch = mock.patch.object(resilience, attribute, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def run_async(self, coroutine):
+        async def run():
+            try:
+                return await coroutine
+            finally:
+                await asyncio.sleep(0.1)
+        return asyncio.run(run())
+
+    async def get_within_budget(self, url, seconds):
+        with deadline(seconds):
+            return await AsyncLoggedRequests.get(url)
+
+    def test_budget_header_sent(self):
+        response = self.run_async(self.get_within_budget(self.server.url(), 5))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'content')
+        self.assertLessEqual(int(self.server.requests[0][BUDGET_HEADER]), 5000)
+
+    def test_failure_logged(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            url = 'http://127.0.0.1:{}/'.format(sock.getsockname()[1])
+
+        with mock.patch.object(RequestLogger, 'log_error') as log_error:
+            with self.assertRaises(Exception):
+                self.run_async(AsyncLoggedRequests.get(url, retries=1))
+            RequestLogger.get_log_executor().submit(lambda: None).result()
+
+        self.assertEqual(log_error.call_count, 1)
+        error = log_error.call_args[1]['error']
+        self.assertEqual(error.resilience['attempts'], 2)
@@ -0,0 +1,26 @@
+import time
+
+from django.test import SimpleTestCase
+
+from common.tests.servers import RangeServer
+from common.utils.logged_requests import LoggedRequests
+
+
+class BatchTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = RangeServer(b'content').start()
+        self.addCleanup(self.server.stop)
+
+    def test_deadline(self):
+        self.server.delays['/slow'] = 2
+        start = time.monotonic()
+
+        results = LoggedRequests.batch([{'url': self.server.url('/fast')}, {'url': self.server.url('/slow')},
+                                        {'url': self.server.url('/fast')}], max_workers=2, deadline=0.5)
+
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertTrue(results[0].ok)
+        self.assertEqual(results[0].response.content, b'content')
+        self.assertFalse(results[1].ok)
+        self.assertTrue(results[2].ok)
@@ -0,0 +1,47 @@
+import logging
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from common.logging.adapters import MessageAdapter
+from common.logging.builders import MessageTemplate, split_field_name
+from common.logging.message_types import MESSAGE_TYPE
+
+
+class SplitFieldNameTests(SimpleTestCase):
+
+    def test_split(self):
+        self.assertEqual(split_field_name('request'), ('request', []))
+        self.assertEqual(split_field_name('0'), (0, []))
+        self.assertEqual(split_field_name('request.META[REMOTE_ADDR]'),
+                         ('request', [(True, 'META'), (False, 'REMOTE_ADDR')]))
+        self.assertEqual(split_field_name('items[12].id'), ('items', [(False, 12), (True, 'id')]))
+
+    def test_invalid(self):
+        for field_name in ('request.', 'items[0'):
+            with self.assertRaises(ValueError):
+                split_field_name(field_name)
+
+    def test_template_render(self):
+        template = MessageTemplate('IN {request.method} {items[1]!r}:{count:03d}', 'message')
+
+        self.assertEqual(template.render({'request': mock.Mock(method='GET'), 'items': ['a', 'b'], 'count': 7}),
+                         "IN GET 'b':007")
+
+
+class MessageAdapterTests(SimpleTestCase):
+
+    def test_disabled_levels_skip_building(self):
+        logger = logging.getLogger('common.tests.disabled')
+        logger.setLevel(logging.CRITICAL)
+        self.addCleanup(logger.setLevel, logging.NOTSET)
+        adapter = MessageAdapter(logger, structured=False)
+
+        with mock.patch.object(MessageAdapter, 'process') as process:
+            message_type = MESSAGE_TYPE(format='TEST {value}')
+            adapter.info(message_type=message_type, value=1)
+            adapter.debug(message_type=message_type, value=1)
+            adapter.exception(message_type=message_type, value=1)
+            adapter.log(logging.WARNING, message_type=message_type, value=1)
+
+        process.assert_not_called()
@@ -0,0 +1,55 @@
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from common.logging import handlers
+from common.logging.handlers import LogFileMaintainer
+
+
+class CompressTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, 'app.log.2024-01-01')
+        with open(self.path, 'wb') as file_obj:
+            file_obj.write(b'line\n' * 1000)
+
+    def assert_compressed(self):
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.compressing'))
+        with gzip.open(self.path + '.gz') as file_obj:
+            self.assertEqual(file_obj.read(), b'line\n' * 1000)
+
+    def test_lock_left_by_crashed_process(self):
+        open(self.path + '.compressing', 'w').close()
+
+        LogFileMaintainer().compress(self.path, 'gzip')
+
+        self.assert_compressed()
+
+    def test_stale_lock_without_flock(self):
+        lock_path = self.path + '.compressing'
+        open(lock_path, 'w').close()
+        maintainer = LogFileMaintainer()
+
+        with mock.patch.object(handlers, 'fcntl', None):
+            maintainer.compress(self.path, 'gzip')
+            self.assertTrue(os.path.exists(self.path))
+
+            os.utime(lock_path, (0, 0))
+            maintainer.compress(self.path, 'gzip')
+
+        self.assert_compressed()
+
+    def test_locked_by_another_process(self):
+        lock_fd = LogFileMaintainer().lock_compression(self.path + '.compressing')
+        self.addCleanup(os.close, lock_fd)
+
+        LogFileMaintainer().compress(self.path, 'gzip')
+
+        self.assertTrue(os.path.exists(self.path))
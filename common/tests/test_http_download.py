@@ -0,0 +1,130 @@
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from common.tests.servers import RangeServer
+from common.utils.http import HttpOperations
+
+
+class DownloadTests(SimpleTestCase):
+    """
+    HttpOperations.download & download_to_temp against the local Range server of common.tests.servers
+    """
+    data = os.urandom(64 * 1024) * 8
+
+    def setUp(self):
+        self.server = RangeServer(self.data).start()
+        self.addCleanup(self.server.stop)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        patch = mock.patch.object(HttpOperations, 'temp_download_directory', os.path.join(self.directory, 'downloads'))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def read(self, path):
+        with open(path, 'rb') as file_obj:
+            return file_obj.read()
+
+    def test_download_identity(self):
+        path = os.path.join(self.directory, 'file.bin')
+        progress = []
+
+        size = HttpOperations.download(self.server.url(), path, segments=1,
+                                       progress=lambda *args: progress.append(args))
+
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(self.read(path), self.data)
+        self.assertEqual(progress[-1][:2], (len(self.data), len(self.data)))
+        self.assertEqual(self.server.requests[0]['Accept-Encoding'], 'identity')
+        self.assertFalse(os.path.exists('{}.validator'.format(path)))
+
+    def test_resume(self):
+        path = os.path.join(self.directory, 'file.bin')
+        with open(path, 'wb') as file_obj:
+            file_obj.write(self.data[:1000])
+        HttpOperations.write_validator(path, '"v1"')
+
+        HttpOperations.download(self.server.url(), path, segments=1)
+
+        self.assertEqual(self.server.requests[0]['Range'], 'bytes=1000-')
+        self.assertEqual(self.server.requests[0]['If-Range'], '"v1"')
+        self.assertEqual(self.read(path), self.data)
+
+    def test_complete_partial_file(self):
+        path = os.path.join(self.directory, 'file.bin')
+        with open(path, 'wb') as file_obj:
+            file_obj.write(self.data)
+        HttpOperations.write_validator(path, '"v1"')
+
+        self.assertEqual(HttpOperations.download(self.server.url(), path), len(self.data))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_unsatisfiable_range_starts_over(self):
+        path = os.path.join(self.directory, 'file.bin')
+        with open(path, 'wb') as file_obj:
+            file_obj.write(b'\0' * (len(self.data) + 10))
+        HttpOperations.write_validator(path, '"v1"')
+
+        HttpOperations.download(self.server.url(), path, segments=1)
+
+        self.assertEqual(self.read(path), self.data)
+
+    def test_segments(self):
+        path = os.path.join(self.directory, 'file.bin')
+
+        HttpOperations.download(self.server.url(), path, segments=4)
+
+        self.assertEqual(self.read(path), self.data)
+        self.assertEqual(sorted(request['Range'] for request in self.server.requests[1:]),
+                         sorted('bytes={}-{}'.format(start, start + 128 * 1024 - 1)
+                                for start in range(0, len(self.data), 128 * 1024)))
+
+    def test_failed_segments_leave_nothing_to_resume(self):
+        path = os.path.join(self.directory, 'file.bin')
+        self.server.fail_segments = True
+
+        with mock.patch.object(HttpOperations, 'segment_retries', 0), self.assertRaises(IOError):
+            HttpOperations.download(self.server.url(), path, segments=4)
+
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists('{}.validator'.format(path)))
+
+    def test_encoded_response(self):
+        compressed = gzip.compress(self.data)
+        path = os.path.join(self.directory, 'file.bin')
+
+        def encoded_response(handler):
+            handler.send_response(200)
+            handler.send_header('Content-Encoding', 'gzip')
+            handler.send_header('Content-Length', str(len(compressed)))
+            handler.end_headers()
+            handler.wfile.write(compressed)
+
+        with mock.patch('common.tests.servers.RangeHandler.do_GET', encoded_response):
+            self.assertEqual(HttpOperations.download(self.server.url(), path), len(self.data))
+        self.assertEqual(self.read(path), self.data)
+
+    def test_download_to_temp_keeps_returned_files(self):
+        first = HttpOperations.download_to_temp(self.server.url(), 'file.bin', segments=1)
+        second = HttpOperations.download_to_temp(self.server.url(), 'file.bin', segments=1)
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.read(first), self.data)
+        self.assertEqual(self.read(second), self.data)
+
+    def test_download_to_temp_resumes_failed_download(self):
+        part_path, lock_file = HttpOperations.get_temp_part_path(self.server.url(), 'file.bin')
+        lock_file.close()
+        with open(part_path, 'wb') as file_obj:
+            file_obj.write(self.data[:5000])
+        HttpOperations.write_validator(part_path, '"v1"')
+
+        path = HttpOperations.download_to_temp(self.server.url(), 'file.bin', segments=1)
+
+        self.assertEqual(self.server.requests[0]['Range'], 'bytes=5000-')
+        self.assertEqual(self.read(path), self.data)
+        self.assertFalse(os.path.exists(part_path))
@@ -0,0 +1,20 @@
+from django.test import SimpleTestCase
+
+from common.utils.http_sessions import SessionRegistry
+
+
+class SessionRegistryTests(SimpleTestCase):
+
+    def test_host_overrides_match_the_exact_host(self):
+        registry = SessionRegistry()
+        registry.configure(hosts={'api.example.com': {'pool_maxsize': 2},
+                                  'internal.example.com:8443': {'pool_maxsize': 3}})
+        session = registry.get_session()
+        default = session.get_adapter('http://other.example.com/')
+
+        self.assertIsNot(session.get_adapter('http://api.example.com/path'), default)
+        self.assertIsNot(session.get_adapter('https://api.example.com/path'), default)
+        self.assertIsNot(session.get_adapter('https://internal.example.com:8443/path'), default)
+        self.assertIs(session.get_adapter('http://api.example.com.evil.org/path'), default)
+        self.assertIs(session.get_adapter('http://api.example.com:8080/path'), default)
+        self.assertIs(session.get_adapter('https://internal.example.com/path'), default)
@@ -0,0 +1,70 @@
+import random
+import threading
+
+from django.test import SimpleTestCase
+
+from common.logging.metrics import LatencyHistogram, LatencyMetrics
+
+
+class LatencyHistogramTests(SimpleTestCase):
+
+    def histogram(self, values):
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.record(value)
+        return histogram
+
+    def test_merge_equals_single_histogram(self):
+        values = [random.randint(0, 5000000) for _ in range(5000)]
+        merged = self.histogram(values[:2000]).merge(self.histogram(values[2000:]))
+        single = self.histogram(values)
+
+        self.assertEqual(merged.to_dict(), single.to_dict())
+        self.assertEqual(merged.percentile(99), single.percentile(99))
+
+    def test_merge_copies_counts(self):
+        other = self.histogram([10, 20000])
+        merged = LatencyHistogram().merge(other)
+        other.record(30000000)
+
+        self.assertEqual(merged.count, 2)
+        self.assertEqual(sum(merged.counts.values()), 2)
+
+    def test_percentile_error(self):
+        values = sorted(random.randint(1000, 10000000) for _ in range(10000))
+        histogram = self.histogram(values)
+        for percent in (50, 90, 99):
+            exact = values[int(len(values) * percent / 100.0) - 1]
+            self.assertLessEqual(abs(histogram.percentile(percent) - exact) / exact, 1.0 / LatencyHistogram.sub_buckets)
+
+    def test_cumulative_buckets_fixed_bounds(self):
+        histogram = self.histogram([500, 700, 3000, 2000000])
+        buckets = histogram.cumulative_buckets()
+
+        self.assertEqual([bound for bound, _ in buckets], list(LatencyHistogram.export_bounds))
+        self.assertEqual(dict(buckets)[1000], 2)
+        self.assertEqual(dict(buckets)[5000], 3)
+        self.assertEqual(buckets[-1][1], 4)
+        self.assertEqual([count for _, count in LatencyHistogram().cumulative_buckets()],
+                         [0] * len(LatencyHistogram.export_bounds))
+
+    def test_dict_round_trip(self):
+        histogram = self.histogram([1, 100, 100000])
+
+        self.assertEqual(LatencyHistogram.from_dict(histogram.to_dict()).to_dict(), histogram.to_dict())
+
+
+class LatencyMetricsTests(SimpleTestCase):
+
+    def test_shards_of_exited_threads_are_retired(self):
+        metrics = LatencyMetrics()
+        for _ in range(20):
+            thread = threading.Thread(target=metrics.record, args=('route', 200, 0.01))
+            thread.start()
+            thread.join()
+        metrics.record('route', 200, 0.02)
+
+        self.assertEqual(len(metrics._shards), 1)
+        histograms = metrics.snapshot()
+        self.assertEqual(histograms[('route', 200)].count, 21)
+        self.assertEqual(metrics.snapshot()[('route', 200)].count, 21)
@@ -0,0 +1,44 @@
+import time
+
+from django.test import SimpleTestCase
+
+from common.utils.resilience import BUDGET_HEADER, Resilience, deadline
+
+
+class FakeResponse:
+    status_code = 200
+
+    def close(self):
+        pass
+
+
+class ResilienceTests(SimpleTestCase):
+
+    def setUp(self):
+        self.sent = []
+
+    def send(self, method, url, **kwargs):
+        self.sent.append((url, (kwargs.get('headers') or {}).get(BUDGET_HEADER)))
+        time.sleep(0.05)
+        return FakeResponse()
+
+    def test_budget_header_sent_only_to_budget_hosts(self):
+        resilience = Resilience()
+        resilience.configure(budget_hosts=['internal.svc'])
+        with deadline(5):
+            resilience.send(self.send, 'GET', 'http://internal.svc:8080/path')
+            resilience.send(self.send, 'GET', 'http://internal.svc.example.org/path')
+            resilience.send(self.send, 'GET', 'https://example.org/path')
+
+        self.assertIsNotNone(self.sent[0][1])
+        self.assertLessEqual(int(self.sent[0][1]), 5000)
+        self.assertEqual([budget for _, budget in self.sent[1:]], [None, None])
+
+    def test_hedged_attempts_recorded(self):
+        resilience = Resilience()
+        resilience.configure(default={'hedge': True, 'hedge_delay': 0.01})
+        response = resilience.send(self.send, 'GET', 'http://internal.svc/path', hedge=True)
+
+        self.assertEqual(response.resilience['attempts'], 2)
+        self.assertTrue(response.resilience['hedged'])
+        self.assertIn(response.resilience['winner'], ('primary', 'hedge'))
@@ -0,0 +1,104 @@
+import os
+import tempfile
+from unittest import mock, skipIf
+
+from django.test import SimpleTestCase
+
+from common.tests.servers import S3Server
+
+try:
+    from common.utils.s3 import S3Operations
+except ImportError:
+    S3Operations = None
+
+MB = 1024 * 1024
+
+
+@skipIf(S3Operations is None, 'boto is not installed')
+class S3UploadTests(SimpleTestCase):
+    """
+    Uploads of S3Operations to the S3 compatible stand-in of common.tests.servers
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = S3Server().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(S3Operations, 'connection_kwargs', self.server.connection_kwargs),
+            mock.patch.object(S3Operations, 'bucket_name', self.server.bucket),
+            mock.patch.object(S3Operations, 'access_key_id', 'key-id'),
+            mock.patch.object(S3Operations, 'secret_access_key', 'secret'),
+            # 5MB is the smallest part size of S3
+            mock.patch.object(S3Operations, 'multipart_threshold', 8 * MB),
+            mock.patch.object(S3Operations, 'multipart_part_size', 5 * MB),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        S3Operations.clear_connections()
+        self.addCleanup(S3Operations.clear_connections)
+
+    def write_file(self, size):
+        file_obj = tempfile.NamedTemporaryFile(delete=False)
+        self.addCleanup(os.remove, file_obj.name)
+        data = os.urandom(size)
+        with file_obj:
+            file_obj.write(data)
+        return file_obj.name, data
+
+    def test_small_file_single_request_reports_progress(self):
+        file_path, data = self.write_file(MB)
+        progress = []
+
+        key, url = S3Operations.push_via_file_path(file_path, 'small.bin', 'dir', mode='private',
+                                                   progress=lambda *args: progress.append(args))
+
+        self.assertEqual(key, 'dir/small.bin')
+        self.assertIn('dir/small.bin', url)
+        self.assertEqual(self.server.objects['dir/small.bin'], data)
+        self.assertEqual(progress[-1][:2], (len(data), len(data)))
+
+    def test_large_file_multipart_upload(self):
+        file_path, data = self.write_file(17 * MB)
+        completed = len(self.server.completed)
+        progress = []
+
+        key, _ = S3Operations.push_via_file_path(file_path, 'large.bin', 'dir', mode='private', workers=3,
+                                                 progress=lambda *args: progress.append(args))
+
+        self.assertEqual(key, 'dir/large.bin')
+        self.assertEqual(self.server.objects['dir/large.bin'], data)
+        self.assertEqual(self.server.completed[completed:], [('dir/large.bin', [1, 2, 3, 4])])
+        self.assertEqual(progress[-1][:2], (len(data), len(data)))
+        # the workers upload over connections of their own
+        self.assertGreater(len({address for _, address in self.server.connections}), 1)
+
+    def test_part_size_passed_through(self):
+        file_path, data = self.write_file(12 * MB)
+        completed = len(self.server.completed)
+
+        S3Operations.push_via_file_path(file_path, 'parts.bin', 'dir', mode='private', part_size=6 * MB, workers=2)
+
+        self.assertEqual(self.server.completed[completed:], [('dir/parts.bin', [1, 2])])
+        self.assertEqual(self.server.objects['dir/parts.bin'], data)
+
+    def test_failed_part_aborts_upload(self):
+        file_path, _ = self.write_file(10 * MB)
+        aborted = self.server.aborted
+
+        with mock.patch.object(S3Operations, 'multipart_retries', 0), \
+                mock.patch('boto.s3.multipart.MultiPartUpload.upload_part_from_file', side_effect=IOError('down')):
+            key, url = S3Operations.push_via_file_path(file_path, 'failed.bin', 'dir', mode='private')
+
+        self.assertEqual((key, url), (None, None))
+        self.assertNotIn('dir/failed.bin', self.server.objects)
+        self.assertEqual(self.server.aborted, aborted + 1)
+        self.assertEqual(self.server.uploads, {})
@@ -0,0 +1,85 @@
+import io
+import os
+import tempfile
+import zipfile
+
+from django.test import SimpleTestCase
+
+from common.utils.zip_stream import ZIP_DEFLATED, ZIP_STORED, ZipStream
+
+
+class ZipStreamTests(SimpleTestCase):
+
+    def read_archive(self, archive):
+        data = b''.join(archive)
+        self.assertEqual(len(data), archive.offset)
+        zip_file = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(zip_file.testzip())
+        return zip_file
+
+    def test_sources(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'file.txt')
+            with open(path, 'wb') as file_obj:
+                file_obj.write(b'from a path' * 1000)
+            os.chmod(path, 0o600)
+
+            archive = ZipStream()
+            archive.add('path.txt', path)
+            archive.add('bytes.bin', os.urandom(100000), compression=ZIP_STORED)
+            archive.add('file_obj.txt', io.BytesIO(b'from a file object'))
+            archive.add('generator.csv', (b'%d,row\n' % number for number in range(10000)))
+            archive.add('café.txt', b'utf-8 name')
+            zip_file = self.read_archive(archive)
+
+            self.assertEqual(zip_file.read('path.txt'), b'from a path' * 1000)
+            self.assertEqual(zip_file.getinfo('path.txt').external_attr >> 16 & 0o777, 0o600)
+            self.assertEqual(zip_file.getinfo('bytes.bin').compress_type, ZIP_STORED)
+            self.assertEqual(zip_file.getinfo('generator.csv').compress_type, ZIP_DEFLATED)
+            self.assertEqual(zip_file.read('file_obj.txt'), b'from a file object')
+            self.assertEqual(zip_file.read('generator.csv'), b''.join(b'%d,row\n' % n for n in range(10000)))
+            self.assertEqual(zip_file.read('café.txt'), b'utf-8 name')
+
+    def test_add_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, 'sub'))
+            for name in ('a.txt', 'sub/b.txt'):
+                with open(os.path.join(directory, name), 'w') as file_obj:
+                    file_obj.write(name)
+            archive = ZipStream()
+            archive.add_directory(directory, prefix='export')
+            zip_file = self.read_archive(archive)
+
+        self.assertEqual(zip_file.namelist(), ['export/a.txt', 'export/sub/b.txt'])
+        self.assertEqual(zip_file.read('export/sub/b.txt'), b'sub/b.txt')
+
+    def test_parallel_compression(self):
+        contents = [os.urandom(1000) * (index + 1) * 50 for index in range(6)]
+        archive = ZipStream(workers=3, chunk_size=4096)
+        for index, content in enumerate(contents):
+            archive.add('{}.bin'.format(index), content)
+        chunks = list(archive)
+        zip_file = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+        self.assertTrue(all(len(chunk) >= 4096 for chunk in chunks[:-1]))
+        for index, content in enumerate(contents):
+            self.assertEqual(zip_file.read('{}.bin'.format(index)), content)
+
+    def test_force_zip64(self):
+        archive = ZipStream(force_zip64=True)
+        archive.add('stream.txt', iter([b'zip64 ', b'entry']))
+        zip_file = self.read_archive(archive)
+
+        self.assertEqual(zip_file.read('stream.txt'), b'zip64 entry')
+
+    def test_changed_source(self):
+        with tempfile.NamedTemporaryFile() as file_obj:
+            file_obj.write(b'before')
+            file_obj.flush()
+            archive = ZipStream()
+            archive.add('changed.txt', file_obj.name)
+            file_obj.write(b' & after')
+            file_obj.flush()
+
+            with self.assertRaises(ValueError):
+                b''.join(archive)
@@ -1,5 +1,7 @@
 import inspect
 import logging
+import os
+import sys
 
 from common.utils.exception import ExceptionLogger
 from common.utils.vars import unauthorized
@@ -75,15 +77,100 @@ def split_str(string, data_type=str):
     return split_string
 
 
+# caches of the caller lookups -- (filename, working directory) -> relative file, code object -> logger, (code
+# object, class) -> scope
+_caller_files = {}
+_caller_loggers = {}
+_func_scopes = {}
+
+
+def get_caller_frame(stack_depth=1):
+    """
+    Get the frame of the caller by walking the frames directly -- unlike inspect.stack(), no frame info or source lines
+        are read for the whole stack
+    :param stack_depth: 1 for the caller of the function calling get_caller_frame, 2 for its caller & so on
+    :return: the frame, None if the stack is not that deep
+    """
+    try:
+        return sys._getframe(stack_depth + 1)
+    except ValueError:
+        return None
+
+
+def _get_frame_file(frame):
+    cwd = os.getcwd()
+    key = (frame.f_code.co_filename, cwd)
+    caller_file = _caller_files.get(key)
+    if caller_file is None:
+        caller_file = _caller_files[key] = frame.f_code.co_filename.replace('{}/'.format(cwd), '')
+    return caller_file
+
+
 def get_caller_file(stack_depth=1):
     try:
-        return inspect.stack()[stack_depth + 1].filename.replace('{}/'.format(os.getcwd()), '')
+        return _get_frame_file(sys._getframe(stack_depth + 1))
     except:
         return None
 
 
+def get_caller_name(stack_depth=1):
+    """
+    :return: the function name of the caller at stack_depth (see get_caller_frame), None if the stack is not that deep
+    """
+    try:
+        return sys._getframe(stack_depth + 1).f_code.co_name
+    except ValueError:
+        return None
+
+
+def _is_configured(caller_logger):
+    """
+    :return: True if the logger or one of its ancestors below the root logger has handlers or a level of its own
+        (e.g. the 'common', 'dummy_app' & 'project' loggers of the LOGGING setting)
+    """
+    while caller_logger is not None and caller_logger.parent is not None:
+        if caller_logger.handlers or caller_logger.level != logging.NOTSET:
+            return True
+        caller_logger = caller_logger.parent
+    return False
+
+
 def get_caller_logger(stack_depth=1, default_logger=None):
-    caller_file = get_caller_file(stack_depth=stack_depth + 1)
-    if caller_file:
-        return logging.getLogger(caller_file)
-    return default_logger
+    """
+    Get the logger named after the module of the caller (e.g. dummy_app.views), or default_logger if neither the logger
+        nor its ancestors are configured, so that the records are not dropped by the root logger. The logger is cached
+        per code object of the caller; its name does not depend on the working directory.
+    """
+    try:
+        frame = sys._getframe(stack_depth + 1)
+    except ValueError:
+        return default_logger
+
+    caller_logger = _caller_loggers.get(frame.f_code)
+    if caller_logger is None:
+        module_name = frame.f_globals.get('__name__')
+        if not module_name:
+            return default_logger
+        caller_logger = _caller_loggers[frame.f_code] = logging.getLogger(module_name)
+    # checked on every call, as the LOGGING setting may be applied after the first lookup
+    if default_logger is not None and not _is_configured(caller_logger):
+        return default_logger
+    return caller_logger
+
+
+def get_func_scope(func, args=()):
+    """
+    Get the scope name of the function -- module.function, or module.Class.function if the function is a method of
+        the class of the first argument. Cached per code object & class.
+    """
+    cls = args[0].__class__ if args else None
+    key = (getattr(func, '__code__', func), cls)
+    scope = _func_scopes.get(key)
+    if scope is None:
+        module_name = getattr(func, '__module__', None) or inspect.getmodule(func).__name__
+        if cls is not None and hasattr(cls, func.__name__):
+            scope = '{}.{}.{}'.format(module_name, cls.__name__, func.__name__)
+        else:
+            scope = '{}.{}'.format(module_name, func.__name__)
+        _func_scopes[key] = scope
+    return scope
@@ -1,8 +1,14 @@
-import inspect
+import atexit
+import fcntl
 import os
 import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
 
-__all__ = ['FileOperations']
+from common.utils import get_caller_name
+
+__all__ = ['FileOperations', 'TempWorkspace', 'SpillingFile']
 
 
 class FileOperations:
@@ -21,8 +27,8 @@ class FileOperations:
         :param expected: the expected data type; by default this is str
         :return: assertion error if failed
         """
-        caller = inspect.stack()[1][3]
-        assert type(item) is expected, '{} received {} as {}:{}'.format(caller, item_name, type(item), str(item))
+        assert type(item) is expected, '{} received {} as {}:{}'.format(
+            get_caller_name(), item_name, type(item), str(item))
 
     @classmethod
     def remove_directory(cls, directory):
@@ -112,6 +118,28 @@ class FileOperations:
             return None
         return zip_path
 
+    @classmethod
+    @contextmanager
+    def temp_workspace(cls, prefix='workspace-', root=None, memory=None, spill_bytes=None):
+        """
+        A unique temp directory for the files of a call, removed with its files on exit
+            with FileOperations.temp_workspace(memory='memfd') as workspace:
+                with workspace.open('report.csv') as file_obj:
+                    ...
+                upload(workspace.path_of('report.csv'))
+        :param prefix: the prefix of the directory name
+        :param root: the parent directory. Default is TempWorkspace.root
+        :param memory: None for the files on disk, 'memfd' for anonymous memory files or 'tmpfs' for /dev/shm files.
+            The memory files are moved to the disk when they grow beyond spill_bytes.
+        :param spill_bytes: default is TempWorkspace.spill_bytes
+        :return: the TempWorkspace
+        """
+        workspace = TempWorkspace(prefix=prefix, root=root, memory=memory, spill_bytes=spill_bytes)
+        try:
+            yield workspace
+        finally:
+            workspace.cleanup()
+
     @classmethod
     def create_parent_directory(cls, path):
         cls.assert_type('path', path)
@@ -123,3 +151,230 @@ class FileOperations:
             print('Error creating parent directory of {} : {}'.format(path, e))
             return False
         return True
+
+
+class SpillingFile:
+    """
+    Binary file in memory (a memfd or a tmpfs file) moved to disk_path when it grows beyond spill_bytes. Takes the
+        methods of the underlying file object; path is the current path of the file for the other functions of the
+        process (/proc/self/fd/<fd> for a memfd) & is valid until the file is closed.
+    """
+
+    def __init__(self, file_obj, memory_path, disk_path, spill_bytes):
+        self.file = file_obj
+        # None for a memfd
+        self.memory_path = memory_path
+        self.disk_path = disk_path
+        self.spill_bytes = spill_bytes
+        self.spilled = False
+
+    @property
+    def path(self):
+        if self.spilled:
+            return self.disk_path
+        return self.memory_path or '/proc/{}/fd/{}'.format(os.getpid(), self.file.fileno())
+
+    @property
+    def name(self):
+        return self.path
+
+    def write(self, data):
+        if not self.spilled and self.file.tell() + len(data) > self.spill_bytes:
+            self.spill()
+        return self.file.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def truncate(self, size=None):
+        if not self.spilled and size is not None and size > self.spill_bytes:
+            self.spill()
+        return self.file.truncate(size)
+
+    def spill(self):
+        """
+        Move the contents to disk_path, keeping the position
+        """
+        position = self.file.tell()
+        self.file.flush()
+        self.file.seek(0)
+        disk_file = open(self.disk_path, 'w+b')
+        shutil.copyfileobj(self.file, disk_file, 1024 * 1024)
+        disk_file.seek(position)
+        self.file.close()
+        if self.memory_path:
+            os.remove(self.memory_path)
+        self.file = disk_file
+        self.spilled = True
+
+    def close(self):
+        self.file.close()
+        if not self.spilled and self.memory_path and os.path.exists(self.memory_path):
+            os.remove(self.memory_path)
+
+    def __getattr__(self, item):
+        return getattr(self.file, item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.file)
+
+
+class TempWorkspace:
+    """
+    Unique temp directory of a call -- FileOperations.temp_workspace(). Concurrent calls never share their files.
+    The directory holds a shared lock on its LOCK_NAME file while it is in use, so cleanup jobs can skip the live
+        workspaces. Workspaces not cleaned up are removed at the exit of the process.
+    Files opened with open() are kept in memory (memory='memfd' or 'tmpfs') until they grow beyond spill_bytes, & are
+        then moved to the directory; path_of() is the current path of a file. memfd falls back to tmpfs & tmpfs to the
+        disk when not available, for the workspace & for the memory override of every open(). The tmpfs directory
+        is created with the first tmpfs file.
+    """
+    root = os.path.join(tempfile.gettempdir(), 'workspaces')
+    tmpfs_root = '/dev/shm'
+    spill_bytes = 8 * 1024 * 1024
+    LOCK_NAME = '.workspace.lock'
+
+    # path -> workspace of the process, removed at exit if still there
+    live = {}
+    live_lock = threading.Lock()
+
+    def __init__(self, prefix='workspace-', root=None, memory=None, spill_bytes=None):
+        self.memory = self.get_memory(memory)
+        self.spill_bytes = self.spill_bytes if spill_bytes is None else spill_bytes
+
+        os.makedirs(root or self.root, exist_ok=True)
+        self.prefix = prefix
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root or self.root)
+        # the tmpfs directory of the workspace, created by the first tmpfs file
+        self.memory_path = None
+        self.lock_file = open(os.path.join(self.path, self.LOCK_NAME), 'w')
+        fcntl.flock(self.lock_file, fcntl.LOCK_SH)
+        self.pid = os.getpid()
+        self.files = {}
+        with self.live_lock:
+            self.live[self.path] = self
+
+        from common.utils.temp_janitor import temp_janitor
+        temp_janitor.ensure_running()
+
+    def __repr__(self):
+        return 'TempWorkspace({})'.format(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+    @classmethod
+    def get_memory(cls, memory):
+        """
+        :return: the memory option available on the host -- memfd falls back to tmpfs & tmpfs to None (disk)
+        """
+        if memory not in (None, False, 'memfd', 'tmpfs'):
+            raise ValueError('Invalid workspace memory {}'.format(memory))
+        if memory == 'memfd' and not hasattr(os, 'memfd_create'):
+            memory = 'tmpfs'
+        if memory == 'tmpfs' and not os.path.isdir(cls.tmpfs_root):
+            memory = None
+        return memory or None
+
+    def join(self, name):
+        """
+        :return: the disk path of the file name in the workspace
+        :raises ValueError: if the name is outside of the workspace
+        """
+        path = os.path.normpath(os.path.join(self.path, name))
+        if not path.startswith(self.path + os.sep):
+            raise ValueError('Invalid workspace file name {}'.format(name))
+        return path
+
+    def open(self, name, mode='w+b', memory=None):
+        """
+        Create a file in the workspace
+        :param name: the file name, relative to the workspace
+        :param mode: the file mode. Memory files are binary -- text modes always open disk files
+        :param memory: override of the memory option of the workspace for this file, False for disk
+        :return: the file object; a SpillingFile for the memory files
+        """
+        memory = self.memory if memory is None else self.get_memory(memory)
+        disk_path = self.join(name)
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        if not memory or 'b' not in mode or 'r' in mode:
+            return open(disk_path, mode)
+
+        file_obj = memory_path = None
+        if memory == 'memfd':
+            try:
+                file_obj = os.fdopen(os.memfd_create(os.path.basename(name)), 'w+b')
+            except OSError:
+                # e.g. not allowed by the seccomp policy of the container
+                memory = self.get_memory('tmpfs')
+                if not memory:
+                    return open(disk_path, mode)
+        if file_obj is None:
+            if self.memory_path is None:
+                self.memory_path = tempfile.mkdtemp(prefix=self.prefix, dir=self.tmpfs_root)
+            memory_path = os.path.join(self.memory_path, os.path.relpath(disk_path, self.path))
+            os.makedirs(os.path.dirname(memory_path), exist_ok=True)
+            file_obj = open(memory_path, 'w+b')
+        spilling_file = SpillingFile(file_obj, memory_path, disk_path, self.spill_bytes)
+        self.files[name] = spilling_file
+        return spilling_file
+
+    def path_of(self, name):
+        """
+        :return: the current path of the file name -- in memory or on disk
+        """
+        spilling_file = self.files.get(name)
+        if spilling_file is not None and not spilling_file.closed:
+            return spilling_file.path
+        return self.join(name)
+
+    def cleanup(self):
+        """
+        Close the memory files & remove the directories of the workspace
+        """
+        if os.getpid() != self.pid:
+            return
+        with self.live_lock:
+            if self.live.pop(self.path, None) is None:
+                return
+        for spilling_file in self.files.values():
+            try:
+                spilling_file.close()
+            except OSError:
+                pass
+        self.lock_file.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+        if self.memory_path:
+            shutil.rmtree(self.memory_path, ignore_errors=True)
+
+    @classmethod
+    def cleanup_all(cls):
+        for workspace in list(cls.live.values()):
+            workspace.cleanup()
+
+    @classmethod
+    def is_live(cls, path):
+        """
+        :return: True if the workspace directory is in use by a process
+        """
+        try:
+            with open(os.path.join(path, cls.LOCK_NAME)) as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True
+        return False
+
+
+atexit.register(TempWorkspace.cleanup_all)
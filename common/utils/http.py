@@ -1,13 +1,26 @@
+import contextvars
+import fcntl
+import hashlib
 import mimetypes
 import os
+import re
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from io import BytesIO
-from wsgiref.util import FileWrapper
+from urllib.parse import quote
 
-import requests
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
 
 from common.utils.file_ops import FileOperations as FOps
 from common.utils.exception import ExceptionLogger
+from common.utils.http_cache import asset_cache
+from common.utils.logged_requests import LoggedRequests
+from common.utils.temp_janitor import temp_janitor
 
 __all__ = ['HttpOperations']
 
@@ -17,41 +30,250 @@ class HttpOperations:
     Custom operations to be performed to for downloading or uploading files
     """
 
-    # temp file download path -- /tmp/temp_download/<filename>
-    temp_file_download_path_format = '/tmp/temp_download/{}'
+    # temp download directory -- a download is written to /tmp/temp_download/<hash of url & filename>/<filename>.part,
+    # so that a retry resumes it, & moved to /tmp/temp_download/<unique>/<filename> when complete
+    temp_download_directory = '/tmp/temp_download'
+    # deprecated -- the path format of the downloads (formatted with the filename) instead of the directories above,
+    # e.g. '/tmp/temp_download/{}'; concurrent downloads of the same filename overwrite each other
+    temp_file_download_path_format = None
+    DOWNLOAD_LOCK_NAME = '.download.lock'
+
+    # bytes read from the network & written at a time while downloading
+    download_chunk_size = 1024 * 1024
+    # files of at least this size are downloaded in parallel segments, if the server supports Range requests
+    segment_threshold = 32 * 1024 * 1024
+    max_segments = 4
+    # retries of a failed segment, resuming from the bytes received
+    segment_retries = 2
+    download_timeout = (3.05, 60)
+    content_range_pattern = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+    unsatisfied_range_pattern = re.compile(r'^bytes \*/(\d+)$')
+
+    # Range request header e.g. bytes=0-499,1000-
+    range_pattern = re.compile(r'^bytes=(\d*-\d*(?:\s*,\s*\d*-\d*)*)$')
+    # max ranges served in a multipart/byteranges response; the whole file is served for more
+    max_ranges = 10
 
     @classmethod
-    def downloadable_file(cls, file_path, download_name):
+    def downloadable_file(cls, file_path, download_name, request=None, content_type=None, offload=None):
         """
-        Create a HttpResponse object of the local file for downloading
+        Create a streaming response of the local file for downloading. The file is sent by the wsgi.file_wrapper of
+            the server (sendfile) when available, & closed when the response is closed.
+        With the request, the conditional (If-None-Match, If-Modified-Since) & Range (If-Range) requests are answered
+            with 304, 206 or 416 responses.
         :param file_path: the target file to be downloaded
         :param download_name: the filename with which the target file will be downloaded
-        :return: the HttpResponse object of the file if success else None
+        :param request: the django request, for the conditional & Range requests
+        :param content_type: the content type. Guessed from the file path by default
+        :param offload: dict to let the front server send the file (see offload_response). Default is the
+            HTTP_FILE_OFFLOAD django setting; False not to offload
+        :return: the response object of the file if success else None
         """
         try:
-            wrapper = FileWrapper(open(file_path, 'rb'))
-            content_type = mimetypes.guess_type(file_path)[0]
-            response = HttpResponse(wrapper, content_type=content_type)
-            response['Content-Length'] = os.path.getsize(file_path)
-            response['Content-Disposition'] = "attachment; filename={}".format(download_name)
+            stat = os.stat(file_path)
+            etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+            last_modified = int(stat.st_mtime)
+            content_type = content_type or mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+
+            if request is not None and cls.is_not_modified(request, etag, last_modified):
+                response = HttpResponseNotModified()
+                cls.set_file_headers(response, download_name, etag, last_modified)
+                return response
+
+            if offload is None:
+                from django.conf import settings
+                offload = getattr(settings, 'HTTP_FILE_OFFLOAD', None)
+            response = cls.offload_response(file_path, content_type, offload) if offload else None
+            if response is None:
+                ranges = cls.get_ranges(request, stat.st_size, etag, last_modified) if request is not None else None
+                response = cls.file_response(file_path, stat.st_size, content_type, ranges)
+            cls.set_file_headers(response, download_name, etag, last_modified)
         except:
             ExceptionLogger.print_exception()
             return None
 
         return response
 
+    @staticmethod
+    def set_file_headers(response, download_name, etag, last_modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        if response.status_code == 304:
+            return
+        response['Accept-Ranges'] = 'bytes'
+        HttpOperations.set_content_disposition(response, download_name)
+
+    @staticmethod
+    def set_content_disposition(response, download_name):
+        try:
+            download_name.encode('ascii')
+            response['Content-Disposition'] = 'attachment; filename={}'.format(download_name)
+        except UnicodeEncodeError:
+            response['Content-Disposition'] = "attachment; filename*=utf-8''{}".format(quote(download_name))
+
     @classmethod
-    def retrieve_image(cls, url):
+    def streaming_zip_response(cls, zip_stream, download_name):
+        """
+        Create a streaming response of the zip archive, sent as it is generated
+        :param zip_stream: the common.utils.zip_stream.ZipStream
+        :param download_name: the filename with which the archive will be downloaded
+        :return: the StreamingHttpResponse
+        """
+        response = StreamingHttpResponse(zip_stream, content_type='application/zip')
+        cls.set_content_disposition(response, download_name)
+        return response
+
+    @staticmethod
+    def is_not_modified(request, etag, last_modified):
+        """
+        :return: True if the copy of the client is current, as per If-None-Match or else If-Modified-Since
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            # weak comparison -- the W/ prefix is ignored
+            opaque_etags = [item[2:] if item.startswith('W/') else item for item in etags]
+            return '*' in etags or (etag[2:] if etag.startswith('W/') else etag) in opaque_etags
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return if_modified_since is not None and last_modified <= if_modified_since
+
+    @classmethod
+    def get_ranges(cls, request, size, etag, last_modified):
+        """
+        Parse the Range header of the request
+        :return: list of (start, end) byte ranges (end inclusive); None to serve the whole file; [] if not satisfiable
+        """
+        range_header = request.META.get('HTTP_RANGE')
+        if not range_header or request.method != 'GET':
+            return None
+
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+            # the file changed since the client got its part
+            return None
+
+        match = cls.range_pattern.match(range_header.strip())
+        if not match:
+            return None
+
+        ranges = []
+        for item in match.group(1).split(','):
+            first, last = item.strip().split('-')
+            if not first:
+                if not last or int(last) == 0:
+                    continue
+                # suffix range e.g. -500 for the last 500 bytes
+                start, end = max(size - int(last), 0), size - 1
+            else:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+                if start > end or start >= size:
+                    continue
+            ranges.append((start, end))
+
+        if len(ranges) > cls.max_ranges:
+            return None
+        return ranges
+
+    @classmethod
+    def file_response(cls, file_path, size, content_type, ranges=None):
+        """
+        :return: the 200 FileResponse of the whole file, the 206 response of the ranges, or the 416 response
+        """
+        if ranges is None:
+            response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+            response['Content-Length'] = size
+            return response
+
+        if not ranges:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            response = FileResponse(RangeFile(open(file_path, 'rb'), start, end - start + 1),
+                                    content_type=content_type, status=206)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+            return response
+
+        boundary = os.urandom(16).hex()
+        parts = [('\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n'.format(
+            boundary, content_type, start, end, size).encode('ascii'), start, end) for start, end in ranges]
+        closing = '\r\n--{}--\r\n'.format(boundary).encode('ascii')
+
+        def stream_parts():
+            with open(file_path, 'rb') as file_obj:
+                for part_header, start, end in parts:
+                    yield part_header
+                    file_obj.seek(start)
+                    left = end - start + 1
+                    while left > 0:
+                        chunk = file_obj.read(min(FileResponse.block_size * 16, left))
+                        if not chunk:
+                            break
+                        left -= len(chunk)
+                        yield chunk
+                yield closing
+
+        response = StreamingHttpResponse(stream_parts(), status=206,
+                                         content_type='multipart/byteranges; boundary={}'.format(boundary))
+        response['Content-Length'] = sum(len(part_header) + end - start + 1 for part_header, start, end in parts) + \
+            len(closing)
+        return response
+
+    @staticmethod
+    def offload_response(file_path, content_type, offload):
+        """
+        Let the front server send the file; it also serves the Range requests
+        :param offload: {'header': 'X-Sendfile'} (apache mod_xsendfile, lighttpd) to send the file path, or
+            {'header': 'X-Accel-Redirect', 'root': '/tmp/', 'location': '/protected/'} (nginx) to send the file under
+            root as the internal location
+        :return: the response, None if the file is not under the root of the internal location
+        """
+        header = offload.get('header', 'X-Accel-Redirect')
+        if header.lower() == 'x-accel-redirect':
+            # resolved symlinks, so that a link under the root cannot expose a file outside it
+            root = os.path.join(os.path.realpath(offload['root']), '')
+            real_path = os.path.realpath(file_path)
+            if not real_path.startswith(root):
+                return None
+            value = offload['location'].rstrip('/') + '/' + quote(real_path[len(root):])
+        else:
+            value = os.path.abspath(file_path)
+
+        response = HttpResponse(content_type=content_type)
+        response[header] = value
+        return response
+
+    @classmethod
+    def retrieve_image(cls, url, chunk_size=None, cache=None):
         """
         fetch an image from the url specified
         :param url: the url of the image to be retrieved
-        :return: the StringIO object of the image
+        :param chunk_size: bytes read at a time. Default is download_chunk_size
+        :param cache: True to use the asset cache of common.utils.http_cache, False not to. Default is the ASSET_CACHE
+            setting
+        :return: the BytesIO object of the image
         """
         try:
-            response = requests.get(url)
+            if asset_cache.is_enabled(cache):
+                content = asset_cache.get(LoggedRequests.request, url, timeout=cls.download_timeout)
+                # shares the cached bytes until written to
+                return BytesIO(content) if content is not None else None
+
             image = None
-            if response.status_code == 200:
-                image = BytesIO(response.content)
+            with closing(LoggedRequests.get(url, stream=True, timeout=cls.download_timeout, cache=False,
+                                            log_response_data=False)) as response:
+                if response.status_code == 200:
+                    # written as received, without holding the whole body in the response as well
+                    image = BytesIO()
+                    for chunk in response.iter_content(chunk_size or cls.download_chunk_size):
+                        image.write(chunk)
+                    image.seek(0)
         except:
             ExceptionLogger.print_exception()
             return None
@@ -59,22 +281,289 @@ class HttpOperations:
         return image
 
     @classmethod
-    def download_to_temp(cls, file_url, download_name):
+    def download_to_temp(cls, file_url, download_name, chunk_size=None, resume=True, segments=None, progress=None,
+                         workspace=None):
         """
         Download files locally to temp directory & return the downloaded file path
+        The file is streamed to <path>.part & renamed when complete, see download for the options
         :param file_url: the url from which to retrieve the file
         :param download_name: the name with which to save the file
+        :param workspace: the TempWorkspace (FileOperations.temp_workspace) to download the file into, removed with
+            the workspace. Default is a unique directory under temp_download_directory, so that the file returned is
+            never replaced or removed by another call. The partial file is kept in the directory of the url & name
+            meanwhile, where a failed download is resumed by the next call (a concurrent call of the same url & name
+            downloads into a unique directory instead). The directories are left to the caller, & removed by the temp
+            janitor (common.utils.temp_janitor, TEMP_JANITOR setting) max_age seconds after their last write
         :return: the path of the downloaded file
         """
+        lock_file = None
         try:
-            file_path = cls.temp_file_download_path_format.format(download_name)
-            FOps.remove_file(file_path)
-            FOps.create_parent_directory(file_path)
-            file_resp = requests.get(file_url)
-            with open(file_path, 'wb') as file_obj:
-                file_obj.write(file_resp.content)
+            if workspace is not None:
+                file_path = workspace.join(download_name)
+                FOps.remove_file(file_path)
+                part_path = '{}.part'.format(file_path)
+            elif cls.temp_file_download_path_format is not None:
+                warnings.warn('HttpOperations.temp_file_download_path_format is deprecated, downloads are kept in '
+                              'temp_download_directory', DeprecationWarning)
+                file_path = cls.temp_file_download_path_format.format(download_name)
+                FOps.remove_file(file_path)
+                part_path = '{}.part'.format(file_path)
+            else:
+                temp_janitor.ensure_running()
+                part_path, lock_file = cls.get_temp_part_path(file_url, download_name)
+                file_path = None
+            FOps.create_parent_directory(part_path)
+            cls.download(file_url, part_path, chunk_size=chunk_size, resume=resume, segments=segments,
+                         progress=progress)
+            if file_path is None:
+                file_path = os.path.join(tempfile.mkdtemp(dir=cls.temp_download_directory), download_name)
+                FOps.create_parent_directory(file_path)
+            os.replace(part_path, file_path)
 
             return file_path
         except:
             ExceptionLogger.print_exception()
             return None
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    @classmethod
+    def get_temp_part_path(cls, file_url, download_name):
+        """
+        :return: (path of the partial download under temp_download_directory, the open lock file of its directory).
+            The directory is keyed by the url & name, or unique if locked by another download of the same url & name.
+            Only the partial file is kept there; the complete file is moved to a unique directory
+        """
+        FOps.create_directory(cls.temp_download_directory)
+        key = hashlib.sha1('{}\n{}'.format(file_url, download_name).encode('utf-8')).hexdigest()
+        directory = os.path.join(cls.temp_download_directory, key)
+        FOps.create_directory(directory)
+        lock_file = open(os.path.join(directory, cls.DOWNLOAD_LOCK_NAME), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            directory, lock_file = tempfile.mkdtemp(dir=cls.temp_download_directory), None
+        return os.path.join(directory, '{}.part'.format(download_name)), lock_file
+
+    @classmethod
+    def download(cls, url, file_path, chunk_size=None, resume=True, segments=None, progress=None):
+        """
+        Stream the url to the file, chunk_size bytes at a time, so the memory used does not depend on the file size
+        :param url: the url of the file
+        :param file_path: the local file path
+        :param chunk_size: bytes read & written at a time. Default is download_chunk_size
+        :param resume: continue a partial file_path with a Range request (validated by If-Range) instead of starting
+            over
+        :param segments: number of parallel segments to download the file in. Default is max_segments for the files of
+            at least segment_threshold bytes, if the server supports Range requests; 1 for a single stream
+        :param progress: callback receiving (bytes downloaded, total bytes or None, bytes per second) every half
+            second & at the end
+        :return: the size of the file
+        """
+        chunk_size = chunk_size or cls.download_chunk_size
+        offset = os.path.getsize(file_path) if resume and os.path.exists(file_path) else 0
+        validator = cls.read_validator(file_path) if offset else None
+        if offset and not validator:
+            offset = 0
+
+        # the ranges & the sizes are of the encoded content -- identity, so that the bytes written are the ones counted
+        headers = {'Range': 'bytes={}-'.format(offset), 'Accept-Encoding': 'identity'}
+        if validator:
+            headers['If-Range'] = validator
+        response = LoggedRequests.get(url, headers=headers, stream=True, timeout=cls.download_timeout, cache=False,
+                                      log_response_data=False)
+        with closing(response):
+            if response.status_code == 416 and offset:
+                unsatisfied_range = cls.unsatisfied_range_pattern.match(response.headers.get('Content-Range', ''))
+                if unsatisfied_range and int(unsatisfied_range.group(1)) == offset:
+                    # the partial file is complete
+                    cls.write_validator(file_path, None)
+                    return offset
+                # not known to be complete, start over
+                response.close()
+                cls.write_validator(file_path, None)
+                return cls.download(url, file_path, chunk_size=chunk_size, resume=False, segments=segments,
+                                    progress=progress)
+            response.raise_for_status()
+
+            content_range = cls.content_range_pattern.match(response.headers.get('Content-Range', ''))
+            encoded = response.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+            if encoded:
+                # the server ignored Accept-Encoding: identity -- the content is decoded as written, so the sizes of the
+                # headers are not the ones of the file & it cannot be resumed
+                offset = 0
+                total = None
+            elif response.status_code == 206 and content_range and int(content_range.group(1)) == offset:
+                total = int(content_range.group(3)) if content_range.group(3) != '*' else None
+            else:
+                # the server sent the whole file
+                offset = 0
+                total = int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+            tracker = TransferProgress(progress, total=total, initial=offset)
+
+            if not offset:
+                validator = None if encoded else response.headers.get('ETag') or response.headers.get('Last-Modified')
+                cls.write_validator(file_path, validator)
+                segments = segments or (cls.max_segments if total and total >= cls.segment_threshold else 1)
+                if segments > 1 and response.status_code == 206 and total:
+                    response.close()
+                    # the preallocated file has the full size whatever was written, so it is never resumed: it has
+                    # no validator & is removed if a segment fails
+                    cls.write_validator(file_path, None)
+                    try:
+                        cls.download_segments(url, file_path, total, validator, segments, chunk_size, tracker)
+                    except BaseException:
+                        FOps.remove_file(file_path)
+                        raise
+                    return total
+
+            with open(file_path, 'ab' if offset else 'wb') as file_obj:
+                for chunk in response.iter_content(chunk_size):
+                    file_obj.write(chunk)
+                    tracker.add(len(chunk))
+
+        tracker.finish()
+        cls.write_validator(file_path, None)
+        size = os.path.getsize(file_path)
+        if total is not None and size != total:
+            raise IOError('Incomplete download of {} : {} of {} bytes'.format(url, size, total))
+        return size
+
+    @classmethod
+    def download_segments(cls, url, file_path, total, validator, segments, chunk_size, tracker):
+        """
+        Download the file in parallel Range requests written in place into the preallocated file
+        """
+        with open(file_path, 'wb') as file_obj:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(file_obj.fileno(), 0, total)
+            else:
+                file_obj.truncate(total)
+
+        segment_size = -(-total // segments)
+        bounds = [(start, min(start + segment_size, total) - 1) for start in range(0, total, segment_size)]
+        fd = os.open(file_path, os.O_WRONLY)
+        try:
+            def fetch(start, end):
+                position = start
+                for attempt in range(cls.segment_retries + 1):
+                    headers = {'Range': 'bytes={}-{}'.format(position, end), 'Accept-Encoding': 'identity'}
+                    if validator:
+                        headers['If-Range'] = validator
+                    try:
+                        response = LoggedRequests.get(url, headers=headers, stream=True, timeout=cls.download_timeout,
+                                                      cache=False, log_response_data=False)
+                        with closing(response):
+                            if response.status_code != 206:
+                                raise IOError('Range request of {} answered with {}'.format(
+                                    url, response.status_code))
+                            for chunk in response.iter_content(chunk_size):
+                                os.pwrite(fd, chunk, position)
+                                position += len(chunk)
+                                tracker.add(len(chunk))
+                        if position > end:
+                            return
+                    except IOError:
+                        if attempt == cls.segment_retries:
+                            raise
+                raise IOError('Incomplete segment {}-{} of {}'.format(start, end, url))
+
+            with ThreadPoolExecutor(max_workers=len(bounds), thread_name_prefix='DownloadSegment') as executor:
+                futures = [executor.submit(contextvars.copy_context().run, fetch, start, end) for start, end in bounds]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+        tracker.finish()
+
+    @staticmethod
+    def read_validator(file_path):
+        """
+        :return: the ETag or Last-Modified of the remote file of the partial download, None if not known
+        """
+        try:
+            with open('{}.validator'.format(file_path)) as file_obj:
+                return file_obj.read().strip() or None
+        except OSError:
+            return None
+
+    @staticmethod
+    def write_validator(file_path, validator):
+        validator_path = '{}.validator'.format(file_path)
+        if validator:
+            with open(validator_path, 'w') as file_obj:
+                file_obj.write(validator)
+        elif os.path.exists(validator_path):
+            os.remove(validator_path)
+
+
+class RangeFile:
+    """
+    File object reading up to length bytes from the start offset of a file, for the single range responses. Keeps
+        fileno so that the wsgi.file_wrapper of the server can sendfile the range (sendfile servers send
+        Content-Length bytes from the current offset of the file).
+    """
+
+    def __init__(self, file_obj, start, length):
+        self.file_obj = file_obj
+        self.file_obj.seek(start)
+        self.left = length
+
+    def read(self, size=-1):
+        if self.left <= 0:
+            return b''
+        size = self.left if size is None or size < 0 else min(size, self.left)
+        data = self.file_obj.read(size)
+        self.left -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file_obj.fileno()
+
+    def tell(self):
+        return self.file_obj.tell()
+
+    def seek(self, *args):
+        return self.file_obj.seek(*args)
+
+    def close(self):
+        self.file_obj.close()
+
+
+class TransferProgress:
+    """
+    Thread safe byte counter of a download or an upload calling the progress callback at most every interval seconds
+    """
+
+    def __init__(self, callback=None, total=None, initial=0, interval=0.5):
+        self.callback = callback
+        self.total = total
+        self.bytes = initial
+        self.initial = initial
+        self.interval = interval
+        self.start = time.monotonic()
+        self.reported_at = self.start
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        with self.lock:
+            self.bytes += size
+            now = time.monotonic()
+            if self.callback is None or now - self.reported_at < self.interval:
+                return
+            self.reported_at = now
+        self.report(now)
+
+    def report(self, now):
+        elapsed = now - self.start
+        rate = (self.bytes - self.initial) / elapsed if elapsed > 0 else 0
+        try:
+            self.callback(self.bytes, self.total, rate)
+        except Exception as e:
+            print('Error in the transfer progress callback : {}'.format(e))
+
+    def finish(self):
+        if self.callback is not None:
+            self.report(time.monotonic())
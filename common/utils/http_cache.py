@@ -0,0 +1,884 @@
+import hashlib
+import json
+import os
+import re
+import stat
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+
+from requests import Request, Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+__all__ = ['HTTPCache', 'CacheEntry', 'AssetCache', 'http_cache', 'asset_cache']
+
+
+def get_private_directory(directory):
+    """
+    Create the cache directory (mode 0700) if it does not exist
+    :return: the directory
+    :raises PermissionError: if the directory is not owned by this user or is writable by others, as the entries could
+        be planted by other local users
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    directory_stat = os.stat(directory)
+    if directory_stat.st_uid != os.getuid() or directory_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError('Cache directory {} is not private to this user'.format(directory))
+    return directory
+
+
+class CacheEntry:
+    """
+    A cached GET response & its freshness:
+        expires_at -- epoch seconds until which the response is fresh; revalidated with the validators afterwards
+        vary -- the request header values the response varies by (Vary response header)
+    """
+    __slots__ = ('url', 'status_code', 'reason', 'headers', 'content', 'stored_at', 'expires_at', 'vary')
+
+    # status codes cacheable by default (RFC 7231 6.1)
+    cacheable_status_codes = (200, 203, 300, 301, 404, 410)
+
+    cache_control_pattern = re.compile(r'([\w-]+)\s*(?:=\s*"?([^",]*)"?)?')
+
+    def __init__(self, url, status_code, reason, headers, content, stored_at, expires_at, vary):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.vary = vary
+
+    def to_dict(self):
+        """
+        :return: the json serializable fields of the entry, without the content
+        """
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'content'}
+
+    @classmethod
+    def from_dict(cls, data, content):
+        data = dict(data, content=content)
+        data['vary'] = tuple(tuple(item) for item in data['vary'])
+        return cls(**data)
+
+    @classmethod
+    def parse_cache_control(cls, value):
+        """
+        :return: dict of the Cache-Control directives e.g. {'max-age': '60', 'no-cache': None}
+        """
+        return {name.lower(): argument for name, argument in cls.cache_control_pattern.findall(value or '')}
+
+    @classmethod
+    def get_expiry(cls, headers, now):
+        """
+        :return: epoch seconds until which the response is fresh (now if it is to be revalidated every time), None if
+            the response is not to be stored
+        """
+        cache_control = cls.parse_cache_control(headers.get('Cache-Control'))
+        if 'no-store' in cache_control:
+            return None
+        if 'no-cache' in cache_control:
+            return now
+
+        try:
+            age = max(int(headers.get('Age', 0)), 0)
+        except ValueError:
+            age = 0
+
+        if cache_control.get('max-age') is not None:
+            try:
+                return now + max(int(cache_control['max-age']) - age, 0)
+            except ValueError:
+                return now
+
+        if headers.get('Expires'):
+            try:
+                expires = parsedate_to_datetime(headers['Expires']).timestamp()
+                date = parsedate_to_datetime(headers['Date']).timestamp() if headers.get('Date') else now
+            except (TypeError, ValueError):
+                # invalid dates e.g. 0 mean already expired
+                return now
+            return now + max(expires - date - age, 0)
+
+        return now
+
+    @classmethod
+    def from_response(cls, response, request_headers, now=None):
+        """
+        :return: the entry of the response, None if the response is not to be stored
+        """
+        now = now or time.time()
+        if response.status_code not in cls.cacheable_status_codes:
+            return None
+
+        vary_header = response.headers.get('Vary', '')
+        if vary_header.strip() == '*':
+            return None
+
+        expires_at = cls.get_expiry(response.headers, now)
+        if expires_at is None:
+            return None
+        if expires_at <= now and not (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+            # nothing to reuse the response with
+            return None
+
+        vary = tuple(sorted((name.strip().lower(), request_headers.get(name.strip()))
+                            for name in vary_header.split(',') if name.strip()))
+        return cls(response.url, response.status_code, response.reason, dict(response.headers), response.content,
+                   now, expires_at, vary)
+
+    @property
+    def size(self):
+        return len(self.content) + sum(len(name) + len(value) for name, value in self.headers.items())
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+    def matches(self, request_headers):
+        return all(request_headers.get(name) == value for name, value in self.vary)
+
+    def validators(self):
+        """
+        :return: the conditional request headers to revalidate the entry
+        """
+        headers = {}
+        if self.headers.get('ETag'):
+            headers['If-None-Match'] = self.headers['ETag']
+        if self.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+    def refresh(self, not_modified_response, now=None):
+        """
+        Update the entry with the headers of a 304 Not Modified response
+        :return: False if the entry is not to be stored anymore
+        """
+        now = now or time.time()
+        for name in ('Cache-Control', 'Expires', 'Date', 'ETag', 'Last-Modified', 'Age'):
+            if name in not_modified_response.headers:
+                self.headers[name] = not_modified_response.headers[name]
+        expires_at = self.get_expiry(CaseInsensitiveDict(self.headers), now)
+        if expires_at is None:
+            return False
+        self.stored_at = now
+        self.expires_at = expires_at
+        return True
+
+    def to_response(self, cache_status):
+        """
+        :param cache_status: 'hit', 'revalidated' or 'coalesced' -- set as response.from_cache
+        :return: a requests.Response of the entry
+        """
+        response = Response()
+        response.status_code = self.status_code
+        response.reason = self.reason
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.content
+        response.url = self.url
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.elapsed = timedelta(0)
+        response.from_cache = cache_status
+        return response
+
+
+class DjangoCacheTier:
+    """
+    Shared tier of the HTTP cache on a django cache backend
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    @staticmethod
+    def make_key(key):
+        return 'http_cache:{}'.format(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        return self.cache.get(self.make_key(key))
+
+    def set(self, key, entry, timeout):
+        self.cache.set(self.make_key(key), entry, timeout)
+
+
+class DiskTier:
+    """
+    Shared tier of the HTTP cache on the local disk, shared by the processes of the host. Every entry is a file named
+        by the hash of its key, of a json line of the response fields followed by the content; the files are replaced
+        atomically. The directory must be private to the user of the processes (see get_private_directory).
+    """
+
+    def __init__(self, directory='/tmp/http_cache'):
+        self.directory = directory
+        self._checked = False
+
+    def get_path(self, key):
+        if not self._checked:
+            get_private_directory(self.directory)
+            self._checked = True
+        return os.path.join(self.directory, '{}.cache'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    def get(self, key):
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as file_obj:
+                data = json.loads(file_obj.readline())
+                discard_at = data.pop('discard_at')
+                entry = CacheEntry.from_dict(data, file_obj.read())
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if time.time() > discard_at:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def set(self, key, entry, timeout):
+        path = self.get_path(key)
+        temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(temp_path, 'wb') as file_obj:
+            file_obj.write(json.dumps(dict(entry.to_dict(), discard_at=time.time() + timeout)).encode('utf-8'))
+            file_obj.write(b'\n')
+            file_obj.write(entry.content)
+        os.replace(temp_path, path)
+
+
+class SingleFlightCall:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlightMixin:
+    """
+    Coalesces the concurrent calls with the same key -- needs the _lock & _calls dict attributes
+    """
+
+    def single_flight(self, key, func):
+        """
+        Run func once for the concurrent calls with the same key
+        :return: (result of func, True if the result is of the call of another thread)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlightCall()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+
+class HTTPCache(SingleFlightMixin):
+    """
+    Opt in cache of the outbound GET responses of LoggedRequests (LoggedRequests.get(url, cache=True)):
+        -- honours Cache-Control (max-age, no-cache, no-store), Expires, Age & Vary
+        -- stale responses with an ETag or Last-Modified are revalidated with a conditional request & a 304 Not Modified
+            reuses the cached content
+        -- in process LRU of up to max_entries entries & max_bytes bytes, & an optional shared tier ('django' for the
+            django cache of django_cache_alias, 'disk' for disk_directory) checked on a local miss
+        -- concurrent misses of a url in the process are coalesced into a single upstream request
+    Requests with credentials (auth or an Authorization header) & streamed requests are never cached.
+    The settings can be configured by the HTTP_CACHE django setting -- a dict of the __init__ kwargs; enabled=True
+        caches the LoggedRequests.get calls by default.
+    """
+
+    def __init__(self, enabled=False, max_entries=1000, max_bytes=50 * 1024 * 1024, max_entry_bytes=1024 * 1024,
+                 shared_tier=None, django_cache_alias='default', disk_directory='/tmp/http_cache',
+                 stale_keep_seconds=86400):
+        self._lock = threading.Lock()
+        self._settings_loaded = False
+        self._calls = {}
+        self._set_options(enabled=enabled, max_entries=max_entries, max_bytes=max_bytes,
+                          max_entry_bytes=max_entry_bytes, shared_tier=shared_tier,
+                          django_cache_alias=django_cache_alias, disk_directory=disk_directory,
+                          stale_keep_seconds=stale_keep_seconds)
+
+    def _set_options(self, enabled=False, max_entries=1000, max_bytes=50 * 1024 * 1024, max_entry_bytes=1024 * 1024,
+                     shared_tier=None, django_cache_alias='default', disk_directory='/tmp/http_cache',
+                     stale_keep_seconds=86400):
+        assert shared_tier in (None, 'django', 'disk'), 'Invalid shared tier {}'.format(shared_tier)
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        # stale entries with validators are kept this long in the shared tier for revalidation
+        self.stale_keep_seconds = stale_keep_seconds
+        if shared_tier == 'django':
+            self.shared_tier = DjangoCacheTier(django_cache_alias)
+        elif shared_tier == 'disk':
+            self.shared_tier = DiskTier(disk_directory)
+        else:
+            self.shared_tier = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.reset_stats()
+
+    def configure(self, **kwargs):
+        """
+        Replace the settings of the cache. The cached entries of the process are cleared.
+        """
+        with self._lock:
+            self._settings_loaded = True
+            self._set_options(**kwargs)
+
+    def load_settings(self):
+        from django.conf import settings
+        self._settings_loaded = True
+        if settings.configured and getattr(settings, 'HTTP_CACHE', None):
+            self._set_options(**settings.HTTP_CACHE)
+
+    def is_enabled(self, cache=None):
+        """
+        :param cache: the cache argument of the call -- True/False, None for the default of the settings
+        """
+        if not self._settings_loaded:
+            with self._lock:
+                if not self._settings_loaded:
+                    self.load_settings()
+        return self.enabled if cache is None else cache
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.coalesced = 0
+        self.stores = 0
+        self.bypasses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'coalesced': self.coalesced,
+            'stores': self.stores,
+            'bypasses': self.bypasses,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        if self.shared_tier is not None:
+            entry = self.shared_tier.get(key)
+            if entry is not None:
+                self.store_local(key, entry)
+        return entry
+
+    def store_local(self, key, entry):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+
+    def store(self, key, entry):
+        if entry.size > self.max_entry_bytes:
+            return
+        self.stores += 1
+        self.store_local(key, entry)
+        if self.shared_tier is not None:
+            timeout = max(entry.expires_at - time.time(), 0)
+            if entry.validators():
+                timeout += self.stale_keep_seconds
+            if timeout > 0:
+                self.shared_tier.set(key, entry, int(timeout) + 1)
+
+    def get(self, send, url, params=None, **kwargs):
+        """
+        GET the url through the cache
+        :param send: the function sending the requests -- send(method, url, **kwargs) e.g. LoggedRequests.request
+        :param url: the url
+        :param params: the query params
+        :param kwargs: the kwargs of requests.get
+        :return: the requests.Response. Responses from the cache have from_cache set to 'hit', 'revalidated' or
+            'coalesced'
+        """
+        request_headers = CaseInsensitiveDict(kwargs.get('headers') or {})
+        if kwargs.get('auth') is not None or 'Authorization' in request_headers or kwargs.get('stream'):
+            self.bypasses += 1
+            return send('get', url, params=params, **kwargs)
+
+        key = Request('GET', url, params=params).prepare().url
+        entry = self.lookup(key)
+        if entry is not None and entry.matches(request_headers) and entry.is_fresh():
+            self.hits += 1
+            return entry.to_response('hit')
+
+        def fetch():
+            cached_entry = entry if entry is not None and entry.matches(request_headers) else None
+            request_kwargs = kwargs
+            if cached_entry is not None and cached_entry.validators():
+                request_kwargs = dict(kwargs, headers=dict(request_headers, **cached_entry.validators()))
+            response = send('get', url, params=params, **request_kwargs)
+
+            if response.status_code == 304 and cached_entry is not None:
+                self.revalidations += 1
+                if cached_entry.refresh(response):
+                    self.store(key, cached_entry)
+                return cached_entry.to_response('revalidated'), cached_entry
+
+            self.misses += 1
+            new_entry = CacheEntry.from_response(response, request_headers)
+            if new_entry is not None:
+                self.store(key, new_entry)
+            return response, new_entry
+
+        (response, result_entry), coalesced = self.single_flight(key, fetch)
+        if not coalesced:
+            return response
+        if result_entry is None or not result_entry.matches(request_headers):
+            # the response of the other call is not reusable
+            return send('get', url, params=params, **kwargs)
+        self.coalesced += 1
+        return result_entry.to_response('coalesced')
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._bytes = 0
+
+
+class AssetEntry:
+    """
+    A cached remote asset: the sha256 digest of its content, the caching headers of its response & its freshness
+    """
+    __slots__ = ('url', 'digest', 'size', 'headers', 'stored_at', 'expires_at')
+
+    # response headers kept for the freshness & the revalidation
+    header_names = ('Cache-Control', 'Expires', 'Date', 'Age', 'ETag', 'Last-Modified', 'Content-Type')
+
+    def __init__(self, url, digest, size, headers, stored_at, expires_at):
+        self.url = url
+        self.digest = digest
+        self.size = size
+        self.headers = headers
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+    def validators(self):
+        headers = {}
+        if self.headers.get('ETag'):
+            headers['If-None-Match'] = self.headers['ETag']
+        if self.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class AssetCache(SingleFlightMixin):
+    """
+    Two tier cache of the remote assets fetched by HttpOperations.retrieve_image, keyed by url & deduplicated by the
+        sha256 of the content:
+        -- in process LRU of the contents of up to max_bytes bytes
+        -- content addressed store in directory shared by the processes of the host: objects/<digest> files with the
+            contents & urls/<hash of url>.json files with the digest & the caching headers of every url. Objects are
+            evicted after max_age seconds without a hit & least recently used first above max_disk_bytes. The
+            directory must be private to the user (see get_private_directory), & the objects read are checked against
+            their digest.
+    Freshness follows Cache-Control & Expires (default_ttl seconds when the response has neither); stale assets with an
+        ETag or Last-Modified are revalidated with a conditional request. Concurrent misses of a url in the process are
+        coalesced into a single request. Only 200 responses of up to max_entry_bytes are cached.
+    The contents are immutable bytes, shared by the callers without copies (BytesIO(content) & memoryview(content)
+        do not copy).
+    The disk tier is pruned every prune_interval seconds on a daemon thread, never on the thread of the request; a lock
+        file keeps the processes of the host from pruning it at the same time. With prune_interval=None it is pruned
+        only by the prune_asset_cache management command (e.g. from cron).
+    The settings can be configured by the ASSET_CACHE django setting -- a dict of the __init__ kwargs; enabled=True
+        caches the retrieve_image calls by default.
+    """
+
+    PRUNE_LOCK_NAME = '.prune.lock'
+
+    def __init__(self, enabled=False, max_bytes=100 * 1024 * 1024, max_entry_bytes=10 * 1024 * 1024,
+                 directory='/tmp/asset_cache', max_disk_bytes=1024 * 1024 * 1024, max_age=7 * 86400, default_ttl=300,
+                 prune_interval=300):
+        self._lock = threading.Lock()
+        self.prune_thread = None
+        self._settings_loaded = False
+        self._calls = {}
+        self._set_options(enabled=enabled, max_bytes=max_bytes, max_entry_bytes=max_entry_bytes, directory=directory,
+                          max_disk_bytes=max_disk_bytes, max_age=max_age, default_ttl=default_ttl,
+                          prune_interval=prune_interval)
+
+    def _set_options(self, enabled=False, max_bytes=100 * 1024 * 1024, max_entry_bytes=10 * 1024 * 1024,
+                     directory='/tmp/asset_cache', max_disk_bytes=1024 * 1024 * 1024, max_age=7 * 86400,
+                     default_ttl=300, prune_interval=300):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        # None for no disk tier
+        self.directory = directory
+        self._directory_checked = False
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self.default_ttl = default_ttl
+        self.prune_interval = prune_interval
+        self.pruned_at = time.time()
+        # url -> AssetEntry
+        self._entries = OrderedDict()
+        # digest -> content, least recently used first
+        self._contents = OrderedDict()
+        self._bytes = 0
+        self.reset_stats()
+
+    def configure(self, **kwargs):
+        """
+        Replace the settings of the cache. The cached assets of the process are cleared.
+        """
+        with self._lock:
+            self._settings_loaded = True
+            self._set_options(**kwargs)
+
+    def load_settings(self):
+        from django.conf import settings
+        self._settings_loaded = True
+        if settings.configured and getattr(settings, 'ASSET_CACHE', None):
+            self._set_options(**settings.ASSET_CACHE)
+
+    def is_enabled(self, cache=None):
+        """
+        :param cache: the cache argument of the call -- True/False, None for the default of the settings
+        """
+        if not self._settings_loaded:
+            with self._lock:
+                if not self._settings_loaded:
+                    self.load_settings()
+        return self.enabled if cache is None else cache
+
+    def reset_stats(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.coalesced = 0
+        self.deduplicated = 0
+
+    def stats(self):
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'coalesced': self.coalesced,
+            'deduplicated': self.deduplicated,
+            'entries': len(self._entries),
+            'contents': len(self._contents),
+            'bytes': self._bytes,
+        }
+
+    @staticmethod
+    def hash_url(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def get_directory(self):
+        """
+        :return: the directory of the disk tier, created private to the user (see get_private_directory)
+        """
+        if not self._directory_checked:
+            get_private_directory(self.directory)
+            self._directory_checked = True
+        return self.directory
+
+    def get_object_path(self, digest):
+        return os.path.join(self.get_directory(), 'objects', digest[:2], digest)
+
+    def get_url_path(self, url):
+        return os.path.join(self.get_directory(), 'urls', '{}.json'.format(self.hash_url(url)))
+
+    def has_object(self, digest):
+        try:
+            return os.path.exists(self.get_object_path(digest))
+        except OSError:
+            return False
+
+    @staticmethod
+    def write_file(path, data, mode='wb'):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(temp_path, mode) as file_obj:
+            file_obj.write(data)
+        os.replace(temp_path, path)
+
+    def lookup(self, url):
+        """
+        :return: (AssetEntry, content, 'memory' or 'disk') of the url, (None, None, None) if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            content = self._contents.get(entry.digest) if entry is not None else None
+            if content is not None:
+                self._entries.move_to_end(url)
+                self._contents.move_to_end(entry.digest)
+                return entry, content, 'memory'
+
+        if self.directory is None:
+            return None, None, None
+        try:
+            with open(self.get_url_path(url)) as file_obj:
+                entry = AssetEntry(**json.load(file_obj))
+            object_path = self.get_object_path(entry.digest)
+            with open(object_path, 'rb') as file_obj:
+                content = file_obj.read()
+            # the modification time of the objects is their last use, for the eviction
+            os.utime(object_path)
+        except (OSError, ValueError, TypeError):
+            return None, None, None
+        if entry.url != url or len(content) != entry.size:
+            return None, None, None
+        if hashlib.sha256(content).hexdigest() != entry.digest:
+            # a corrupt or planted object, never served
+            self.remove_file(object_path)
+            self.remove_file(self.get_url_path(url))
+            return None, None, None
+        self.store_local(entry, content)
+        return entry, content, 'disk'
+
+    def store_local(self, entry, content):
+        with self._lock:
+            self._entries[entry.url] = entry
+            self._entries.move_to_end(entry.url)
+            if entry.digest in self._contents:
+                self._contents.move_to_end(entry.digest)
+            else:
+                self._contents[entry.digest] = content
+                self._bytes += len(content)
+            while self._contents and self._bytes > self.max_bytes:
+                _, evicted = self._contents.popitem(last=False)
+                self._bytes -= len(evicted)
+            # the entries are small, kept for as many urls as contents
+            while len(self._entries) > max(len(self._contents) * 4, 1000):
+                self._entries.popitem(last=False)
+
+    def store(self, entry, content):
+        self.store_local(entry, content)
+        if self.directory is None:
+            return
+        try:
+            object_path = self.get_object_path(entry.digest)
+            if not os.path.exists(object_path):
+                self.write_file(object_path, content)
+            else:
+                # the same content from another url, or the revalidated content
+                os.utime(object_path)
+            self.write_file(self.get_url_path(entry.url), json.dumps(entry.to_dict()), mode='w')
+        except OSError as e:
+            print('Error storing {} in the asset cache : {}'.format(entry.url, e))
+        if self.prune_interval is not None and time.time() - self.pruned_at > self.prune_interval:
+            self.prune_in_background()
+
+    def create_entry(self, url, headers, content, now):
+        """
+        :return: the AssetEntry of the content, None if it is not to be stored
+        """
+        headers = {name: headers[name] for name in AssetEntry.header_names if name in headers}
+        cache_control = CacheEntry.parse_cache_control(headers.get('Cache-Control'))
+        if 'no-store' in cache_control or len(content) > self.max_entry_bytes:
+            return None
+        if 'Cache-Control' in headers or 'Expires' in headers:
+            expires_at = CacheEntry.get_expiry(CaseInsensitiveDict(headers), now)
+        else:
+            expires_at = now + self.default_ttl
+        return AssetEntry(url, hashlib.sha256(content).hexdigest(), len(content), headers, now, expires_at)
+
+    def get(self, send, url, **kwargs):
+        """
+        GET the content of the url through the cache
+        :param send: the function sending the requests -- send(method, url, **kwargs) e.g. LoggedRequests.request
+        :param url: the url of the asset
+        :param kwargs: the kwargs of requests.get
+        :return: the content bytes, None if the response is not a 200
+        """
+        entry, content, tier = self.lookup(url)
+        if entry is not None and entry.is_fresh():
+            if tier == 'memory':
+                self.memory_hits += 1
+            else:
+                self.disk_hits += 1
+            return content
+
+        def fetch():
+            now = time.time()
+            headers = dict(kwargs.get('headers') or {})
+            if entry is not None:
+                headers.update(entry.validators())
+            response = send('get', url, **dict(kwargs, headers=headers))
+
+            if response.status_code == 304 and entry is not None:
+                self.revalidations += 1
+                headers = CaseInsensitiveDict(entry.headers)
+                headers.update(response.headers)
+                refreshed_entry = self.create_entry(url, headers, content, now)
+                if refreshed_entry is not None:
+                    self.store(refreshed_entry, content)
+                return content
+
+            self.misses += 1
+            if response.status_code != 200:
+                return None
+            new_entry = self.create_entry(url, response.headers, response.content, now)
+            if new_entry is not None:
+                if new_entry.digest in self._contents or (
+                        self.directory is not None and self.has_object(new_entry.digest)):
+                    self.deduplicated += 1
+                self.store(new_entry, response.content)
+            return response.content
+
+        result, coalesced = self.single_flight(url, fetch)
+        if coalesced:
+            self.coalesced += 1
+        return result
+
+    def prune_in_background(self):
+        """
+        Start pruning the disk tier on a daemon thread, unless the process is already pruning it
+        """
+        with self._lock:
+            if self.prune_thread is not None and self.prune_thread.is_alive():
+                return
+            self.pruned_at = time.time()
+            self.prune_thread = threading.Thread(target=self.run_prune, name='AssetCachePrune', daemon=True)
+            self.prune_thread.start()
+
+    def run_prune(self):
+        try:
+            # the lowest priority for this thread only (linux)
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        try:
+            self.prune()
+        except Exception as e:
+            print('Error pruning the asset cache : {}'.format(e))
+
+    def prune(self):
+        """
+        Evict the objects of the disk tier not used in max_age seconds, & the least recently used ones above
+            max_disk_bytes. The url files of the evicted or expired objects are removed too.
+        :return: the number of removed objects & the bytes left, None if being pruned by another process
+        """
+        self.pruned_at = time.time()
+        if self.directory is None or not os.path.isdir(self.directory):
+            return None
+        lock_path = os.path.join(self.get_directory(), self.PRUNE_LOCK_NAME)
+        try:
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # being pruned by another process, unless the lock was left by a killed one
+            try:
+                if time.time() - os.path.getmtime(lock_path) < max(self.prune_interval or 0, 3600):
+                    return None
+                os.utime(lock_path)
+            except FileNotFoundError:
+                return None
+            lock_fd = None
+        try:
+            return self.prune_directory()
+        finally:
+            if lock_fd is not None:
+                os.close(lock_fd)
+            self.remove_file(lock_path)
+
+    def prune_directory(self):
+        now = time.time()
+        objects = []
+        total = 0
+        removed = 0
+        for root, _, names in os.walk(os.path.join(self.directory, 'objects')):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    path_stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith('.tmp') and now - path_stat.st_mtime < 3600:
+                    continue
+                if name.endswith('.tmp') or now - path_stat.st_mtime > self.max_age:
+                    self.remove_file(path)
+                    removed += 1
+                    continue
+                objects.append((path_stat.st_mtime, path_stat.st_size, path))
+                total += path_stat.st_size
+
+        # least recently used first
+        objects.sort()
+        for _, size, path in objects:
+            if total <= self.max_disk_bytes:
+                break
+            self.remove_file(path)
+            total -= size
+            removed += 1
+
+        url_directory = os.path.join(self.directory, 'urls')
+        for name in os.listdir(url_directory) if os.path.isdir(url_directory) else []:
+            path = os.path.join(url_directory, name)
+            try:
+                with open(path) as file_obj:
+                    digest = json.load(file_obj)['digest']
+            except (OSError, ValueError, KeyError):
+                digest = None
+            if digest is None or not os.path.exists(self.get_object_path(digest)):
+                self.remove_file(path)
+        return {'removed': removed, 'bytes': total}
+
+    @staticmethod
+    def remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._contents = OrderedDict()
+            self._bytes = 0
+
+
+# Process wide cache of the LoggedRequests GET responses
+http_cache = HTTPCache()
+
+# Process wide cache of the assets of HttpOperations.retrieve_image
+asset_cache = AssetCache()
@@ -0,0 +1,343 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+__all__ = ['SessionRegistry', 'AsyncSessionRegistry', 'PoolStats', 'session_registry', 'async_session_registry']
+
+
+class PoolStats:
+    """
+    Counters of the connection pool of a host:
+        requests -- connections taken from the pool
+        hits -- requests served by a kept alive connection
+        new_connections -- connections opened (TCP + TLS handshakes)
+        waits -- requests that found the pool empty & waited for a connection (pool_block=True) or opened an extra
+            connection that is not kept (pool_block=False)
+        wait_time -- total seconds spent waiting for a connection
+    """
+    __slots__ = ('requests', 'new_connections', 'waits', 'wait_time', 'lock')
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def hits(self):
+        return max(self.requests - self.new_connections, 0)
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'hits': self.hits,
+            'new_connections': self.new_connections,
+            'waits': self.waits,
+            'wait_time': round(self.wait_time, 6),
+        }
+
+
+class StatsPoolMixin:
+    """
+    urllib3 connection pool recording the PoolStats of its host in the stats of the session registry
+    """
+    stats_registry = None
+
+    def get_stats(self):
+        return self.stats_registry.get_stats(self.scheme, self.host, self.port)
+
+    def _get_conn(self, timeout=None):
+        stats = self.get_stats()
+        waited = self.pool is not None and self.pool.empty()
+        start = time.perf_counter()
+        try:
+            return super(StatsPoolMixin, self)._get_conn(timeout=timeout)
+        finally:
+            with stats.lock:
+                stats.requests += 1
+                if waited:
+                    stats.waits += 1
+                    stats.wait_time += time.perf_counter() - start
+
+    def _new_conn(self):
+        stats = self.get_stats()
+        with stats.lock:
+            stats.new_connections += 1
+        return super(StatsPoolMixin, self)._new_conn()
+
+
+class StatsHTTPConnectionPool(StatsPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class StatsHTTPSConnectionPool(StatsPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with a default timeout & connection pools recording their stats
+    """
+
+    def __init__(self, stats_registry, timeout=None, **kwargs):
+        self.stats_registry = stats_registry
+        self.default_timeout = timeout
+        super(PooledHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('StatsHTTPConnectionPool', (StatsHTTPConnectionPool,),
+                         {'stats_registry': self.stats_registry}),
+            'https': type('StatsHTTPSConnectionPool', (StatsHTTPSConnectionPool,),
+                          {'stats_registry': self.stats_registry}),
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.default_timeout
+        return super(PooledHTTPAdapter, self).send(request, timeout=timeout, **kwargs)
+
+
+class SessionRegistry:
+    """
+    Shared requests sessions, so that the outbound calls reuse kept alive connections instead of opening a new TCP &
+        TLS connection every call.
+    Every host gets its own connection pool of up to pool_maxsize connections. A session is shared by all the threads
+        of the process, or every thread gets its own session with per_thread=True. Sessions are not shared with
+        forked processes. Cookies set by the responses are not stored in the shared sessions.
+    The settings can be configured by the HTTP_SESSIONS django setting -- a dict of the __init__ kwargs. hosts is a
+        dict of host -> pool_maxsize, pool_block & timeout overrides for that host. The host matches the urls of that
+        exact host & port e.g. 'api.example.com' (default port) or 'api.example.com:8443'.
+    """
+
+    def __init__(self, pool_connections=20, pool_maxsize=10, pool_block=False, timeout=(3.05, 30), keep_alive=True,
+                 per_thread=False, max_retries=0, hosts=None):
+        self._lock = threading.Lock()
+        self._settings_loaded = False
+        self._stats = {}
+        self._set_options(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block,
+                          timeout=timeout, keep_alive=keep_alive, per_thread=per_thread, max_retries=max_retries,
+                          hosts=hosts)
+
+    def _set_options(self, pool_connections=20, pool_maxsize=10, pool_block=False, timeout=(3.05, 30),
+                     keep_alive=True, per_thread=False, max_retries=0, hosts=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = tuple(timeout) if isinstance(timeout, list) else timeout
+        self.keep_alive = keep_alive
+        self.per_thread = per_thread
+        self.max_retries = max_retries
+        self.hosts = hosts or {}
+        self._session = None
+        self._session_pid = None
+        self._local = threading.local()
+
+    def configure(self, **kwargs):
+        """
+        Replace the settings of the registry. The sessions created so far are closed.
+        """
+        with self._lock:
+            self._settings_loaded = True
+            self.close()
+            self._set_options(**kwargs)
+
+    def load_settings(self):
+        from django.conf import settings
+        self._settings_loaded = True
+        if settings.configured and getattr(settings, 'HTTP_SESSIONS', None):
+            self.close()
+            self._set_options(**settings.HTTP_SESSIONS)
+
+    def get_session(self):
+        """
+        :return: the session of the process, or of the thread with per_thread
+        """
+        if not self._settings_loaded:
+            with self._lock:
+                if not self._settings_loaded:
+                    self.load_settings()
+
+        if self.per_thread:
+            session = getattr(self._local, 'session', None)
+            if session is None or self._local.pid != os.getpid():
+                session = self._local.session = self.create_session()
+                self._local.pid = os.getpid()
+            return session
+
+        if self._session_pid != os.getpid():
+            with self._lock:
+                if self._session_pid != os.getpid():
+                    self._session = self.create_session()
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def create_adapter(self, **overrides):
+        options = {
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'pool_block': self.pool_block,
+            'timeout': self.timeout,
+            'max_retries': self.max_retries,
+        }
+        options.update(overrides)
+        return PooledHTTPAdapter(self, **options)
+
+    def create_session(self):
+        session = requests.Session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+
+        adapter = self.create_adapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        for host, overrides in self.hosts.items():
+            host_adapter = self.create_adapter(pool_connections=1, **overrides)
+            # the trailing slash ends the host, so that e.g. http://host.evil.org does not match http://host
+            session.mount('http://{}/'.format(host), host_adapter)
+            session.mount('https://{}/'.format(host), host_adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Send the request through the shared session -- same arguments as requests.request
+        """
+        return self.get_session().request(method=method, url=url, **kwargs)
+
+    def get_stats(self, scheme, host, port):
+        key = '{}://{}:{}'.format(scheme, host, port)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats.setdefault(key, PoolStats())
+        return stats
+
+    def stats(self):
+        """
+        :return: dict of scheme://host:port -> pool stats dict
+        """
+        return {key: stats.to_dict() for key, stats in list(self._stats.items())}
+
+    def reset_stats(self):
+        self._stats = {}
+
+    def close(self):
+        """
+        Close the session of the process & the pooled connections. Per thread sessions are closed by their threads.
+        """
+        if self._session is not None and self._session_pid == os.getpid():
+            self._session.close()
+        self._session = None
+        self._session_pid = None
+
+
+class AsyncSessionRegistry:
+    """
+    Shared httpx.AsyncClient per event loop for the asyncio requests. Every client keeps up to max_connections
+        connections (max_keepalive_connections of them kept alive when idle) & takes the requests style arguments.
+        Cookies set by the responses are not stored in the clients.
+    The settings can be configured by the HTTP_ASYNC_SESSIONS django setting -- a dict of the __init__ kwargs.
+    """
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=5, timeout=(3.05, 30)):
+        self._settings_loaded = False
+        self._set_options(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                          keepalive_expiry=keepalive_expiry, timeout=timeout)
+
+    def _set_options(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=5,
+                     timeout=(3.05, 30)):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        # event loop -> client
+        self._clients = weakref.WeakKeyDictionary()
+
+    def configure(self, **kwargs):
+        """
+        Replace the settings of the registry. Applies to the clients created afterwards.
+        """
+        self._settings_loaded = True
+        self._set_options(**kwargs)
+
+    def load_settings(self):
+        from django.conf import settings
+        self._settings_loaded = True
+        if settings.configured and getattr(settings, 'HTTP_ASYNC_SESSIONS', None):
+            self._set_options(**settings.HTTP_ASYNC_SESSIONS)
+
+    @staticmethod
+    def get_timeout(timeout):
+        """
+        :param timeout: requests style timeout -- seconds, (connect, read) tuple or None
+        :return: the httpx.Timeout
+        """
+        import httpx
+        if isinstance(timeout, (tuple, list)):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return httpx.Timeout(timeout)
+
+    def create_client(self):
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError('httpx is required for the asyncio requests')
+
+        return httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_keepalive_connections,
+                                keepalive_expiry=self.keepalive_expiry),
+            timeout=self.get_timeout(self.timeout),
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+        )
+
+    def get_client(self):
+        """
+        :return: the client of the running event loop
+        """
+        if not self._settings_loaded:
+            self.load_settings()
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = self._clients[loop] = self.create_client()
+        return client
+
+    async def request(self, method, url, data=None, allow_redirects=True, timeout=None, **kwargs):
+        """
+        Send the request with the client of the running event loop
+        Takes the arguments of requests.request, except the session level ones (verify, cert, proxies & stream)
+        :return: the httpx.Response
+        """
+        if isinstance(data, (str, bytes)):
+            kwargs['content'] = data
+        elif data is not None:
+            kwargs['data'] = data
+        if timeout is not None:
+            kwargs['timeout'] = self.get_timeout(timeout)
+        return await self.get_client().request(method.upper(), url, follow_redirects=allow_redirects, **kwargs)
+
+    async def aclose(self):
+        """
+        Close the client of the running event loop & its connections
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+# Process wide sessions used by LoggedRequests & PatchedRequests
+session_registry = SessionRegistry()
+
+# Process wide clients used by AsyncLoggedRequests
+async_session_registry = AsyncSessionRegistry()
@@ -1,19 +1,49 @@
+import asyncio
+import contextvars
+import functools
 import json as json_lib
 import logging
-
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+from common.logging.serializers import TRUNCATION_MARKER
+from common.logging.tracing import inject_headers, span
 from common.utils import get_caller_logger
 
-__all__ = ['LoggedRequests', 'PatchedRequests']
+__all__ = ['LoggedRequests', 'PatchedRequests', 'AsyncLoggedRequests', 'BatchResult']
 
 logger = logging.getLogger(__name__)
 
 
+class BatchResult(namedtuple('BatchResult', 'spec response error elapsed')):
+    """
+    Result of a request of LoggedRequests.batch -- the response, or the exception raised for the request
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
 class RequestLogger:
     """
     Set of functions to log the request sent & response received
     """
+    _log_executor = None
+    _log_executor_pid = None
+
+    # max bytes of the response content logged, set by the HTTP_LOG_RESPONSE_BYTES django setting. None for all
+    response_prefix_bytes = 4096
+    _settings_loaded = False
+
     @classmethod
-    def log_request(cls, request_type, url, params=None, data=None, json=None, log_title=None, **kwargs):
+    def log_request(cls, request_type, url, params=None, data=None, json=None, log_title=None, caller_logger=None,
+                    **kwargs):
         log_message = log_title or ''
         log_message += 'Triggered {request_type} on {url}:'.format(request_type=request_type.upper(), url=url)
 
@@ -32,31 +62,135 @@ class RequestLogger:
         if auth is not None:
             log_message += '\nAUTH: {}'.format(json_lib.dumps(auth))
 
-        logger_to_use = get_caller_logger(stack_depth=2, default_logger=logger)
+        from common.utils.resilience import time_left
+        budget = time_left()
+        if budget is not None or kwargs.get('budget') is not None:
+            budget = min(budget if budget is not None else float('inf'), kwargs.get('budget') or float('inf'))
+            log_message += '\nBUDGET: {}ms'.format(int(budget * 1000))
+
+        logger_to_use = caller_logger or get_caller_logger(stack_depth=2, default_logger=logger)
         logger_to_use.info(log_message)
         print(log_message)
 
     @classmethod
-    def log_response(cls, request_type, url, response, log_response_data=True, log_title=None):
+    def log_response(cls, request_type, url, response, log_response_data=True, log_title=None, caller_logger=None,
+                     elapsed=None):
+        """
+        Log the response. The content is never read here for streamed responses (stream=True) -- their transfer is
+            logged once the content is consumed or the response is closed (see StreamedResponseLogger)
+        :param elapsed: seconds from sending the request to receiving the response, for the timing
+        """
+        logger_to_use = caller_logger or get_caller_logger(stack_depth=2, default_logger=logger)
         log_message = log_title or ''
         log_message += 'Response for {request_type} on {url}:\nSTATUS: {status}'.format(
             request_type=request_type.upper(), url=url, status=response.status_code)
 
-        if log_response_data:
-            log_message += '\nCONTENT: {}'.format(response.content)
+        from_cache = getattr(response, 'from_cache', None)
+        if from_cache:
+            log_message += '\nCACHE: {}'.format(from_cache.upper())
+
+        attempts = cls.format_attempts(getattr(response, 'resilience', None))
+        if attempts:
+            log_message += '\nATTEMPTS: {}'.format(attempts)
+
+        prefix_bytes = cls.get_response_prefix_bytes()
+        if cls.is_streamed(response):
+            StreamedResponseLogger(response, request_type, url, prefix_bytes=prefix_bytes if log_response_data else 0,
+                                   log_title=log_title, caller_logger=logger_to_use, elapsed=elapsed)
+            log_message += '\nTIME: {}'.format(cls.format_timing(response, elapsed))
+            if log_response_data:
+                log_message += '\nCONTENT: <streamed>'
+        else:
+            if elapsed is not None:
+                log_message += '\nTIME: {}'.format(cls.format_timing(response, elapsed))
+            if log_response_data:
+                content = response.content
+                if content is not None and prefix_bytes is not None and len(content) > prefix_bytes:
+                    log_message += '\nBYTES: {}\nCONTENT: {}{}'.format(len(content), content[:prefix_bytes],
+                                                                       TRUNCATION_MARKER)
+                else:
+                    log_message += '\nCONTENT: {}'.format(content)
 
-        logger_to_use = get_caller_logger(stack_depth=2, default_logger=logger)
         logger_to_use.info(log_message)
         print(log_message)
 
+    @classmethod
+    def get_response_prefix_bytes(cls):
+        if not cls._settings_loaded:
+            from django.conf import settings
+            if settings.configured and hasattr(settings, 'HTTP_LOG_RESPONSE_BYTES'):
+                RequestLogger.response_prefix_bytes = settings.HTTP_LOG_RESPONSE_BYTES
+            RequestLogger._settings_loaded = True
+        return cls.response_prefix_bytes
+
+    @staticmethod
+    def is_streamed(response):
+        """
+        :return: True for a requests response with stream=True whose content is not read yet
+        """
+        return getattr(response, '_content', None) is False and not getattr(response, '_content_consumed', True)
+
+    @staticmethod
+    def format_timing(response, elapsed=None):
+        """
+        :return: e.g. 'headers 120.5ms, total 180.2ms'
+        """
+        timing = []
+        headers_elapsed = getattr(response, 'elapsed', None)
+        if headers_elapsed is not None:
+            timing.append('headers {:.1f}ms'.format(headers_elapsed.total_seconds() * 1000))
+        if elapsed is not None:
+            timing.append('total {:.1f}ms'.format(elapsed * 1000))
+        return ', '.join(timing)
+
+    @classmethod
+    def log_error(cls, request_type, url, error, log_title=None, caller_logger=None):
+        log_message = log_title or ''
+        log_message += 'Failed {request_type} on {url}:\nERROR: {error}'.format(
+            request_type=request_type.upper(), url=url, error=repr(error))
+
+        attempts = cls.format_attempts(getattr(error, 'resilience', None))
+        if attempts:
+            log_message += '\nATTEMPTS: {}'.format(attempts)
+
+        logger_to_use = caller_logger or get_caller_logger(stack_depth=2, default_logger=logger)
+        logger_to_use.warning(log_message)
+        print(log_message)
+
+    @staticmethod
+    def format_attempts(record):
+        """
+        :param record: the attempts of the call recorded by common.utils.resilience
+        :return: e.g. '3 (2 retries, hedged -- hedge won)', None for a single plain attempt
+        """
+        if not record or (record['attempts'] <= 1 and not record['retries'] and not record['hedged']):
+            return None
+        details = []
+        if record['retries']:
+            details.append('{} retries'.format(record['retries']))
+        if record['hedged']:
+            details.append('hedged -- {} won'.format(record['winner']))
+        return '{} ({})'.format(record['attempts'], ', '.join(details)) if details else str(record['attempts'])
+
     @classmethod
     def log_request_response(cls, request_type):
         def log_decorator(request_func):
-            def request_func_wrapper(_cls, url, log_response_data=True, log_title=None, *args, **kwargs):
-                RequestLogger.log_request(request_type=request_type, url=url, log_title=log_title, *args, **kwargs)
-                response = request_func(_cls, url, *args, **kwargs)
+            def request_func_wrapper(_cls, url, log_response_data=True, log_title=None, caller_logger=None, *args,
+                                     **kwargs):
+                kwargs['headers'] = inject_headers(kwargs.get('headers'))
+                RequestLogger.log_request(request_type=request_type, url=url, log_title=log_title,
+                                          caller_logger=caller_logger, *args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    with span('{} {}'.format(request_type.upper(), url), kind='http'):
+                        response = request_func(_cls, url, *args, **kwargs)
+                except Exception as e:
+                    RequestLogger.log_error(request_type=request_type, url=url, error=e, log_title=log_title,
+                                            caller_logger=caller_logger)
+                    raise
                 RequestLogger.log_response(request_type=request_type, url=url, response=response,
-                                           log_response_data=log_response_data, log_title=log_title)
+                                           log_response_data=log_response_data, log_title=log_title,
+                                           caller_logger=caller_logger, elapsed=time.perf_counter() - start)
                 return response
 
             return request_func_wrapper
@@ -68,105 +202,376 @@ class RequestLogger:
         def log_decorator(request_func):
             def request_func_wrapper(_cls, url, log_response_data=True, log_title=None, vanilla=False, *args, **kwargs):
                 if not vanilla:
+                    kwargs['headers'] = inject_headers(kwargs.get('headers'))
                     RequestLogger.log_request(request_type=request_type, url=url, log_title=log_title, *args, **kwargs)
-                response = request_func(_cls, url, *args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    with span('{} {}'.format(request_type.upper(), url), kind='http'):
+                        response = request_func(_cls, url, *args, **kwargs)
+                except Exception as e:
+                    if not vanilla:
+                        RequestLogger.log_error(request_type=request_type, url=url, error=e, log_title=log_title)
+                    raise
                 if not vanilla:
                     RequestLogger.log_response(request_type=request_type, url=url, response=response,
-                                               log_response_data=log_response_data, log_title=log_title)
+                                               log_response_data=log_response_data, log_title=log_title,
+                                               elapsed=time.perf_counter() - start)
                 return response
 
             return request_func_wrapper
 
         return log_decorator
 
+    @classmethod
+    def log_batch(cls, results, elapsed, log_title=None, caller_logger=None):
+        log_message = log_title or ''
+        errors = [result for result in results if not result.ok]
+        timed_out = [result for result in errors if isinstance(result.error, TimeoutError)]
+        statuses = {}
+        for result in results:
+            if result.ok:
+                statuses[result.response.status_code] = statuses.get(result.response.status_code, 0) + 1
+        log_message += 'Batch of {} requests in {:.3f}s: {} responses, {} errors, {} timed out'.format(
+            len(results), elapsed, len(results) - len(errors), len(errors) - len(timed_out), len(timed_out))
+        if statuses:
+            log_message += '\nSTATUS: {}'.format(json_lib.dumps(statuses, sort_keys=True))
+
+        logger_to_use = caller_logger or get_caller_logger(stack_depth=2, default_logger=logger)
+        logger_to_use.info(log_message)
+        print(log_message)
+
+    @classmethod
+    def get_log_executor(cls):
+        """
+        Single thread executor logging the requests of the event loops, so that the log lines keep their order &
+            the file writes do not block the loop
+        """
+        if cls._log_executor_pid != os.getpid():
+            RequestLogger._log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AsyncRequestLogger')
+            RequestLogger._log_executor_pid = os.getpid()
+        return cls._log_executor
+
+    @classmethod
+    def log_in_executor(cls, log_func, **kwargs):
+        """
+        Run the log function on the log executor without waiting for it
+        """
+        future = asyncio.get_running_loop().run_in_executor(cls.get_log_executor(),
+                                                            functools.partial(log_func, **kwargs))
+        future.add_done_callback(cls.log_executor_error)
+
+    @staticmethod
+    def log_executor_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            print('Error logging the async request : {}'.format(future.exception()))
+
+    @classmethod
+    def log_request_response_async(cls, request_type):
+        def log_decorator(request_func):
+            async def request_func_wrapper(_cls, url, log_response_data=True, log_title=None, *args, **kwargs):
+                kwargs['headers'] = inject_headers(kwargs.get('headers'))
+                caller_logger = get_caller_logger(stack_depth=1, default_logger=logger)
+                RequestLogger.log_in_executor(RequestLogger.log_request, request_type=request_type, url=url,
+                                              log_title=log_title, caller_logger=caller_logger, **kwargs)
+                start = time.perf_counter()
+                try:
+                    with span('{} {}'.format(request_type.upper(), url), kind='http'):
+                        response = await request_func(_cls, url, *args, **kwargs)
+                except Exception as e:
+                    RequestLogger.log_in_executor(RequestLogger.log_error, request_type=request_type, url=url,
+                                                  error=e, log_title=log_title, caller_logger=caller_logger)
+                    raise
+                RequestLogger.log_in_executor(RequestLogger.log_response, request_type=request_type, url=url,
+                                              response=response, log_response_data=log_response_data,
+                                              log_title=log_title, caller_logger=caller_logger,
+                                              elapsed=time.perf_counter() - start)
+                return response
+
+            return request_func_wrapper
+
+        return log_decorator
+
+
+class StreamedResponseLogger:
+    """
+    Follows the content of a streamed response as it is consumed (iter_content, iter_lines, content) without buffering
+        it: keeps up to prefix_bytes of the content & counts the bytes. The transfer is logged once the content is
+        consumed or the response is closed, with the time to the first byte & the total time.
+    """
+
+    def __init__(self, response, request_type, url, prefix_bytes=None, log_title=None, caller_logger=None,
+                 elapsed=None):
+        self.response = response
+        self.request_type = request_type
+        self.url = url
+        self.prefix_bytes = prefix_bytes
+        self.log_title = log_title
+        self.caller_logger = caller_logger or logger
+        # time of sending the request, as per the elapsed time of the response
+        self.start = time.perf_counter() - (elapsed or 0)
+        self.prefix = []
+        self.prefix_size = 0
+        self.bytes = 0
+        self.first_byte_at = None
+        self.logged = False
+
+        self.iter_content = response.iter_content
+        self.close = response.close
+        response.iter_content = self.follow_iter_content
+        response.close = self.follow_close
+
+    def follow_iter_content(self, *args, **kwargs):
+        for chunk in self.iter_content(*args, **kwargs):
+            self.record(chunk)
+            yield chunk
+        self.log()
+
+    def follow_close(self):
+        self.log()
+        self.close()
+
+    def record(self, chunk):
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+        self.bytes += len(chunk)
+        if self.prefix_bytes is None or self.prefix_size < self.prefix_bytes:
+            part = chunk if self.prefix_bytes is None else chunk[:self.prefix_bytes - self.prefix_size]
+            self.prefix.append(part)
+            self.prefix_size += len(part)
+
+    def log(self):
+        if self.logged:
+            return
+        self.logged = True
+
+        total_bytes = self.bytes
+        if not total_bytes and self.response.raw is not None and hasattr(self.response.raw, 'tell'):
+            # the content was read from response.raw directly
+            total_bytes = self.response.raw.tell()
+
+        now = time.perf_counter()
+        log_message = self.log_title or ''
+        log_message += 'Response stream for {request_type} on {url}:\nBYTES: {bytes}\nTIME: {timing}'.format(
+            request_type=self.request_type.upper(), url=self.url, bytes=total_bytes,
+            timing='first byte {}, total {:.1f}ms'.format(
+                '{:.1f}ms'.format((self.first_byte_at - self.start) * 1000) if self.first_byte_at else '-',
+                (now - self.start) * 1000))
+
+        if self.prefix_bytes is None or self.prefix_bytes > 0:
+            if self.prefix and isinstance(self.prefix[0], str):
+                prefix = ''.join(self.prefix)
+            else:
+                prefix = b''.join(self.prefix)
+            log_message += '\nCONTENT: {}{}'.format(prefix, TRUNCATION_MARKER if self.bytes > self.prefix_size else '')
+
+        self.caller_logger.info(log_message)
+        print(log_message)
+
 
 class LoggedRequests:
+    """
+    Logged outbound requests. The requests go through the shared sessions of common.utils.http_sessions, so the
+        connections to a host are kept alive & reused.
+    """
+
+    @classmethod
+    def request(cls, method, url, **kwargs):
+        """
+        Send the request through the shared sessions, as per the resilience policy of the host (common.utils.resilience)
+        :param kwargs: the kwargs of requests.request, & budget, hedge & retries (see Resilience.send)
+        """
+        from common.utils.http_sessions import session_registry
+        from common.utils.resilience import resilience
+        return resilience.send(session_registry.request, method, url, **kwargs)
+
     @classmethod
     @RequestLogger.log_request_response('get')
-    def get(cls, url, params=None, **kwargs):
-        from requests import get
-        response = get(url=url, params=params, **kwargs)
+    def get(cls, url, params=None, cache=None, **kwargs):
+        """
+        :param cache: True to use the HTTP cache of common.utils.http_cache, False not to. Default is the HTTP_CACHE
+            django setting
+        """
+        from common.utils.http_cache import http_cache
+        kwargs.setdefault('allow_redirects', True)
+        if http_cache.is_enabled(cache):
+            return http_cache.get(cls.request, url, params=params, **kwargs)
+        response = cls.request('get', url, params=params, **kwargs)
         return response
 
+    @classmethod
+    def batch(cls, request_specs, max_workers=10, max_per_host=None, deadline=None, log_title=None,
+              caller_logger=None):
+        """
+        Send the requests concurrently over a bounded thread pool. The requests are logged one by one & the batch is
+            summarized in a single log line.
+        :param request_specs: list of dicts -- the method ('get' by default), the url & the kwargs of the method e.g.
+            [{'url': 'http://host/items/1', 'params': {'fields': 'id'}}, {'method': 'post', 'url': ..., 'json': ...}]
+        :param max_workers: max requests in flight
+        :param max_per_host: max requests in flight per host. None for no limit
+        :param deadline: seconds for the whole batch. The requests not started by then are not sent. The started
+            requests run within the deadline budget of the time left (common.utils.resilience): their timeout is
+            capped to it & they are not retried past it. A request in flight at the deadline is not interrupted -- it
+            is reported as a TimeoutError & runs on in the background until its capped timeout, when its response is
+            dropped. None for no deadline
+        :param log_title: the log title of the summary line
+        :param caller_logger: the logger of the request & summary lines. Default is the logger of the calling file
+        :return: list of BatchResult in the order of request_specs; the error is the exception of a failed request,
+            a TimeoutError if the deadline passed before the request completed
+        """
+        from common.utils.resilience import cap_timeout, deadline as resilience_deadline
+        start = time.monotonic()
+        end = start + deadline if deadline is not None else None
+        caller_logger = caller_logger or get_caller_logger(stack_depth=1, default_logger=logger)
+        host_limits = {}
+        host_limits_lock = threading.Lock()
+
+        def send(spec):
+            request_start = time.monotonic()
+            try:
+                kwargs = dict(spec)
+                method = kwargs.pop('method', 'get').lower()
+                url = kwargs.pop('url')
+
+                host_limit = None
+                if max_per_host:
+                    with host_limits_lock:
+                        host_limit = host_limits.setdefault(urlsplit(url).netloc,
+                                                            threading.BoundedSemaphore(max_per_host))
+                    if not host_limit.acquire(timeout=None if end is None else max(end - time.monotonic(), 0)):
+                        raise TimeoutError('Batch deadline exceeded waiting for a {} connection'.format(url))
+                try:
+                    if end is not None:
+                        time_left = end - time.monotonic()
+                        if time_left <= 0:
+                            raise TimeoutError('Batch deadline exceeded before sending {}'.format(url))
+                        kwargs['timeout'] = cap_timeout(kwargs.get('timeout'), time_left)
+                        with resilience_deadline(time_left):
+                            response = getattr(cls, method)(url, caller_logger=caller_logger, **kwargs)
+                    else:
+                        response = getattr(cls, method)(url, caller_logger=caller_logger, **kwargs)
+                finally:
+                    if host_limit is not None:
+                        host_limit.release()
+            except Exception as e:
+                return BatchResult(spec, None, e, time.monotonic() - request_start)
+            return BatchResult(spec, response, None, time.monotonic() - request_start)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(request_specs) or 1)),
+                                      thread_name_prefix='LoggedRequestsBatch')
+        try:
+            # every request runs in a copy of the context of the caller e.g. with its trace
+            futures = [executor.submit(contextvars.copy_context().run, send, spec) for spec in request_specs]
+            wait(futures, timeout=None if end is None else max(end - time.monotonic(), 0))
+        finally:
+            # cancels the requests not started; the ones in flight finish on their own, within their capped timeout
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        results = []
+        for spec, future in zip(request_specs, futures):
+            if future.done() and not future.cancelled():
+                results.append(future.result())
+            else:
+                results.append(BatchResult(spec, None, TimeoutError('Batch deadline exceeded'),
+                                           time.monotonic() - start))
+
+        RequestLogger.log_batch(results, time.monotonic() - start, log_title=log_title, caller_logger=caller_logger)
+        return results
+
+    @classmethod
+    def map(cls, method, urls, max_workers=10, max_per_host=None, deadline=None, log_title=None, **kwargs):
+        """
+        Send the same request to every url concurrently (see batch)
+        LoggedRequests.map('get', ['http://host/items/{}'.format(item_id) for item_id in item_ids], max_workers=20)
+        :return: list of BatchResult in the order of urls
+        """
+        request_specs = [dict(kwargs, method=method, url=url) for url in urls]
+        return cls.batch(request_specs, max_workers=max_workers, max_per_host=max_per_host, deadline=deadline,
+                         log_title=log_title, caller_logger=get_caller_logger(stack_depth=1, default_logger=logger))
+
     @classmethod
     @RequestLogger.log_request_response('post')
     def post(cls, url, data=None, json=None, **kwargs):
-        from requests import post
-        response = post(url=url, data=data, json=json, **kwargs)
+        response = cls.request('post', url, data=data, json=json, **kwargs)
         return response
 
     @classmethod
     @RequestLogger.log_request_response('patch')
     def patch(cls, url, data=None, **kwargs):
-        from requests import patch
-        response = patch(url=url, data=data, **kwargs)
+        response = cls.request('patch', url, data=data, **kwargs)
         return response
 
     @classmethod
     @RequestLogger.log_request_response('put')
     def put(cls, url, data=None, **kwargs):
-        from requests import put
-        response = put(url=url, data=data, **kwargs)
+        response = cls.request('put', url, data=data, **kwargs)
         return response
 
     @classmethod
     @RequestLogger.log_request_response('delete')
     def delete(cls, url, **kwargs):
-        from requests import delete
-        response = delete(url=url, **kwargs)
+        response = cls.request('delete', url, **kwargs)
         return response
 
     @classmethod
     @RequestLogger.log_request_response('options')
     def options(cls, url, **kwargs):
-        from requests import options
-        response = options(url=url, **kwargs)
+        kwargs.setdefault('allow_redirects', True)
+        response = cls.request('options', url, **kwargs)
         return response
 
 
 class PatchedRequests:
+    """
+    Replacements of the requests library functions (patch_library) logging the requests & sending them through the
+        shared sessions of common.utils.http_sessions
+    """
+
+    @classmethod
+    def request(cls, method, url, **kwargs):
+        """
+        Send the request through the shared sessions, as per the resilience policy of the host (common.utils.resilience)
+        :param kwargs: the kwargs of requests.request, & budget, hedge & retries (see Resilience.send)
+        """
+        from common.utils.http_sessions import session_registry
+        from common.utils.resilience import resilience
+        return resilience.send(session_registry.request, method, url, **kwargs)
+
     @classmethod
     @RequestLogger.log_request_response_patched('get')
     def get(cls, url, params=None, **kwargs):
-        from requests import request
         kwargs.setdefault('allow_redirects', True)
-        response = request('get', url, params=params, **kwargs)
+        response = cls.request('get', url, params=params, **kwargs)
         return response
 
     @classmethod
     @RequestLogger.log_request_response_patched('post')
     def post(cls, url, data=None, json=None, **kwargs):
-        from requests import request
-        response = request('post', url, data=data, json=json, **kwargs)
+        response = cls.request('post', url, data=data, json=json, **kwargs)
         return response
 
     @classmethod
     @RequestLogger.log_request_response_patched('patch')
     def patch(cls, url, data=None, **kwargs):
-        from requests import request
-        response = request('patch', url, data=data, **kwargs)
+        response = cls.request('patch', url, data=data, **kwargs)
         return response
 
     @classmethod
     @RequestLogger.log_request_response_patched('put')
     def put(cls, url, data=None, **kwargs):
-        from requests import request
-        response = request('put', url, data=data, **kwargs)
+        response = cls.request('put', url, data=data, **kwargs)
         return response
 
     @classmethod
     @RequestLogger.log_request_response_patched('delete')
     def delete(cls, url, **kwargs):
-        from requests import request
-        response = request('delete', url, **kwargs)
+        response = cls.request('delete', url, **kwargs)
         return response
 
     @classmethod
     @RequestLogger.log_request_response_patched('options')
     def options(cls, url, **kwargs):
-        from requests import request
         kwargs.setdefault('allow_redirects', True)
-        response = request('options', url, **kwargs)
+        response = cls.request('options', url, **kwargs)
         return response
 
     @classmethod
@@ -178,3 +583,56 @@ class PatchedRequests:
         requests.put = cls.put
         requests.delete = cls.delete
         requests.options = cls.options
+
+
+class AsyncLoggedRequests:
+    """
+    asyncio variant of LoggedRequests, on the pooled httpx clients of common.utils.http_sessions (httpx required).
+    Takes the requests style arguments; the request & response are logged like LoggedRequests, on a background thread.
+    """
+
+    @classmethod
+    async def request(cls, method, url, **kwargs):
+        """
+        Send the request with the shared clients, as per the resilience policy of the host (common.utils.resilience)
+        Takes the budget, hedge & retries arguments of LoggedRequests
+        """
+        from common.utils.http_sessions import async_session_registry
+        from common.utils.resilience import resilience
+        return await resilience.send_async(async_session_registry.request, method, url, **kwargs)
+
+    @classmethod
+    @RequestLogger.log_request_response_async('get')
+    async def get(cls, url, params=None, **kwargs):
+        response = await cls.request('get', url, params=params, **kwargs)
+        return response
+
+    @classmethod
+    @RequestLogger.log_request_response_async('post')
+    async def post(cls, url, data=None, json=None, **kwargs):
+        response = await cls.request('post', url, data=data, json=json, **kwargs)
+        return response
+
+    @classmethod
+    @RequestLogger.log_request_response_async('patch')
+    async def patch(cls, url, data=None, **kwargs):
+        response = await cls.request('patch', url, data=data, **kwargs)
+        return response
+
+    @classmethod
+    @RequestLogger.log_request_response_async('put')
+    async def put(cls, url, data=None, **kwargs):
+        response = await cls.request('put', url, data=data, **kwargs)
+        return response
+
+    @classmethod
+    @RequestLogger.log_request_response_async('delete')
+    async def delete(cls, url, **kwargs):
+        response = await cls.request('delete', url, **kwargs)
+        return response
+
+    @classmethod
+    @RequestLogger.log_request_response_async('options')
+    async def options(cls, url, **kwargs):
+        response = await cls.request('options', url, **kwargs)
+        return response
@@ -0,0 +1,551 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from requests.exceptions import ConnectionError, Timeout
+
+from common.logging.metrics import LatencyHistogram
+
+__all__ = ['deadline', 'start_deadline', 'end_deadline', 'time_left', 'cap_timeout', 'CallPolicy', 'CircuitBreaker',
+           'CircuitOpenError', 'DeadlineExceeded', 'Resilience', 'resilience']
+
+# Header carrying the budget left in milliseconds, read from inbound requests & sent with the outbound requests to the
+# internal hosts (Resilience budget_hosts)
+BUDGET_HEADER = 'X-Request-Budget-Ms'
+
+# monotonic time by which the current request (context) is to be completed
+_current_deadline = contextvars.ContextVar('common_utils_deadline', default=None)
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# methods without side effects, safe to send twice at the same time
+HEDGED_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class DeadlineExceeded(Timeout):
+    """
+    The deadline budget of the request ran out before the outbound call could complete
+    """
+
+
+class CircuitOpenError(ConnectionError):
+    """
+    The circuit breaker of the host is open -- the call fails fast without being sent
+    """
+
+
+def start_deadline(seconds):
+    """
+    Start a deadline budget in the current context. A budget nested in another one cannot extend it.
+    :param seconds: the budget in seconds
+    :return: the token to be passed to end_deadline
+    """
+    end = time.monotonic() + seconds
+    current = _current_deadline.get()
+    return _current_deadline.set(end if current is None else min(current, end))
+
+
+def end_deadline(token):
+    try:
+        _current_deadline.reset(token)
+    except ValueError:
+        # the token was created in a different context
+        _current_deadline.set(None)
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Run the enclosed outbound calls within a deadline budget -- the timeouts of the calls are capped to the time left
+        & the calls fail with DeadlineExceeded once it has run out
+    with deadline(0.8):
+        LoggedRequests.get(...)
+    """
+    token = start_deadline(seconds)
+    try:
+        yield
+    finally:
+        end_deadline(token)
+
+
+def time_left():
+    """
+    :return: seconds left of the deadline budget of the current context, None if no budget is set
+    """
+    end = _current_deadline.get()
+    return None if end is None else end - time.monotonic()
+
+
+def cap_timeout(timeout, seconds):
+    """
+    :return: the requests timeout (seconds or a (connect, read) tuple) capped to seconds
+    """
+    if timeout is None:
+        return seconds
+    if isinstance(timeout, (tuple, list)):
+        return tuple(min(value, seconds) if value is not None else seconds for value in timeout)
+    return min(timeout, seconds)
+
+
+class CallPolicy:
+    """
+    Resilience policy of the outbound calls to a host:
+        retries -- retries of the idempotent calls failing with a connection error, a timeout or a retry_statuses
+            response, with full jitter exponential backoff: random(0, min(backoff_max, backoff_base * 2 ** retry))
+        hedge -- send a second attempt of the GET/HEAD/OPTIONS calls not answered after the hedge_percentile latency
+            of the host (hedge_delay seconds until hedge_min_samples calls are recorded) & take the first answer
+        circuit_breaker -- fail fast after failure_threshold consecutive failures (errors & 5xx responses) for
+            reset_timeout seconds, then let a single trial call through
+    """
+
+    def __init__(self, retries=0, backoff_base=0.1, backoff_max=2, retry_statuses=(502, 503, 504), hedge=False,
+                 hedge_percentile=95, hedge_delay=0.5, hedge_min_samples=20, circuit_breaker=True,
+                 failure_threshold=5, reset_timeout=30):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = tuple(retry_statuses)
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.circuit_breaker = circuit_breaker
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def backoff(self, retry):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+
+
+class CircuitBreaker:
+    """
+    Consecutive failures circuit breaker of a host: closed -> open after failure_threshold failures -> half open after
+        reset_timeout seconds, letting a single trial call through -> closed if it succeeds, else open again
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        :return: True if a call can be sent
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self.trial_running = False
+            if self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class Resilience:
+    """
+    Deadline budgets, hedging, retries & circuit breakers of the outbound calls of LoggedRequests, PatchedRequests &
+        AsyncLoggedRequests (send_async).
+    Opt in: with the HTTP_RESILIENCE django setting {'enabled': True, 'default': {CallPolicy kwargs},
+        'hosts': {host: {CallPolicy kwargs}}} every call follows the policy of its host; else only the calls with the
+        budget, hedge or retries arguments & the calls within a deadline budget are handled.
+    The budget left is sent in the X-Request-Budget-Ms header only to the internal hosts of budget_hosts (host or
+        host:port), so that it is not disclosed to third parties.
+    The attempts of a call are recorded on the response (response.resilience) & in its log lines.
+    """
+
+    def __init__(self, enabled=False, default=None, hosts=None, hedge_workers=32, budget_hosts=None):
+        self._lock = threading.Lock()
+        self._settings_loaded = False
+        self._set_options(enabled=enabled, default=default, hosts=hosts, hedge_workers=hedge_workers,
+                          budget_hosts=budget_hosts)
+
+    def _set_options(self, enabled=False, default=None, hosts=None, hedge_workers=32, budget_hosts=None):
+        self.enabled = enabled
+        self.default_policy = CallPolicy(**(default or {}))
+        self.policies = {host: CallPolicy(**policy_kwargs) for host, policy_kwargs in (hosts or {}).items()}
+        self.budget_hosts = frozenset(host.lower() for host in budget_hosts or ())
+        self.hedge_workers = hedge_workers
+        self._breakers = {}
+        self._latencies = {}
+        self._executor = None
+        self._executor_pid = None
+
+    def configure(self, **kwargs):
+        with self._lock:
+            self._settings_loaded = True
+            self._set_options(**kwargs)
+
+    def load_settings(self):
+        from django.conf import settings
+        self._settings_loaded = True
+        if settings.configured and getattr(settings, 'HTTP_RESILIENCE', None):
+            self._set_options(**settings.HTTP_RESILIENCE)
+
+    def get_policy(self, host):
+        return self.policies.get(host) or self.policies.get(host.split(':')[0]) or self.default_policy
+
+    def sends_budget(self, host):
+        """
+        :return: whether the budget header is sent to the host -- one of the budget_hosts, with or without the
+            port
+        """
+        host = host.lower()
+        return host in self.budget_hosts or host.rsplit('@', 1)[-1].split(':')[0] in self.budget_hosts
+
+    def get_breaker(self, host, policy):
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(host, CircuitBreaker(failure_threshold=policy.failure_threshold,
+                                                                         reset_timeout=policy.reset_timeout))
+        return breaker
+
+    def get_latency(self, host):
+        latency = self._latencies.get(host)
+        if latency is None:
+            with self._lock:
+                latency = self._latencies.setdefault(host, (LatencyHistogram(), threading.Lock()))
+        return latency
+
+    def get_executor(self):
+        if self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.hedge_workers,
+                                                        thread_name_prefix='HedgedRequests')
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def hedge_delay(self, host, policy):
+        """
+        :return: seconds to wait for the first attempt before sending the hedge -- the hedge_percentile latency of the
+            host
+        """
+        histogram, lock = self.get_latency(host)
+        with lock:
+            if histogram.count < policy.hedge_min_samples:
+                return policy.hedge_delay
+            return histogram.percentile(policy.hedge_percentile) / 1e6
+
+    def breaker_states(self):
+        """
+        :return: dict of host -> circuit breaker state
+        """
+        return {host: breaker.state for host, breaker in list(self._breakers.items())}
+
+    def send(self, send, method, url, budget=None, hedge=None, retries=None, **kwargs):
+        """
+        Send the call as per the policy of its host
+        :param send: the function sending a request -- send(method, url, **kwargs)
+        :param budget: deadline budget in seconds for this call (within the budget of the context, if any)
+        :param hedge: True/False to override the hedge option of the policy
+        :param retries: the number of retries, to override the policy
+        :return: the response, with the attempts of the call recorded in response.resilience
+        """
+        if not self._settings_loaded:
+            with self._lock:
+                if not self._settings_loaded:
+                    self.load_settings()
+
+        if not self.enabled and budget is None and hedge is None and retries is None \
+                and _current_deadline.get() is None:
+            return send(method, url, **kwargs)
+
+        if budget is None:
+            return self.send_with_policy(send, method, url, hedge, retries, kwargs)
+        with deadline(budget):
+            return self.send_with_policy(send, method, url, hedge, retries, kwargs)
+
+    async def send_async(self, send, method, url, budget=None, hedge=None, retries=None, **kwargs):
+        """
+        asyncio variant of send
+        :param send: the coroutine function sending a request -- await send(method, url, **kwargs)
+        :return: the response, with the attempts of the call recorded in response.resilience
+        """
+        if not self._settings_loaded:
+            with self._lock:
+                if not self._settings_loaded:
+                    self.load_settings()
+
+        if not self.enabled and budget is None and hedge is None and retries is None \
+                and _current_deadline.get() is None:
+            return await send(method, url, **kwargs)
+
+        if budget is None:
+            return await self.send_with_policy_async(send, method, url, hedge, retries, kwargs)
+        with deadline(budget):
+            return await self.send_with_policy_async(send, method, url, hedge, retries, kwargs)
+
+    def get_call(self, method, url, hedge, retries):
+        """
+        :return: (host, policy, method, retries, hedge, circuit breaker or None, whether the budget is sent, record of
+            the attempts) of a call
+        """
+        host = urlsplit(url).netloc
+        policy = self.get_policy(host)
+        method = method.upper()
+        retries = (policy.retries if retries is None else retries) if method in IDEMPOTENT_METHODS else 0
+        hedge = (policy.hedge if hedge is None else hedge) and method in HEDGED_METHODS
+        breaker = self.get_breaker(host, policy) if self.enabled and policy.circuit_breaker else None
+        # updated only by the caller, not by the attempts running on the hedging executor or tasks
+        record = {'attempts': 0, 'retries': 0, 'hedged': False, 'winner': None}
+        return host, policy, method, retries, hedge, breaker, self.sends_budget(host), record
+
+    @staticmethod
+    def get_attempt_kwargs(url, host, kwargs, breaker, send_budget, record):
+        """
+        :return: the kwargs of the next attempt, with the timeout capped to the budget left
+        :raise: CircuitOpenError if the circuit breaker of the host is open, DeadlineExceeded if the budget ran out
+        """
+        if breaker is not None and not breaker.allow():
+            error = CircuitOpenError('Circuit breaker open for {}'.format(host))
+            error.resilience = record
+            raise error
+        seconds_left = time_left()
+        if seconds_left is not None and seconds_left <= 0:
+            error = DeadlineExceeded('Deadline budget exceeded for {}'.format(url))
+            error.resilience = record
+            raise error
+
+        attempt_kwargs = dict(kwargs)
+        if seconds_left is not None:
+            attempt_kwargs['timeout'] = cap_timeout(kwargs.get('timeout'), seconds_left)
+            if send_budget:
+                attempt_kwargs['headers'] = dict(kwargs.get('headers') or {},
+                                                 **{BUDGET_HEADER: str(int(seconds_left * 1000))})
+        return attempt_kwargs
+
+    @staticmethod
+    def get_backoff(policy, retry, retries, response, error):
+        """
+        :return: seconds to wait before retrying the attempt, None if it is not to be retried
+        """
+        retryable = (error is not None and not isinstance(error, (CircuitOpenError, DeadlineExceeded))) or \
+                    (response is not None and response.status_code in policy.retry_statuses)
+        backoff = policy.backoff(retry) if retryable and retry < retries else None
+        seconds_left = time_left()
+        if backoff is None or (seconds_left is not None and backoff >= seconds_left):
+            return None
+        return backoff
+
+    def send_with_policy(self, send, method, url, hedge, retries, kwargs):
+        host, policy, method, retries, hedge, breaker, send_budget, record = self.get_call(method, url, hedge, retries)
+
+        retry = 0
+        while True:
+            attempt_kwargs = self.get_attempt_kwargs(url, host, kwargs, breaker, send_budget, record)
+            response, error = None, None
+            try:
+                if hedge:
+                    response = self.send_hedged(send, method, url, attempt_kwargs, host, policy, breaker, record)
+                else:
+                    record['attempts'] += 1
+                    response = self.send_attempt(send, method, url, attempt_kwargs, host, breaker)
+            except (ConnectionError, Timeout) as e:
+                error = e
+
+            backoff = self.get_backoff(policy, retry, retries, response, error)
+            if backoff is None:
+                if error is not None:
+                    error.resilience = record
+                    raise error
+                response.resilience = record
+                return response
+
+            if response is not None:
+                response.close()
+            time.sleep(backoff)
+            retry += 1
+            record['retries'] = retry
+
+    async def send_with_policy_async(self, send, method, url, hedge, retries, kwargs):
+        import httpx
+
+        host, policy, method, retries, hedge, breaker, send_budget, record = self.get_call(method, url, hedge, retries)
+
+        retry = 0
+        while True:
+            attempt_kwargs = self.get_attempt_kwargs(url, host, kwargs, breaker, send_budget, record)
+            response, error = None, None
+            try:
+                if hedge:
+                    response = await self.send_hedged_async(send, method, url, attempt_kwargs, host, policy, breaker,
+                                                            record)
+                else:
+                    record['attempts'] += 1
+                    response = await self.send_attempt_async(send, method, url, attempt_kwargs, host, breaker)
+            except (ConnectionError, Timeout, httpx.TransportError) as e:
+                error = e
+
+            backoff = self.get_backoff(policy, retry, retries, response, error)
+            if backoff is None:
+                if error is not None:
+                    error.resilience = record
+                    raise error
+                response.resilience = record
+                return response
+
+            if response is not None:
+                await response.aclose()
+            await asyncio.sleep(backoff)
+            retry += 1
+            record['retries'] = retry
+
+    def send_attempt(self, send, method, url, kwargs, host, breaker):
+        """
+        Send a single attempt, recording its latency & outcome for the host
+        """
+        start = time.perf_counter()
+        try:
+            response = send(method, url, **kwargs)
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        self.record_attempt(host, breaker, start, response)
+        return response
+
+    async def send_attempt_async(self, send, method, url, kwargs, host, breaker):
+        start = time.perf_counter()
+        try:
+            response = await send(method, url, **kwargs)
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        self.record_attempt(host, breaker, start, response)
+        return response
+
+    def record_attempt(self, host, breaker, start, response):
+        histogram, lock = self.get_latency(host)
+        with lock:
+            histogram.record((time.perf_counter() - start) * 1e6)
+        if breaker is not None:
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+    def send_hedged(self, send, method, url, kwargs, host, policy, breaker, record):
+        """
+        Send the attempt & a second one if the first is not answered in the hedge delay; the first good answer wins
+        """
+        executor = self.get_executor()
+        record['attempts'] += 1
+        primary = executor.submit(contextvars.copy_context().run, self.send_attempt, send, method, url, kwargs, host,
+                                  breaker)
+        delay = self.hedge_delay(host, policy)
+        seconds_left = time_left()
+        if seconds_left is not None:
+            delay = min(delay, max(seconds_left, 0))
+        if wait([primary], timeout=delay).done:
+            record['winner'] = 'primary'
+            return primary.result()
+
+        record['hedged'] = True
+        record['attempts'] += 1
+        hedged = executor.submit(contextvars.copy_context().run, self.send_attempt, send, method, url, kwargs, host,
+                                 breaker)
+        pending = {primary: 'primary', hedged: 'hedge'}
+        last = None
+        while pending:
+            seconds_left = time_left()
+            done, _ = wait(list(pending), timeout=None if seconds_left is None else max(seconds_left, 0),
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.add_done_callback(self.close_response)
+                raise DeadlineExceeded('Deadline budget exceeded for {}'.format(url))
+
+            for future in done:
+                name = pending.pop(future)
+                last = future
+                if future.exception() is None and future.result().status_code < 500:
+                    record['winner'] = name
+                    for other in pending:
+                        other.add_done_callback(self.close_response)
+                    return future.result()
+
+        record['winner'] = 'none'
+        return last.result()
+
+    async def send_hedged_async(self, send, method, url, kwargs, host, policy, breaker, record):
+        """
+        asyncio variant of send_hedged; the attempt that lost is cancelled
+        """
+        record['attempts'] += 1
+        primary = asyncio.ensure_future(self.send_attempt_async(send, method, url, kwargs, host, breaker))
+        delay = self.hedge_delay(host, policy)
+        seconds_left = time_left()
+        if seconds_left is not None:
+            delay = min(delay, max(seconds_left, 0))
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done:
+            record['winner'] = 'primary'
+            return primary.result()
+
+        record['hedged'] = True
+        record['attempts'] += 1
+        hedged = asyncio.ensure_future(self.send_attempt_async(send, method, url, kwargs, host, breaker))
+        pending = {primary: 'primary', hedged: 'hedge'}
+        last = None
+        try:
+            while pending:
+                seconds_left = time_left()
+                done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED,
+                                             timeout=None if seconds_left is None else max(seconds_left, 0))
+                if not done:
+                    raise DeadlineExceeded('Deadline budget exceeded for {}'.format(url))
+
+                for task in done:
+                    name = pending.pop(task)
+                    last = task
+                    if task.exception() is None and task.result().status_code < 500:
+                        record['winner'] = name
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        record['winner'] = 'none'
+        return last.result()
+
+    @staticmethod
+    def close_response(future):
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+
+# Process wide resilience policies of the outbound calls
+resilience = Resilience()
@@ -1,10 +1,21 @@
+import contextvars
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from ssl import CertificateError
 from urllib.request import urlretrieve
 
 import boto
 from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
 from django.conf import settings
 
+from common.logging.tracing import traced
+from common.utils.http import TransferProgress
+
 __all__ = ['S3Operations']
 
 
@@ -15,56 +26,159 @@ class S3Operations:
     bucket_name = settings.BUCKET_NAME
     access_key_id = settings.AWS_ACCESS_KEY_ID
     secret_access_key = settings.AWS_SECRET_ACCESS_KEY
+    # default boto.connect_s3 kwargs, e.g. the host, port, is_secure & calling_format of an S3 compatible server
+    connection_kwargs = getattr(settings, 'AWS_S3_CONNECTION', None) or {}
 
     # Public urls will be of the format https://seller.payments.s3.amazonaws.com/DUMMY/Dummy_POD_Image.png
     public_url_format = 'https://{}.s3.amazonaws.com/{}'
 
+    # connections & buckets of every thread (boto connections are not thread safe), reused by the calls of the thread
+    # -- see get_s3_conn & get_s3_bucket
+    _local = threading.local()
+    # (connection key without is_secure, bucket name) that failed the certificate validation & use insecure connections
+    _insecure = set()
+
+    # size of the parts of the multipart uploads -- at least 5MB, except the last part
+    multipart_part_size = 8 * 1024 * 1024
+    # files of at least this size are pushed as multipart uploads of parts uploaded in parallel
+    multipart_threshold = 64 * 1024 * 1024
+    multipart_workers = 4
+    # retries of a failed part, with exponential backoff from multipart_retry_delay seconds
+    multipart_retries = 3
+    multipart_retry_delay = 0.5
+    max_parts = 10000
+
     @classmethod
-    def get_s3_conn(cls, access_key_id=None, secret_access_key=None, **kwargs):
+    def get_conn_key(cls, access_key_id=None, secret_access_key=None, **kwargs):
         """
-        Ge the s3 connection object
+        :return: the cache key of the connection of the credentials & the boto.connect_s3 kwargs
+        """
+        kwargs = dict(cls.connection_kwargs, **kwargs)
+        return (access_key_id or cls.access_key_id, secret_access_key or cls.secret_access_key,
+                tuple(sorted((name, repr(value)) for name, value in kwargs.items())))
+
+    @classmethod
+    def get_thread_cache(cls):
+        """
+        :return: the (connections, buckets) dicts of the thread; the ones inherited from the parent process are dropped
+        """
+        local = S3Operations._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connections = {}
+            local.buckets = {}
+            local.pid = os.getpid()
+        return local.connections, local.buckets
+
+    @classmethod
+    def get_s3_conn(cls, access_key_id=None, secret_access_key=None, bucket_name=None, **kwargs):
+        """
+        Ge the s3 connection object. The connection is created once per thread for the credentials & kwargs, & is
+            insecure (is_secure=False) if a secure one failed the certificate validation for the bucket before
         :param access_key_id: access key id to use. default is the key id specified in settings
         :param secret_access_key: secret key for the access key id. default is the secret key specified in settings
+        :param bucket_name: the bucket to be accessed. default is the bucket name defined in settings
+        :param kwargs: the boto.connect_s3 kwargs, over the connection_kwargs (AWS_S3_CONNECTION setting)
         :return: the s3 connection object
         """
+        kwargs = dict(cls.connection_kwargs, **kwargs)
         access_key_id = access_key_id or cls.access_key_id
         secret_access_key = secret_access_key or cls.secret_access_key
-        return boto.connect_s3(access_key_id, secret_access_key, **kwargs)
+        bucket_name = bucket_name or cls.bucket_name
+        if 'is_secure' not in kwargs and \
+                (cls.get_conn_key(access_key_id, secret_access_key, **kwargs), bucket_name) in cls._insecure:
+            kwargs['is_secure'] = False
+
+        connections, _ = cls.get_thread_cache()
+        key = cls.get_conn_key(access_key_id, secret_access_key, **kwargs)
+        conn = connections.get(key)
+        if conn is None:
+            conn = connections[key] = boto.connect_s3(access_key_id, secret_access_key, **kwargs)
+        return conn
 
     @classmethod
     def get_s3_bucket(cls, bucket_name=None, **kwargs):
         """
-        Get the s3 bucket for the specified params
+        Get the s3 bucket for the specified params. The bucket is not validated (no request is made) & is reused by the
+            later calls of the thread; a missing bucket fails the operations on it.
         :param bucket_name: the bucket name. default is the bucket name defined in settings
         :return: the bucket object
         """
         bucket_name = bucket_name or cls.bucket_name
 
-        conn = cls.get_s3_conn(**kwargs)
+        conn = cls.get_s3_conn(bucket_name=bucket_name, **kwargs)
+        _, buckets = cls.get_thread_cache()
+        key = (id(conn), bucket_name)
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = conn.get_bucket(bucket_name, validate=False)
+
+        return bucket
+
+    @classmethod
+    def with_bucket(cls, func, bucket_name=None, **kwargs):
+        """
+        Run func(bucket) with the bucket of get_s3_bucket. On a CertificateError, the insecure connection is
+            remembered for the credentials & the bucket, & func is run again with it.
+        :return: the result of func
+        """
         try:
-            bucket = conn.get_bucket(bucket_name)
+            return func(cls.get_s3_bucket(bucket_name=bucket_name, **kwargs))
         except CertificateError:
-            conn = cls.get_s3_conn(is_secure=False, **kwargs)
-            bucket = conn.get_bucket(bucket_name)
+            if kwargs.get('is_secure') is False:
+                raise
+            kwargs.pop('is_secure', None)
+            cls._insecure.add((cls.get_conn_key(**kwargs), bucket_name or cls.bucket_name))
+            return func(cls.get_s3_bucket(bucket_name=bucket_name, **kwargs))
 
-        return bucket
+    @classmethod
+    def clear_connections(cls):
+        """
+        Close the cached connections of the thread & forget the insecure fallbacks, e.g. after rotating the
+            credentials. The connections of the other threads are dropped, & closed when collected.
+        """
+        connections, _ = cls.get_thread_cache()
+        for conn in connections.values():
+            try:
+                conn.close()
+            except Exception:
+                pass
+        S3Operations._local = threading.local()
+        S3Operations._insecure = set()
 
     @classmethod
-    def push_via_file_path(cls, file_path, filename, s3_dir, mode='public', **kwargs):
+    @traced('s3')
+    def push_via_file_path(cls, file_path, filename, s3_dir, mode='public', progress=None, part_size=None,
+                           workers=None, **kwargs):
         """
-        push a local file to s3
+        push a local file to s3. Files of at least multipart_threshold bytes are pushed as parallel multipart uploads
         :param file_path: the local path of the file
         :param filename: the name of the file stored locally
         :param s3_dir: the s3 directory to which the file is to be pushed
         :param mode: the mode of file storage public/private
+        :param progress: callback receiving (bytes uploaded, total bytes, bytes per second)
+        :param part_size: the part size of the multipart uploads (see upload_multipart)
+        :param workers: the parts uploaded at a time by the multipart uploads (see upload_multipart)
         :return: the s3 key and url of the file
         """
         try:
-            bucket = cls.get_s3_bucket(**kwargs)
+            def upload(bucket):
+                key_obj = Key(bucket)
+                key_obj.key = "{}/{}".format(s3_dir, filename)
+                size = os.path.getsize(file_path)
+                if size >= cls.multipart_threshold:
+                    cls.upload_multipart(bucket, key_obj.key, file_path, progress=progress, part_size=part_size,
+                                         workers=workers, **kwargs)
+                elif progress is None:
+                    key_obj.set_contents_from_filename(file_path)
+                else:
+                    tracker = TransferProgress(progress, total=size)
+                    # boto calls cb(bytes sent, total bytes) after every buffer sent with num_cb=-1
+                    key_obj.set_contents_from_filename(
+                        file_path, cb=lambda sent, total: tracker.add(sent - tracker.bytes), num_cb=-1)
+                    tracker.finish()
+                return key_obj
 
-            key_obj = Key(bucket)
-            key_obj.key = "{}/{}".format(s3_dir, filename)
-            key_obj.set_contents_from_filename(file_path)
+            key_obj = cls.with_bucket(upload, **kwargs)
 
             if mode == 'public':
                 key_obj.make_public()
@@ -78,6 +192,7 @@ class S3Operations:
             return None, None
 
     @classmethod
+    @traced('s3')
     def push_via_file_object(cls, file_obj, filename, s3_dir, mode='private', **kwargs):
         """
         push file object to s3 directory
@@ -88,14 +203,16 @@ class S3Operations:
         :return: the s3 key and the url generated for the file
         """
         try:
-            # point to the beginning of the file
-            file_obj.seek(0)
+            def upload(bucket):
+                # point to the beginning of the file
+                file_obj.seek(0)
 
-            bucket = cls.get_s3_bucket(**kwargs)
+                key_obj = Key(bucket)
+                key_obj.key = "{}/{}".format(s3_dir, filename)
+                key_obj.set_contents_from_file(file_obj)
+                return key_obj
 
-            key_obj = Key(bucket)
-            key_obj.key = "{}/{}".format(s3_dir, filename)
-            key_obj.set_contents_from_file(file_obj)
+            key_obj = cls.with_bucket(upload, **kwargs)
 
             if mode == 'public':
                 key_obj.make_public()
@@ -108,6 +225,110 @@ class S3Operations:
             print("error pushing file object to s3 : {}".format(e))
             return None, None
 
+    @classmethod
+    @traced('s3')
+    def push_via_chunks(cls, chunks, filename, s3_dir, mode='private', part_size=None, **kwargs):
+        """
+        push the iterable of bytes chunks (e.g. a ZipStream) to s3 as a multipart upload, without the whole content
+            in memory or on disk. The upload is aborted if the chunks or a part fail.
+        :param chunks: the iterable of bytes
+        :param filename: the name to store the object with
+        :param s3_dir: the s3 directory to push the object to
+        :param mode: private or public url to be generated
+        :param part_size: the size of the uploaded parts. Default is multipart_part_size
+        :return: the s3 key and the url generated for the file
+        """
+        part_size = part_size or cls.multipart_part_size
+        try:
+            key_name = "{}/{}".format(s3_dir, filename)
+            # the chunks are read once, after the upload is initiated over a working connection
+            bucket, multipart = cls.with_bucket(
+                lambda bucket: (bucket, bucket.initiate_multipart_upload(key_name)), **kwargs)
+            try:
+                part_number = 0
+                buffer = bytearray()
+                for chunk in chunks:
+                    buffer += chunk
+                    while len(buffer) >= part_size:
+                        part_number += 1
+                        multipart.upload_part_from_file(BytesIO(buffer[:part_size]), part_number)
+                        del buffer[:part_size]
+                if buffer or not part_number:
+                    multipart.upload_part_from_file(BytesIO(buffer), part_number + 1)
+                multipart.complete_upload()
+            except BaseException:
+                multipart.cancel_upload()
+                raise
+
+            key_obj = Key(bucket)
+            key_obj.key = key_name
+            if mode == 'public':
+                key_obj.make_public()
+                url = key_obj.generate_url(expires_in=0, query_auth=False)
+            else:
+                url = cls.generate_private_url(key_name=key_obj.key, **kwargs)
+
+            return key_obj.key, url
+        except Exception as e:
+            print("error pushing chunks to s3 : {}".format(e))
+            return None, None
+
+    @classmethod
+    def upload_multipart(cls, bucket, key_name, file_path, progress=None, part_size=None, workers=None, **kwargs):
+        """
+        Upload the file as a multipart upload of parts uploaded in parallel. The parts are read from a memory map of
+            the file by PartReader, so no part is held in memory as a whole -- boto copies them in buffers of a few KB
+            while hashing & sending. Failed parts are retried; the upload is aborted if a part fails for good.
+            Every worker uploads its parts over the connection of its thread (get_s3_bucket with kwargs).
+        :param bucket: the bucket object
+        :param key_name: the s3 key
+        :param file_path: the local path of the file
+        :param progress: callback receiving (bytes uploaded, total bytes, bytes per second)
+        :param part_size: default is multipart_part_size, increased to fit the file in max_parts parts
+        :param workers: parts uploaded at a time. Default is multipart_workers
+        :param kwargs: the get_s3_bucket kwargs (credentials & boto.connect_s3 kwargs) of the connections of the workers
+        """
+        size = os.path.getsize(file_path)
+        part_size = max(part_size or cls.multipart_part_size, -(-size // cls.max_parts))
+        tracker = TransferProgress(progress, total=size)
+
+        multipart = bucket.initiate_multipart_upload(key_name)
+        try:
+            with open(file_path, 'rb') as file_obj, \
+                    mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                def upload_part(part_number, start):
+                    # the multipart upload over the bucket of the connection of the worker thread
+                    part_upload = MultiPartUpload(cls.get_s3_bucket(**dict(kwargs, bucket_name=bucket.name)))
+                    part_upload.key_name = multipart.key_name
+                    part_upload.id = multipart.id
+                    with memoryview(mapped)[start:start + part_size] as part:
+                        for attempt in range(cls.multipart_retries + 1):
+                            try:
+                                part_upload.upload_part_from_file(PartReader(part), part_number, size=len(part))
+                                break
+                            except Exception:
+                                if attempt == cls.multipart_retries:
+                                    raise
+                                time.sleep(cls.multipart_retry_delay * 2 ** attempt)
+                        tracker.add(len(part))
+
+                with ThreadPoolExecutor(max_workers=workers or cls.multipart_workers,
+                                        thread_name_prefix='S3Multipart') as executor:
+                    futures = [executor.submit(contextvars.copy_context().run, upload_part, number, start)
+                               for number, start in enumerate(range(0, size, part_size), 1)]
+                    try:
+                        for future in futures:
+                            future.result()
+                    except BaseException:
+                        for future in futures:
+                            future.cancel()
+                        raise
+            multipart.complete_upload()
+        except BaseException:
+            multipart.cancel_upload()
+            raise
+        tracker.finish()
+
     @classmethod
     def generate_public_url(cls, key_name, bucket_name=None):
         """
@@ -120,6 +341,7 @@ class S3Operations:
         return cls.public_url_format.format(bucket_name, key_name)
 
     @classmethod
+    @traced('s3')
     def generate_private_url(cls, key_name, **kwargs):
         """
         generate a private s3 url for the specified s3 key
@@ -129,17 +351,14 @@ class S3Operations:
         if key_name is None or key_name == '':
             return None
 
+        # signed locally, with the scheme of the remembered secure/insecure connection
         conn = cls.get_s3_conn(**kwargs)
-
-        try:
-            key_url = conn.generate_url(604800, 'GET', cls.bucket_name, key_name)
-        except CertificateError:
-            conn = cls.get_s3_conn(is_secure=False, **kwargs)
-            key_url = conn.generate_url(604800, 'GET', cls.bucket_name, key_name)
+        key_url = conn.generate_url(604800, 'GET', kwargs.get('bucket_name') or cls.bucket_name, key_name)
 
         return key_url
 
     @classmethod
+    @traced('s3')
     def fetch_file(cls, key_name, file_path, key_type='public', **kwargs):
         """
         fetch file from s3 & save to local storage
@@ -159,3 +378,38 @@ class S3Operations:
             print("error downloading s3 key {} to {} : {}".format(key_name, file_path, e))
             return False
         return True
+
+
+class PartReader:
+    """
+    Read only file object over a memoryview of a part of a file. read() copies only the requested bytes, as boto
+        needs bytes; readinto() copies them straight into the buffer of the caller.
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.position + size, len(self.view))
+        data = self.view[self.position:end].tobytes()
+        self.position = max(end, self.position)
+        return data
+
+    def readinto(self, buffer):
+        with memoryview(buffer) as target:
+            size = max(min(len(target), len(self.view) - self.position), 0)
+            target[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += len(self.view)
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
@@ -0,0 +1,249 @@
+import os
+import shutil
+import stat
+import threading
+import time
+
+from common.utils.file_ops import TempWorkspace
+
+__all__ = ['TempJanitor', 'temp_janitor']
+
+
+class TempJanitor:
+    """
+    Reclaims the space of the temp roots (the download & workspace directories) left to the callers to clean up.
+    The entries of every root (its files & directories) are removed:
+        -- when not modified in max_age seconds
+        -- least recently modified first while the root is above its max_bytes quota
+    Entries modified in the last min_age seconds (in progress downloads) & live TempWorkspaces are never removed.
+    The roots are scanned with os.scandir in batches of batch_size entries with a pause of batch_pause seconds after
+        every batch, so that large trees do not stall the disk for the other threads & processes. With background=True
+        the roots are cleaned every interval seconds on a daemon thread of every process, at the lowest cpu priority.
+        A lock file keeps the processes of the host from cleaning a root at the same time.
+    The settings can be configured by the TEMP_JANITOR django setting -- a dict of the __init__ kwargs. roots is a list
+        of dicts of path & the max_age, max_bytes & min_age of the root (None for no limit).
+    """
+    LOCK_NAME = '.janitor.lock'
+
+    def __init__(self, roots=None, background=False, interval=300, max_age=86400, max_bytes=None, min_age=60,
+                 batch_size=500, batch_pause=0.01):
+        self._lock = threading.Lock()
+        self._settings_loaded = False
+        self.thread = None
+        self.pid = None
+        self.wake = threading.Event()
+        self._set_options(roots=roots, background=background, interval=interval, max_age=max_age,
+                          max_bytes=max_bytes, min_age=min_age, batch_size=batch_size, batch_pause=batch_pause)
+
+    def _set_options(self, roots=None, background=False, interval=300, max_age=86400, max_bytes=None, min_age=60,
+                     batch_size=500, batch_pause=0.01):
+        # None for the download directory of HttpOperations & the root of TempWorkspace
+        self._roots = roots
+        self.root_defaults = {'max_age': max_age, 'max_bytes': max_bytes, 'min_age': min_age}
+        self.background = background
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.scanned = 0
+        self.reclaimed_bytes = 0
+        self.removed = 0
+        self.last_reports = []
+
+    def configure(self, **kwargs):
+        """
+        Replace the settings of the janitor. A running background thread picks them up at its next run.
+        """
+        with self._lock:
+            self._settings_loaded = True
+            self._set_options(**kwargs)
+
+    def load_settings(self):
+        from django.conf import settings
+        self._settings_loaded = True
+        if settings.configured and getattr(settings, 'TEMP_JANITOR', None):
+            self._set_options(**settings.TEMP_JANITOR)
+
+    @property
+    def roots(self):
+        roots = self._roots
+        if roots is None:
+            from common.utils.http import HttpOperations
+            roots = [{'path': HttpOperations.temp_download_directory}, {'path': TempWorkspace.root}]
+        return [dict(self.root_defaults, **root) for root in roots]
+
+    def ensure_running(self):
+        """
+        Start the background thread of the process if enabled by the settings
+        """
+        if self.pid == os.getpid():
+            return
+        with self._lock:
+            if not self._settings_loaded:
+                self.load_settings()
+            if self.pid == os.getpid() or not self.background:
+                return
+            self.pid = os.getpid()
+            self.wake = threading.Event()
+            self.thread = threading.Thread(target=self.run, name='TempJanitor', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        try:
+            # the lowest priority for this thread only (linux)
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while not self.wake.wait(self.interval):
+            try:
+                for report in self.clean():
+                    if report['removed']:
+                        print('TempJanitor reclaimed {reclaimed_bytes} bytes of {removed} entries in {root} '
+                              '({bytes} bytes left)'.format(**report))
+            except Exception as e:
+                print('Error cleaning the temp roots : {}'.format(e))
+
+    def stop(self):
+        self.wake.set()
+        self.pid = None
+
+    def pause(self):
+        """
+        Called after every scanned entry; sleeps batch_pause seconds after every batch_size entries
+        """
+        self.scanned += 1
+        if self.batch_pause and self.scanned % self.batch_size == 0:
+            time.sleep(self.batch_pause)
+
+    def measure(self, path):
+        """
+        :return: (total size, latest modification time) of the file, or of the directory & its files
+        """
+        try:
+            path_stat = os.lstat(path)
+        except FileNotFoundError:
+            return 0, 0
+        if not stat.S_ISDIR(path_stat.st_mode):
+            return path_stat.st_size, path_stat.st_mtime
+
+        size, latest = 0, path_stat.st_mtime
+        directories = [path]
+        while directories:
+            try:
+                with os.scandir(directories.pop()) as entries:
+                    for entry in entries:
+                        self.pause()
+                        try:
+                            entry_stat = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue
+                        latest = max(latest, entry_stat.st_mtime)
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                        else:
+                            size += entry_stat.st_size
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+        return size, latest
+
+    @staticmethod
+    def remove(path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clean_root(self, root, dry_run=False):
+        """
+        Remove the expired entries of the root & the oldest ones above its quota
+        :param root: dict of path, max_age, max_bytes & min_age
+        :param dry_run: report the entries to be removed without removing them
+        :return: the report dict -- root, entries, bytes (left), removed, reclaimed_bytes, live & duration
+        """
+        start = time.monotonic()
+        report = {'root': root['path'], 'entries': 0, 'bytes': 0, 'removed': 0, 'reclaimed_bytes': 0, 'live': 0}
+        if not os.path.isdir(root['path']):
+            report['duration'] = 0
+            return report
+
+        lock_path = os.path.join(root['path'], self.LOCK_NAME)
+        try:
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # being cleaned by another process, unless the lock was left by a killed one
+            if time.time() - os.path.getmtime(lock_path) < max(self.interval, 3600):
+                report['duration'] = 0
+                return report
+            os.utime(lock_path)
+            lock_fd = None
+
+        try:
+            now = time.time()
+            candidates = []
+            with os.scandir(root['path']) as entries:
+                for entry in entries:
+                    self.pause()
+                    if entry.name == self.LOCK_NAME:
+                        continue
+                    size, modified_at = self.measure(entry.path)
+                    report['entries'] += 1
+                    report['bytes'] += size
+                    if entry.is_dir(follow_symlinks=False) and TempWorkspace.is_live(entry.path):
+                        report['live'] += 1
+                    elif root['min_age'] is None or now - modified_at >= root['min_age']:
+                        candidates.append((modified_at, size, entry.path))
+
+            # least recently modified first
+            candidates.sort()
+            for modified_at, size, path in candidates:
+                expired = root['max_age'] is not None and now - modified_at > root['max_age']
+                over_quota = root['max_bytes'] is not None and report['bytes'] > root['max_bytes']
+                if not expired and not over_quota:
+                    continue
+                if not dry_run:
+                    self.remove(path)
+                report['entries'] -= 1
+                report['bytes'] -= size
+                report['removed'] += 1
+                report['reclaimed_bytes'] += size
+        finally:
+            if lock_fd is not None:
+                os.close(lock_fd)
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+
+        if not dry_run:
+            self.removed += report['removed']
+            self.reclaimed_bytes += report['reclaimed_bytes']
+        report['duration'] = round(time.monotonic() - start, 3)
+        return report
+
+    def clean(self, dry_run=False):
+        """
+        Clean all the roots
+        :return: list of the report dicts of the roots
+        """
+        if not self._settings_loaded:
+            with self._lock:
+                if not self._settings_loaded:
+                    self.load_settings()
+        reports = [self.clean_root(root, dry_run=dry_run) for root in self.roots]
+        if not dry_run:
+            self.last_reports = reports
+        return reports
+
+    def stats(self):
+        return {
+            'removed': self.removed,
+            'reclaimed_bytes': self.reclaimed_bytes,
+            'scanned': self.scanned,
+            'last_reports': self.last_reports,
+        }
+
+
+# Process wide janitor of the temp roots, run in the background with TEMP_JANITOR = {'background': True, ...}
+temp_janitor = TempJanitor()
@@ -0,0 +1,317 @@
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+__all__ = ['ZipStream', 'ZIP_DEFLATED', 'ZIP_STORED']
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+DATA_DESCRIPTOR = struct.Struct('<IIII')
+DATA_DESCRIPTOR64 = struct.Struct('<IIQQ')
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+CENTRAL_HEADER_SIGNATURE = 0x02014b50
+END_RECORD64 = struct.Struct('<IQHHIIQQQQ')
+END_RECORD64_SIGNATURE = 0x06064b50
+END_LOCATOR64 = struct.Struct('<IIQI')
+END_LOCATOR64_SIGNATURE = 0x07064b50
+END_RECORD = struct.Struct('<IHHHHIIH')
+END_RECORD_SIGNATURE = 0x06054b50
+ZIP64_EXTRA_ID = 0x0001
+
+# general purpose flags -- sizes & crc in the data descriptor, utf-8 names
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+# version made by -- unix attributes
+CREATE_SYSTEM_UNIX = 3
+
+
+class ZipEntry:
+    """
+    A file of the archive & its source: a file path, bytes like object, file like object or iterable of bytes
+    """
+    __slots__ = ('name', 'source', 'compression', 'compress_level', 'date_time', 'mode', 'size', 'zip64',
+                 'flags', 'crc', 'compressed_size', 'offset', 'future')
+
+    def __init__(self, name, source, compression, compress_level, date_time=None, mode=None, zip64=None):
+        self.name = name
+        self.source = source
+        self.compression = compression
+        self.compress_level = compress_level
+        self.mode = mode
+        self.size = None
+
+        if isinstance(source, (str, os.PathLike)):
+            stat = os.stat(source)
+            self.size = stat.st_size
+            date_time = date_time or time.localtime(stat.st_mtime)[:6]
+            self.mode = mode or stat.st_mode & 0o777
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            self.source = memoryview(source).cast('B')
+            self.size = self.source.nbytes
+        self.date_time = date_time or time.localtime()[:6]
+        self.mode = self.mode or 0o644
+
+        if zip64 is None and self.size is not None:
+            # deflate may grow incompressible data slightly
+            zip64 = self.size + (self.size >> 8) + 1024 >= ZIP64_LIMIT
+        self.zip64 = bool(zip64)
+
+        self.flags = FLAG_DATA_DESCRIPTOR
+        try:
+            name.encode('ascii')
+        except UnicodeEncodeError:
+            self.flags |= FLAG_UTF8
+        self.crc = 0
+        self.compressed_size = 0
+        self.offset = 0
+        self.future = None
+
+    @property
+    def encoded_name(self):
+        return self.name.encode('utf-8' if self.flags & FLAG_UTF8 else 'ascii')
+
+    @property
+    def version(self):
+        return 45 if self.zip64 else 20
+
+    @property
+    def dos_time(self):
+        year, month, day, hour, minute, second = self.date_time
+        year = min(max(year, 1980), 2107)
+        return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+    def iter_data(self, chunk_size):
+        """
+        Yield the uncompressed data of the source
+        """
+        source = self.source
+        if isinstance(source, memoryview):
+            for start in range(0, source.nbytes, chunk_size):
+                yield source[start:start + chunk_size]
+        elif isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as file_obj:
+                yield from iter(lambda: file_obj.read(chunk_size), b'')
+        elif hasattr(source, 'read'):
+            yield from iter(lambda: source.read(chunk_size), b'')
+        else:
+            for chunk in source:
+                if chunk:
+                    yield chunk
+
+    def compress(self, chunk_size):
+        """
+        Compress the whole entry -- for the thread pool
+        :return: (list of compressed chunks, crc, size)
+        """
+        compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -15)
+        chunks = []
+        crc = 0
+        size = 0
+        for chunk in self.iter_data(chunk_size):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            chunks.append(compressor.compress(chunk))
+        chunks.append(compressor.flush())
+        return chunks, crc, size
+
+    def local_header(self):
+        name = self.encoded_name
+        extra = b''
+        size_field = 0
+        if self.zip64:
+            # the sizes are in the data descriptor
+            extra = struct.pack('<HHQQ', ZIP64_EXTRA_ID, 16, 0, 0)
+            size_field = ZIP64_LIMIT
+        dos_time, dos_date = self.dos_time
+        return LOCAL_HEADER.pack(LOCAL_HEADER_SIGNATURE, self.version, self.flags, self.compression, dos_time,
+                                 dos_date, 0, size_field, size_field, len(name), len(extra)) + name + extra
+
+    def data_descriptor(self):
+        if self.zip64:
+            return DATA_DESCRIPTOR64.pack(DATA_DESCRIPTOR_SIGNATURE, self.crc, self.compressed_size, self.size)
+        return DATA_DESCRIPTOR.pack(DATA_DESCRIPTOR_SIGNATURE, self.crc, self.compressed_size, self.size)
+
+    def central_header(self):
+        name = self.encoded_name
+        zip64_values = []
+        size, compressed_size, offset = self.size, self.compressed_size, self.offset
+        if size >= ZIP64_LIMIT:
+            zip64_values.append(size)
+            size = ZIP64_LIMIT
+        if compressed_size >= ZIP64_LIMIT:
+            zip64_values.append(compressed_size)
+            compressed_size = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            zip64_values.append(offset)
+            offset = ZIP64_LIMIT
+        extra = b''
+        if zip64_values:
+            extra = struct.pack('<HH{}Q'.format(len(zip64_values)), ZIP64_EXTRA_ID, 8 * len(zip64_values),
+                                *zip64_values)
+        version = max(self.version, 45 if zip64_values else 20)
+        dos_time, dos_date = self.dos_time
+        return CENTRAL_HEADER.pack(
+            CENTRAL_HEADER_SIGNATURE, (CREATE_SYSTEM_UNIX << 8) | version, version, self.flags, self.compression,
+            dos_time, dos_date, self.crc, compressed_size, size, len(name), len(extra), 0, 0, 0,
+            (0o100000 | self.mode) << 16, offset) + name + extra
+
+
+class ZipStream:
+    """
+    Zip archive generated as it is read, without writing the archive or its files to disk:
+        archive = ZipStream()
+        archive.add('report.csv', csv_rows_generator)
+        archive.add('images/logo.png', '/path/to/logo.png', compression=ZIP_STORED)
+        return HttpOperations.streaming_zip_response(archive, 'export.zip')
+    Entries are written with data descriptors, so their sizes need not be known in advance, & as ZIP64 when they
+        (or the archive) grow beyond 4GB. Entries of unknown size (file objects & generators) are ZIP64 only with
+        force_zip64, as some unzip tools do not support ZIP64.
+    With workers, the deflated entries of known size of up to parallel_max_bytes are compressed ahead on a thread pool
+        (zlib releases the GIL); the memory used is then up to workers * parallel_max_bytes.
+    Iterating the ZipStream yields chunks of about chunk_size bytes & can be done once.
+    """
+    chunk_size = 64 * 1024
+    parallel_max_bytes = 16 * 1024 * 1024
+
+    def __init__(self, compression=ZIP_DEFLATED, compress_level=6, workers=0, force_zip64=False, chunk_size=None):
+        assert compression in (ZIP_STORED, ZIP_DEFLATED), 'Invalid compression {}'.format(compression)
+        self.compression = compression
+        self.compress_level = compress_level
+        self.workers = workers
+        self.force_zip64 = force_zip64
+        self.chunk_size = chunk_size or self.chunk_size
+        self.entries = []
+        self.offset = 0
+
+    def add(self, name, source, compression=None, compress_level=None, date_time=None, mode=None, zip64=None):
+        """
+        Add a file to the archive
+        :param name: the path of the file in the archive
+        :param source: the file path, bytes like object, file like object (read from its position) or iterable of
+            bytes
+        :param compression: ZIP_STORED or ZIP_DEFLATED. Default is the compression of the archive
+        :param compress_level: the zlib level for ZIP_DEFLATED. Default is the level of the archive
+        :param date_time: the modification time tuple (year, month, day, hour, minute, second). Default is the
+            modification time of the file path, or now
+        :param mode: the unix permissions. Default is those of the file path, or 0o644
+        :param zip64: write the entry as ZIP64. Default is by the size of the source; force_zip64 if not known
+        """
+        if zip64 is None and not isinstance(source, (str, os.PathLike, bytes, bytearray, memoryview)):
+            zip64 = self.force_zip64
+        self.entries.append(ZipEntry(
+            name, source, self.compression if compression is None else compression,
+            self.compress_level if compress_level is None else compress_level, date_time=date_time, mode=mode,
+            zip64=zip64))
+
+    def add_directory(self, directory, prefix='', **kwargs):
+        """
+        Add the files of the directory (recursively) with their paths relative to the directory under prefix
+        """
+        for root, directories, names in os.walk(directory):
+            directories.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                self.add(os.path.join(prefix, os.path.relpath(path, directory)).replace(os.sep, '/'), path, **kwargs)
+
+    def is_parallel(self, entry):
+        return (self.workers and entry.compression == ZIP_DEFLATED and entry.size is not None
+                and entry.size <= self.parallel_max_bytes)
+
+    def iter_entry(self, entry):
+        entry.offset = self.offset
+        yield entry.local_header()
+
+        if entry.future is not None:
+            chunks, entry.crc, size = entry.future.result()
+            entry.future = None
+            for chunk in chunks:
+                entry.compressed_size += len(chunk)
+                yield chunk
+        else:
+            compressor = zlib.compressobj(entry.compress_level, zlib.DEFLATED, -15) \
+                if entry.compression == ZIP_DEFLATED else None
+            size = 0
+            for chunk in entry.iter_data(self.chunk_size):
+                size += len(chunk)
+                entry.crc = zlib.crc32(chunk, entry.crc)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                entry.compressed_size += len(chunk)
+                yield chunk
+            if compressor is not None:
+                chunk = compressor.flush()
+                entry.compressed_size += len(chunk)
+                yield chunk
+
+        if entry.size is not None and size != entry.size:
+            raise ValueError('{} changed while being archived'.format(entry.name))
+        entry.size = size
+        if not entry.zip64 and (entry.size >= ZIP64_LIMIT or entry.compressed_size >= ZIP64_LIMIT):
+            raise ValueError('{} is larger than 4GB -- add it with zip64=True'.format(entry.name))
+        yield entry.data_descriptor()
+
+    def iter_central_directory(self):
+        start = self.offset
+        headers = [entry.central_header() for entry in self.entries]
+        yield from headers
+        size = sum(len(header) for header in headers)
+        count = len(self.entries)
+        if count >= ZIP_FILECOUNT_LIMIT or start >= ZIP64_LIMIT or size >= ZIP64_LIMIT:
+            end64_offset = start + size
+            yield END_RECORD64.pack(END_RECORD64_SIGNATURE, END_RECORD64.size - 12, 45, 45, 0, 0, count, count, size,
+                                    start)
+            yield END_LOCATOR64.pack(END_LOCATOR64_SIGNATURE, 0, end64_offset, 1)
+        yield END_RECORD.pack(END_RECORD_SIGNATURE, 0, 0, min(count, ZIP_FILECOUNT_LIMIT),
+                              min(count, ZIP_FILECOUNT_LIMIT), min(size, ZIP64_LIMIT), min(start, ZIP64_LIMIT), 0)
+
+    def iter_chunks(self):
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ZipStream') \
+            if self.workers else None
+        try:
+            for index, entry in enumerate(self.entries):
+                if executor is not None:
+                    # keep the next entries compressing
+                    for ahead in self.entries[index:index + self.workers + 1]:
+                        if ahead.future is None and self.is_parallel(ahead):
+                            ahead.future = executor.submit(ahead.compress, self.chunk_size)
+                for chunk in self.iter_entry(entry):
+                    self.offset += len(chunk)
+                    yield chunk
+            for chunk in self.iter_central_directory():
+                self.offset += len(chunk)
+                yield chunk
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def __iter__(self):
+        """
+        Yield the archive in chunks of about chunk_size bytes
+        """
+        buffer = bytearray()
+        for chunk in self.iter_chunks():
+            if not buffer and len(chunk) >= self.chunk_size:
+                yield bytes(chunk)
+                continue
+            buffer += chunk
+            if len(buffer) >= self.chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+    def write_to(self, file_obj):
+        """
+        Write the archive to the file object
+        :return: the size of the archive
+        """
+        for chunk in self:
+            file_obj.write(chunk)
+        return self.offset
@@ -42,11 +42,12 @@ THIRD_PARTY_APPS = [
     'rest_framework',
 ]
 CUSTOM_APPS = [
+    'common',
     'dummy_app',
 ]
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + CUSTOM_APPS
 
-MIDDLEWARE_CLASSES = [
+MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -108,6 +109,129 @@ STATIC_URL = '/static/'
 # Logging Configuration
 LOGGING_LOG_LEVEL = get_var('LOGGING_LOG_LEVEL', 'DEBUG')
 LOGGING_LOGS_ROOT = get_var('LOGGING_LOGS_ROOT', '/tmp/django_logs/')
+# Unix socket of the per host log collector (python manage.py run_log_collector). Empty to write from every process
+LOGGING_COLLECTOR_SOCKET = get_var('LOGGING_COLLECTOR_SOCKET', '') or None
+# Max records buffered per log file handler before the overflow policy (drop/block/sample) applies
+LOGGING_QUEUE_SIZE = int(get_var('LOGGING_QUEUE_SIZE', 10000))
+LOGGING_QUEUE_OVERFLOW = get_var('LOGGING_QUEUE_OVERFLOW', 'drop')
+# Rotated log files are compressed (gzip/zstd) in the background & kept up to the count, age & total size limits
+LOGGING_COMPRESSION = get_var('LOGGING_COMPRESSION', 'gzip') or None
+LOGGING_BACKUP_COUNT = int(get_var('LOGGING_BACKUP_COUNT', 30))
+LOGGING_MAX_AGE_DAYS = 90
+LOGGING_MAX_TOTAL_BYTES = 10 * 1024 ** 3
+# 'text' for the message type formats, 'json' for a single json object per log record in the log files
+LOGGING_MESSAGE_MODE = get_var('LOGGING_MESSAGE_MODE', 'text')
+LOGGING_FILE_FORMATTER = 'json' if LOGGING_MESSAGE_MODE == 'json' else 'verbose'
+# Import path of the serializer for the logged json data. By default orjson is used if installed
+LOGGING_JSON_SERIALIZER = None
+LOGGING_JSON_SORT_KEYS = False
+# Request latency histograms of the LoggingMiddleware. Every worker writes its snapshot to LOGGING_METRICS_DIR, which
+# is read by the /metrics/ url & the latency_report management command
+LOGGING_LATENCY_METRICS = True
+LOGGING_METRICS_DIR = os.path.join(LOGGING_LOGS_ROOT, 'metrics')
+LOGGING_METRICS_ALLOWED_IPS = ['127.0.0.1']
+# Seconds between the snapshots of a worker; the snapshots older than LOGGING_METRICS_MAX_AGE seconds are of exited
+# workers & skipped by the /metrics/ url
+LOGGING_METRICS_DUMP_INTERVAL = 10
+LOGGING_METRICS_MAX_AGE = 3 * LOGGING_METRICS_DUMP_INTERVAL
+# Request scoped traces of the LoggingMiddleware, timing the outbound http, s3 & db calls of every request. The finished
+# traces can be exported e.g. {'class': 'common.logging.tracing.FileTraceExporter', 'file_path': '/tmp/traces.log'}
+LOGGING_TRACING = True
+LOGGING_TRACE_EXPORTER = None
+# Log policies of the api actions of APILoggingMixin views -- level, rate_limit, burst, sample_rate, tail_errors &
+# tail_slow_seconds, keyed by module.Class.action (glob patterns allowed)
+LOGGING_API_POLICIES = {}
+# Limits for the request/response data logged by APILoggingMixin. Can be overridden per view by log_data_<key>
+LOGGING_API_DATA = {
+    'max_bytes': 10240,
+    'sample_rate': 1,
+    'content_types': [],
+    'skip_content_types': ['multipart/form-data', 'application/octet-stream'],
+    'errors_only': False,
+}
+
+# Shared sessions of LoggedRequests & PatchedRequests (common.utils.http_sessions.SessionRegistry kwargs)
+HTTP_SESSIONS = {
+    'pool_connections': 20,
+    'pool_maxsize': 10,
+    'pool_block': False,
+    'timeout': (3.05, 30),
+    'keep_alive': True,
+    'per_thread': False,
+    'hosts': {},
+}
+# Max bytes of the response content logged by LoggedRequests & PatchedRequests (None for all). Streamed responses are
+# logged as they are consumed, without buffering the content
+HTTP_LOG_RESPONSE_BYTES = 4096
+# Let the front server send the files of HttpOperations.downloadable_file e.g. {'header': 'X-Sendfile'} or
+# {'header': 'X-Accel-Redirect', 'root': '/tmp/', 'location': '/protected/'} for an nginx internal location
+HTTP_FILE_OFFLOAD = None
+# Bucket & credentials of common.utils.s3.S3Operations, & the default boto.connect_s3 kwargs -- e.g. {'host':
+# 'localhost', 'port': 9000, 'is_secure': False, 'calling_format': 'boto.s3.connection.OrdinaryCallingFormat'} for an
+# S3 compatible server
+BUCKET_NAME = os.environ.get('BUCKET_NAME', '')
+AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID', '')
+AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY', '')
+AWS_S3_CONNECTION = {}
+# Cache of the LoggedRequests.get responses (common.utils.http_cache.HTTPCache kwargs). shared_tier is None, 'django'
+# or 'disk'. Disabled by default -- enable per call with LoggedRequests.get(url, cache=True)
+HTTP_CACHE = {
+    'enabled': False,
+    'max_entries': 1000,
+    'max_bytes': 50 * 1024 * 1024,
+    'max_entry_bytes': 1024 * 1024,
+    'shared_tier': None,
+}
+# Cache of the HttpOperations.retrieve_image assets (common.utils.http_cache.AssetCache kwargs): in memory LRU & a
+# content addressed store in directory shared by the workers of the host (None for memory only), pruned every
+# prune_interval seconds on a background thread (None to prune with the prune_asset_cache management command only)
+ASSET_CACHE = {
+    'enabled': False,
+    'max_bytes': 100 * 1024 * 1024,
+    'max_entry_bytes': 10 * 1024 * 1024,
+    'directory': '/tmp/asset_cache',
+    'max_disk_bytes': 1024 * 1024 * 1024,
+    'max_age': 7 * 86400,
+    'default_ttl': 300,
+    'prune_interval': 300,
+}
+# Cleanup of the temp download & workspace directories (common.utils.temp_janitor.TempJanitor kwargs), every interval
+# seconds on a background thread with background=True, or with the clean_temp management command
+TEMP_JANITOR = {
+    'background': False,
+    'interval': 300,
+    'max_age': 86400,
+    'max_bytes': None,
+    'min_age': 60,
+}
+# Deadline budget in seconds of the outbound calls of every request (None for no budget, unless the caller sends the
+# X-Request-Budget-Ms header), & the retries, hedging & circuit breakers of the outbound calls
+# (common.utils.resilience.Resilience kwargs; 'default' & the 'hosts' values are CallPolicy kwargs)
+HTTP_REQUEST_BUDGET = None
+# The X-Request-Budget-Ms header is honored only from these networks of internal callers (none by default, e.g.
+# ['10.0.0.0/8']), & raised to HTTP_REQUEST_BUDGET_MIN seconds
+HTTP_REQUEST_BUDGET_TRUSTED_NETWORKS = []
+HTTP_REQUEST_BUDGET_MIN = 0.5
+HTTP_RESILIENCE = {
+    'enabled': False,
+    'default': {
+        'retries': 0,
+        'hedge': False,
+        'circuit_breaker': True,
+        'failure_threshold': 5,
+        'reset_timeout': 30,
+    },
+    'hosts': {},
+    # internal hosts (host or host:port) the X-Request-Budget-Ms header is sent to, none by default
+    'budget_hosts': [],
+}
+# Shared httpx clients of AsyncLoggedRequests (common.utils.http_sessions.AsyncSessionRegistry kwargs)
+HTTP_ASYNC_SESSIONS = {
+    'max_connections': 100,
+    'max_keepalive_connections': 20,
+    'keepalive_expiry': 5,
+    'timeout': (3.05, 30),
+}
 
 if not os.path.exists(LOGGING_LOGS_ROOT):
     os.makedirs(LOGGING_LOGS_ROOT)
@@ -132,6 +256,9 @@ LOGGING = {
             'format': '[%(asctime)s] %(levelname)s %(message)s',
             'datefmt': '%d/%b/%Y %H:%M:%S'
         },
+        'json': {
+            '()': 'common.logging.formatters.JSONFormatter',
+        },
     },
     'handlers': {
         'console': {
@@ -141,29 +268,57 @@ LOGGING = {
         },
         'project_logfile': {
             'level': 'DEBUG',
-            'class': 'logging.handlers.TimedRotatingFileHandler',
+            'class': 'common.logging.handlers.QueuedCompressingTimedRotatingFileHandler',
             'when': 'midnight',
+            'backupCount': LOGGING_BACKUP_COUNT,
+            'compression': LOGGING_COMPRESSION,
+            'max_age_days': LOGGING_MAX_AGE_DAYS,
+            'max_total_bytes': LOGGING_MAX_TOTAL_BYTES,
+            'queue_size': LOGGING_QUEUE_SIZE,
+            'overflow': LOGGING_QUEUE_OVERFLOW,
+            'collector_socket': LOGGING_COLLECTOR_SOCKET,
             'filename': os.path.join(LOGGING_LOGS_ROOT, 'project.log'),
-            'formatter': 'verbose',
+            'formatter': LOGGING_FILE_FORMATTER,
         },
         'dummy_app_logfile': {
             'level': 'DEBUG',
-            'class': 'logging.handlers.TimedRotatingFileHandler',
+            'class': 'common.logging.handlers.QueuedCompressingTimedRotatingFileHandler',
             'when': 'midnight',
+            'backupCount': LOGGING_BACKUP_COUNT,
+            'compression': LOGGING_COMPRESSION,
+            'max_age_days': LOGGING_MAX_AGE_DAYS,
+            'max_total_bytes': LOGGING_MAX_TOTAL_BYTES,
+            'queue_size': LOGGING_QUEUE_SIZE,
+            'overflow': LOGGING_QUEUE_OVERFLOW,
+            'collector_socket': LOGGING_COLLECTOR_SOCKET,
             'filename': os.path.join(LOGGING_LOGS_ROOT, 'dummy_app.log'),
-            'formatter': 'verbose',
+            'formatter': LOGGING_FILE_FORMATTER,
         },
         'error_logfile': {
             'level': 'ERROR',
-            'class': 'logging.handlers.TimedRotatingFileHandler',
+            'class': 'common.logging.handlers.QueuedCompressingTimedRotatingFileHandler',
             'when': 'midnight',
+            'backupCount': LOGGING_BACKUP_COUNT,
+            'compression': LOGGING_COMPRESSION,
+            'max_age_days': LOGGING_MAX_AGE_DAYS,
+            'max_total_bytes': LOGGING_MAX_TOTAL_BYTES,
+            'queue_size': LOGGING_QUEUE_SIZE,
+            'overflow': LOGGING_QUEUE_OVERFLOW,
+            'collector_socket': LOGGING_COLLECTOR_SOCKET,
             'filename': os.path.join(LOGGING_LOGS_ROOT, 'error.log'),
-            'formatter': 'verbose',
+            'formatter': LOGGING_FILE_FORMATTER,
         },
         'dba_logfile': {
             'level': 'DEBUG',
-            'class': 'logging.handlers.TimedRotatingFileHandler',
+            'class': 'common.logging.handlers.QueuedCompressingTimedRotatingFileHandler',
             'when': 'midnight',
+            'backupCount': LOGGING_BACKUP_COUNT,
+            'compression': LOGGING_COMPRESSION,
+            'max_age_days': LOGGING_MAX_AGE_DAYS,
+            'max_total_bytes': LOGGING_MAX_TOTAL_BYTES,
+            'queue_size': LOGGING_QUEUE_SIZE,
+            'overflow': LOGGING_QUEUE_OVERFLOW,
+            'collector_socket': LOGGING_COLLECTOR_SOCKET,
             'filename': os.path.join(LOGGING_LOGS_ROOT, 'dba.log'),
             'formatter': 'simple'
         },
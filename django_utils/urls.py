@@ -16,7 +16,10 @@ Including another URLconf
 from django.conf.urls import url, include
 from django.contrib import admin
 
+from common.logging.views import latency_metrics_view
+
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
+    url(r'^metrics/$', latency_metrics_view, name='latency_metrics'),
     url(r'^dummy/', include('dummy_app.urls')),
 ]